@@ -0,0 +1,235 @@
+"""
+两级缓存：进程内的 LRU 缓存 + 各进程共享的缓存（生产环境为 Redis，开发和测试时用 LocMemCache 代替）
+
+读取时先查进程内缓存，未命中再查共享缓存并把结果放入进程内缓存；写入和删除同时作用于两级。
+进程内缓存只保留很短的时间（FRONT_TIMEOUT），其它进程修改或删除的键最多在这段时间内读到旧值。
+计数、锁这类要求各进程读到同一个值的键，由使用它们的模块用 shared_only 声明前缀，只存放在共享缓存中。
+
+get_or_set 额外提供两项保护：
+- 单飞（single-flight）：键过期时只有拿到锁的进程重新计算，其余进程等待它的结果，而不是同时计算；
+- 概率提前重算：临近过期时按 XFetch 算法以逐渐增大的概率提前重算，计算越慢越早开始，
+  重算期间其它进程继续使用当前值，热点键不会在过期的一瞬间被所有进程同时重算。
+
+配置示例：
+
+    CACHES = {
+        "default": {
+            "BACKEND": "blog.cache_backends.TwoTierCache",
+            "OPTIONS": {"BACK": "shared", "FRONT_TIMEOUT": 5},
+        },
+        "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+"""
+import math
+import pickle
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .utils import LRUCache
+
+# get_or_set 写入的值连同计算耗时和过期时间一起保存，供提前重算使用
+CacheEntry = namedtuple("CacheEntry", ["value", "delta", "expires_at"])
+
+_MISSING = object()
+
+# DRF 的限流记录由各进程读出、追加后写回，必须读到最新的值
+_shared_only_prefixes = {"throttle_"}
+
+# 同一进程中各线程的缓存后端实例共用进程内缓存
+_fronts = {}
+_fronts_lock = threading.Lock()
+
+
+def shared_only(*prefixes):
+    """
+    声明以这些前缀开头的键只存放在共享缓存中，不放入进程内缓存
+    """
+    _shared_only_prefixes.update(prefixes)
+
+
+def unwrap(value):
+    return value.value if isinstance(value, CacheEntry) else value
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.back_alias = options.get("BACK", "shared")
+        self.front_timeout = options.get("FRONT_TIMEOUT", 5)
+        # 等待其它进程计算的最长时间，超过后自己计算，也是计算锁的过期时间
+        self.lock_timeout = options.get("LOCK_TIMEOUT", 10)
+        self.lock_poll_interval = options.get("LOCK_POLL_INTERVAL", 0.05)
+        # 提前重算的激进程度，越大越早开始重算，0 表示不提前重算
+        self.beta = options.get("BETA", 1.0)
+        with _fronts_lock:
+            if location not in _fronts:
+                # 条目是 (pickle 后的值, 过期时间)，按值的字节数计算占用
+                _fronts[location] = LRUCache(
+                    options.get("FRONT_MAX_BYTES", 16 * 1024 * 1024), sizeof=lambda stored: len(stored[0])
+                )
+            self.front = _fronts[location]
+
+    @property
+    def back(self):
+        return caches[self.back_alias]
+
+    def is_shared_only(self, key):
+        return any(key.startswith(prefix) for prefix in _shared_only_prefixes)
+
+    # 进程内缓存中保存 pickle 后的值和过期时间，取出时反序列化，调用方修改取出的对象不会影响缓存
+
+    def _front_get(self, key, version):
+        if self.is_shared_only(key):
+            return _MISSING
+        stored = self.front.get(self.make_key(key, version))
+        if stored is None:
+            return _MISSING
+        data, expires_at = stored
+        if expires_at <= time.time():
+            self.front.delete(self.make_key(key, version))
+            return _MISSING
+        return pickle.loads(data)
+
+    def _front_set(self, key, value, version, timeout=DEFAULT_TIMEOUT):
+        if self.is_shared_only(key):
+            return
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        expires_at = time.time() + (self.front_timeout if timeout is None else min(self.front_timeout, timeout))
+        if isinstance(value, CacheEntry) and value.expires_at is not None:
+            expires_at = min(expires_at, value.expires_at)
+        if expires_at <= time.time():
+            self._front_delete(key, version)
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.front.set(self.make_key(key, version), (data, expires_at))
+
+    def _front_delete(self, key, version):
+        self.front.delete(self.make_key(key, version))
+
+    def _get_raw(self, key, version):
+        value = self._front_get(key, version)
+        if value is _MISSING:
+            value = self.back.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                self._front_set(key, value, version)
+        return value
+
+    def get(self, key, default=None, version=None):
+        value = self._get_raw(key, version)
+        return default if value is _MISSING else unwrap(value)
+
+    def get_many(self, keys, version=None):
+        result = {}
+        missing = []
+        for key in keys:
+            value = self._front_get(key, version)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            fetched = self.back.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self._front_set(key, value, version)
+            result.update(fetched)
+        return {key: unwrap(value) for key, value in result.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.back.set(key, value, timeout=timeout, version=version)
+        self._front_set(key, value, version, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.back.set_many(data, timeout=timeout, version=version) or []
+        for key, value in data.items():
+            if key in failed:
+                self._front_delete(key, version)
+            else:
+                self._front_set(key, value, version, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.back.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._front_set(key, value, version, timeout)
+        else:
+            # 共享缓存中已有值，进程内的副本可能已经过期
+            self._front_delete(key, version)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        self._front_delete(key, version)
+        return self.back.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._front_delete(key, version)
+        return self.back.decr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._front_delete(key, version)
+        return self.back.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._front_delete(key, version)
+        return self.back.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._front_delete(key, version)
+        self.back.delete_many(keys, version=version)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def should_recompute(self, entry):
+        if entry.expires_at is None or not self.beta:
+            return False
+        # XFetch：-log(U) 服从指数分布，离过期越近、计算越慢，提前重算的概率越大
+        gap = -entry.delta * self.beta * math.log(1.0 - random.random())
+        return time.time() + gap >= entry.expires_at
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        返回缓存的值，没有时调用 default 计算并写入，同一时刻只有一个进程计算（default 不可调用时直接写入）
+
+        与 Django 自带的 get_or_set 不同，计算结果为 None 时也会缓存
+        """
+        value = self._get_raw(key, version)
+        if value is not _MISSING and not (isinstance(value, CacheEntry) and self.should_recompute(value)):
+            return unwrap(value)
+
+        lock_key = "%s:lock" % key
+        if self.back.add(lock_key, 1, timeout=self.lock_timeout, version=version):
+            try:
+                return self._compute(key, default, timeout, version)
+            finally:
+                self.back.delete(lock_key, version=version)
+        if value is not _MISSING:
+            # 其它进程正在提前重算，继续使用当前值
+            return unwrap(value)
+
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.lock_poll_interval)
+            value = self.back.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                self._front_set(key, value, version)
+                return unwrap(value)
+        # 计算的进程可能已经崩溃，不再等待
+        return self._compute(key, default, timeout, version)
+
+    def _compute(self, key, default, timeout, version):
+        start = time.time()
+        value = default() if callable(default) else default
+        delta = time.time() - start
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        expires_at = None if timeout is None else time.time() + timeout
+        self.set(key, CacheEntry(value, delta, expires_at), timeout, version)
+        return value
@@ -0,0 +1,100 @@
+"""
+条件请求（If-None-Match / If-Modified-Since）
+
+ETag 是返回内容的摘要，能直接取到内容时不需要再查询、序列化或者渲染 Markdown：
+- 文章列表和详情接口使用响应缓存（见 response_cache.cached_response）中的数据；
+- 订阅源使用缓存的 XML；
+- 文章页面和关于我使用取出的对象中的正文等字段，这些对象随后直接用于渲染。
+内容无论以什么方式被修改，只要返回的内容变了，ETag 就会改变。
+
+接口返回的阅读量、点赞数等计数一直在变化，参与计算就几乎不会命中，所以摘要按缓存中的数据计算，
+返回前填入的最新计数不参与计算，并使用弱 ETag：校验通过表示内容没有变化，其中的计数可能是旧的。
+"""
+import calendar
+import functools
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .utils import get_updated_at
+
+Validators = namedtuple("Validators", ["etag", "last_modified"])
+
+
+def content_digest(value):
+    """
+    返回内容的摘要，value 是 bytes，或者可以转换为 JSON 的数据（日期时间等按字符串处理）
+    """
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.md5(value).hexdigest()
+
+
+def make_validators(parts, timestamps):
+    """
+    parts 是决定响应内容的各个值（通常包括内容的摘要），timestamps 是内容所依赖的各项的修改时间（Unix 时间戳）
+    """
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return Validators('W/"%s"' % digest, max(timestamps) if timestamps else None)
+
+
+def updated_at_timestamp(key):
+    # utils.get_updated_at 记录的是 UTC 时间，保留微秒，同一秒内的修改也会改变 ETag
+    updated_at = get_updated_at(key)
+    return calendar.timegm(updated_at.timetuple()) + updated_at.microsecond / 1e6
+
+
+def not_modified(request, validators):
+    """
+    客户端缓存的版本仍然有效时返回 304 响应，否则返回 None
+    """
+    if validators is None or request.method not in ("GET", "HEAD"):
+        return None
+    # If-Modified-Since 只精确到秒，和响应头中的 Last-Modified 一样按整秒比较
+    last_modified = int(validators.last_modified) if validators.last_modified is not None else None
+    response = get_conditional_response(request, etag=validators.etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, validators)
+    return response
+
+
+def set_validators(response, validators):
+    if validators is None or response.status_code not in (200, 304):
+        return response
+    if not response.has_header("ETag"):
+        response["ETag"] = validators.etag
+    if validators.last_modified is None or response.has_header("Last-Modified"):
+        return response
+    # HTTP 日期精确到秒，向下取整，不能晚于实际的修改时间。修改发生在当前这一秒内时不返回 Last-Modified，
+    # 否则同一秒内的下一次修改按整秒比较会被当作没有修改，客户端只能用 ETag 校验（RFC 7232 2.2.2）
+    if int(validators.last_modified) < int(time.time()):
+        response["Last-Modified"] = http_date(int(validators.last_modified))
+    return response
+
+
+def conditional(validators, on_not_modified=None):
+    """
+    为视图方法加上条件请求的处理
+
+    validators(view, request) 返回 Validators，返回 None 时按普通请求处理（例如对象不存在，交给视图返回 404）；
+    on_not_modified(view) 在返回 304 前调用，例如累加阅读量。
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(view, request, *args, **kwargs):
+            current = validators(view, request) if request.method in ("GET", "HEAD") else None
+            response = not_modified(request, current)
+            if response is not None:
+                if on_not_modified is not None and response.status_code == 304:
+                    on_not_modified(view)
+                return response
+            return set_validators(func(view, request, *args, **kwargs), current)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,302 @@
+"""
+文章计数（阅读量、点赞数、评论数）
+
+计数存放在分片的计数表 PostCounter 中，每次计数随机更新一个分片，读取时把各分片相加并缓存。
+访问文章时阅读量不直接写数据库，而是先累加到缓存中，由后台定时器（或 flush_views 命令）
+批量写回计数表。读取阅读量时把尚未写回的增量加上，所以显示的阅读量总是最新的。
+
+分类和标签下的文章数存放在各自的 num_posts 字段中，在保存、删除文章和修改文章标签的同一个事务中增减，
+侧边栏和计数接口直接读取，不需要联表聚合。数量不一致时可以用 reconcile_num_posts 命令修复。
+"""
+import atexit
+import logging
+import random
+import threading
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count, F, Sum
+
+from . import metrics
+from .cache_backends import shared_only
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ("views", "like_count", "comment_count")
+
+
+class PostCounters:
+    """
+    分片计数表的读写
+
+    各分片之和按文章缓存，计数变化时删除对应文章的缓存。缓存设置了较短的过期时间，
+    即使删除缓存与并发读取交错写入了旧值，旧值也很快会过期。
+    """
+
+    key_prefix = "post_counters"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shards(self):
+        return getattr(settings, "POST_COUNTER_SHARDS", 8)
+
+    @property
+    def timeout(self):
+        return getattr(settings, "POST_COUNTER_CACHE_TIMEOUT", 60)
+
+    def make_key(self, pk):
+        return "%s:%s" % (self.key_prefix, pk)
+
+    def incr(self, pk, field, delta=1):
+        PostCounter = apps.get_model("blog", "PostCounter")
+        shard = random.randrange(self.shards)
+        updated = PostCounter.objects.filter(post_id=pk, shard=shard).update(
+            **{field: F(field) + delta}
+        )
+        if not updated:
+            # 分片按需创建
+            _, created = PostCounter.objects.get_or_create(
+                post_id=pk, shard=shard, defaults={field: delta}
+            )
+            if not created:
+                PostCounter.objects.filter(post_id=pk, shard=shard).update(
+                    **{field: F(field) + delta}
+                )
+        self.invalidate([pk])
+
+    def incr_many(self, deltas, field):
+        """
+        批量计数，deltas 为 {文章 id: 增量}，增量相同的文章合并成一条 UPDATE
+        """
+        if not deltas:
+            return
+        PostCounter = apps.get_model("blog", "PostCounter")
+        shard = random.randrange(self.shards)
+        with transaction.atomic():
+            PostCounter.objects.bulk_create(
+                [PostCounter(post_id=pk, shard=shard) for pk in deltas], ignore_conflicts=True
+            )
+            groups = defaultdict(list)
+            for pk, delta in deltas.items():
+                groups[delta].append(pk)
+            for delta, group in groups.items():
+                PostCounter.objects.filter(post_id__in=group, shard=shard).update(
+                    **{field: F(field) + delta}
+                )
+        self.invalidate(deltas)
+
+    def get(self, pk):
+        return self.get_many([pk])[pk]
+
+    def get_many(self, pks):
+        """
+        返回 {文章 id: {"views": ..., "like_count": ..., "comment_count": ...}}
+        """
+        keys = {self.make_key(pk): pk for pk in pks}
+        result = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+        self.hits += len(result)
+        missing = [pk for pk in keys.values() if pk not in result]
+        if missing:
+            self.misses += len(missing)
+            PostCounter = apps.get_model("blog", "PostCounter")
+            fetched = {pk: dict.fromkeys(COUNTER_FIELDS, 0) for pk in missing}
+            rows = (
+                PostCounter.objects.filter(post_id__in=missing)
+                .values("post_id")
+                .annotate(**{field: Sum(field) for field in COUNTER_FIELDS})
+            )
+            for row in rows:
+                fetched[row.pop("post_id")] = row
+            cache.set_many(
+                {self.make_key(pk): counts for pk, counts in fetched.items()}, self.timeout
+            )
+            result.update(fetched)
+        return result
+
+    def invalidate(self, pks):
+        cache.delete_many([self.make_key(pk) for pk in pks])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ViewCounter:
+    """
+    写缓冲的阅读量计数器
+
+    增量以 cache.incr 原子地累加，写回时先读出增量再用 cache.decr 减去已写回的部分，
+    写回期间新增的访问不会丢失。多个进程同时写回时用缓存中的锁保证同一时刻只有一个进程在写。
+    """
+
+    key_prefix = "post_views_pending"
+    lock_key = "post_views_flush_lock"
+    lock_timeout = 5 * 60
+
+    def __init__(self):
+        # 当前进程累加过的文章，定时器只需要写回这些文章
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._timer = None
+        self.increments = 0
+        self.flushed = 0
+
+    def make_key(self, pk):
+        return "%s:%s" % (self.key_prefix, pk)
+
+    def incr(self, pk, delta=1):
+        key = self.make_key(pk)
+        # 增量在写回之前不能过期
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # add 与 incr 之间键被淘汰了
+            cache.set(key, delta, timeout=None)
+        with self._lock:
+            self.increments += 1
+            self._dirty.add(pk)
+            self._schedule_flush()
+
+    def pending(self, pk):
+        return cache.get(self.make_key(pk), 0)
+
+    def pending_many(self, pks):
+        keys = {self.make_key(pk): pk for pk in pks}
+        return {keys[key]: value for key, value in cache.get_many(list(keys)).items() if value}
+
+    def flush(self, pks):
+        """
+        把指定文章的增量写回数据库，返回写回的阅读量总数；其它进程正在写回时返回 None
+        """
+        if not cache.add(self.lock_key, 1, timeout=self.lock_timeout):
+            return None
+        try:
+            pending = self.pending_many(pks)
+            post_counters.incr_many(pending, "views")
+            for pk, delta in pending.items():
+                cache.decr(self.make_key(pk), delta)
+        finally:
+            cache.delete(self.lock_key)
+        total = sum(pending.values())
+        self.flushed += total
+        return total
+
+    def flush_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        total = None
+        try:
+            total = self.flush(dirty)
+        finally:
+            if total is None:
+                # 写回失败或者其它进程正在写回时保留这些文章，下次再试
+                with self._lock:
+                    self._dirty |= dirty
+                    self._schedule_flush()
+        return total
+
+    def _schedule_flush(self):
+        interval = getattr(settings, "VIEW_COUNT_FLUSH_INTERVAL", 30)
+        if interval <= 0 or self._timer is not None:
+            return
+        self._timer = threading.Timer(interval, self._flush_and_close)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_and_close(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush_dirty()
+        except Exception:
+            logger.exception("写回阅读量失败")
+        finally:
+            # 定时器线程使用的数据库连接不会被请求结束时的信号关闭，需要手动关闭
+            connections.close_all()
+
+    def stats(self):
+        return {
+            "increments": self.increments,
+            "flushed": self.flushed,
+            "dirty_posts": len(self._dirty),
+        }
+
+
+def prefetch_counts(posts):
+    """
+    一次性取出多篇文章的计数和尚未写回的阅读量，避免序列化列表时每篇文章各查一次
+    """
+    pks = [post.pk for post in posts]
+    counts = post_counters.get_many(pks)
+    pending = view_counter.pending_many(pks)
+    for post in posts:
+        post._counts = counts[post.pk]
+        post._pending_views = pending.get(post.pk, 0)
+
+
+def fill_counts(items):
+    """
+    把最新的计数填入已经序列化的文章数据（例如从响应缓存中取出的数据）
+    """
+    pks = [item["id"] for item in items]
+    counts = post_counters.get_many(pks)
+    pending = view_counter.pending_many(pks)
+    for item in items:
+        item_counts = counts[item["id"]]
+        item["views"] = item_counts["views"] + pending.get(item["id"], 0)
+        item["like_count"] = item_counts["like_count"]
+        item["comment_count"] = item_counts["comment_count"]
+
+
+def adjust_num_posts(model, deltas):
+    """
+    按 {pk: 增量} 修改分类或标签的 num_posts，增量相同的记录用一条 UPDATE 完成
+    """
+    groups = defaultdict(list)
+    for pk, delta in Counter(deltas).items():
+        if pk is not None and delta:
+            groups[delta].append(pk)
+    for delta, pks in groups.items():
+        model._default_manager.filter(pk__in=pks).update(num_posts=F("num_posts") + delta)
+
+
+def reconcile_num_posts(model, dry_run=False, batch_size=500):
+    """
+    按文章表重新统计分类或标签的文章数，修复 num_posts，返回数量不一致的记录及其原来的数量
+
+    也供数据迁移使用（model 是迁移中的历史模型）
+    """
+    drifted = []
+    for obj in model._default_manager.annotate(actual=Count("post")).order_by("pk"):
+        if obj.num_posts != obj.actual:
+            drifted.append((obj, obj.num_posts))
+            obj.num_posts = obj.actual
+    if drifted and not dry_run:
+        model._default_manager.bulk_update(
+            [obj for obj, _ in drifted], ["num_posts"], batch_size=batch_size
+        )
+    return drifted
+
+
+post_counters = PostCounters()
+metrics.register("post_counters", post_counters.stats)
+
+view_counter = ViewCounter()
+# 增量和写回锁由各进程共同读写，不能读到进程内缓存中的旧值
+shared_only(ViewCounter.key_prefix, ViewCounter.lock_key)
+metrics.register("view_counter", view_counter.stats)
+# 进程退出前写回尚未写回的阅读量
+atexit.register(view_counter._flush_and_close)
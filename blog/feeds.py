@@ -1,5 +1,10 @@
+import hashlib
+
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import HttpResponse
 
+from .conditional import content_digest, make_validators, not_modified, set_validators, updated_at_timestamp
 from .models import Post
 
 
@@ -13,9 +18,32 @@ class AllPostsRssFeed(Feed):
     # 显示在聚合阅读器上的描述信息
     description = "HelloDjango-blog-tutorial 全部文章"
 
+    # 生成的 XML 的缓存时间，正文被直接改写（不更新 post_updated_at）时最多这么久之后能看到
+    cache_timeout = 5 * 60
+
+    def __call__(self, request, *args, **kwargs):
+        # 文章、分类、标签的增删改都会更新 post_updated_at，生成的 XML 按它缓存，
+        # ETag 是 XML 的摘要，订阅源没有变化时返回 304
+        timestamp = updated_at_timestamp("post_updated_at")
+        key = "rss:%.6f:%s" % (timestamp, hashlib.md5(request.build_absolute_uri().encode("utf-8")).hexdigest())
+        cached = cache.get(key)
+        if cached is None:
+            response = super().__call__(request, *args, **kwargs)
+            cached = (response.content, response["Content-Type"])
+            cache.set(key, cached, self.cache_timeout)
+        content, content_type = cached
+        validators = make_validators([content_digest(content)], [timestamp])
+        response = not_modified(request, validators)
+        if response is None:
+            response = set_validators(HttpResponse(content, content_type=content_type), validators)
+        return response
+
     # 需要显示的内容条目
     def items(self):
-        return Post.objects.all()
+        # 标题中用到了分类，一次查出来；描述用的是渲染好的 body_html，不取出 Markdown 正文
+        return Post.objects.select_related("category").only(
+            "id", "title", "body_html", "category__name"
+        )
 
     # 聚合器中显示的内容条目的标题
     def item_title(self, item):
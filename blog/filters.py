@@ -1,14 +1,19 @@
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django_filters import rest_framework as drf_filters
+from rest_framework.filters import OrderingFilter
 
-from .models import Category, Post, Tag
+from .counters import COUNTER_FIELDS
+from .models import Category, Post, PostCounter, Tag
+from .utils import date_range
 
 
 class PostFilter(drf_filters.FilterSet):
     created_year = drf_filters.NumberFilter(
-        field_name="created_time", lookup_expr="year", help_text="根据文章发表年份过滤文章列表。"
+        method="filter_created_year", help_text="根据文章发表年份过滤文章列表。"
     )
     created_month = drf_filters.NumberFilter(
-        field_name="created_time", lookup_expr="month", help_text="根据文章发表月份过滤文章列表。"
+        method="filter_created_month", help_text="根据文章发表月份过滤文章列表。"
     )
     category = drf_filters.ModelChoiceFilter(
         queryset=Category.objects.all(),
@@ -22,3 +27,60 @@ class PostFilter(drf_filters.FilterSet):
     class Meta:
         model = Post
         fields = ["category", "tags", "created_year", "created_month"]
+
+    def filter_created_year(self, queryset, name, value):
+        # 年份和月份合并成一个时间范围过滤，可以使用 created_time 上的索引
+        month = self.form.cleaned_data.get("created_month")
+        try:
+            start, end = date_range(int(value), int(month) if month is not None else None)
+        except ValueError:
+            return queryset.none()
+        return queryset.filter(created_time__gte=start, created_time__lt=end)
+
+    def filter_created_month(self, queryset, name, value):
+        if self.form.cleaned_data.get("created_year") is not None:
+            # 已经在 filter_created_year 中一起过滤了
+            return queryset
+        # 只有月份时无法表示成一个时间范围
+        return queryset.filter(created_time__month=value)
+
+
+class CounterOrderingFilter(OrderingFilter):
+    """
+    支持按计数（阅读量、点赞数、评论数）排序的 OrderingFilter
+
+    计数存放在分片计数表中，排序时用子查询把各分片之和注解到文章上再排序，
+    只有请求了按计数排序时才会注解。按阅读量排序时不包括尚未写回数据库的阅读量。
+    """
+
+    def get_ordering(self, request, queryset, view):
+        # 计数字段替换为注解的别名，游标分页也使用这里返回的排序
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        terms = []
+        for term in ordering:
+            name = term.lstrip("-")
+            if name in COUNTER_FIELDS:
+                term = term.replace(name, "%s_total" % name)
+            terms.append(term)
+        return terms
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+
+        annotations = {}
+        for term in ordering:
+            alias = term.lstrip("-")
+            name = alias[: -len("_total")]
+            if alias.endswith("_total") and name in COUNTER_FIELDS:
+                totals = (
+                    PostCounter.objects.filter(post=OuterRef("pk"))
+                    .values("post")
+                    .annotate(total=Sum(name))
+                    .values("total")
+                )
+                annotations[alias] = Coalesce(Subquery(totals), 0)
+        return queryset.annotate(**annotations).order_by(*ordering)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import view_counter
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = "把缓存中尚未写回的阅读量写回数据库（可由 cron 定时执行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="每批检查的文章数量"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pks = list(Post.objects.order_by("pk").values_list("pk", flat=True))
+        total = 0
+        for i in range(0, len(pks), batch_size):
+            flushed = view_counter.flush(pks[i:i + batch_size])
+            if flushed is None:
+                self.stdout.write(self.style.WARNING("其它进程正在写回阅读量，请稍后再试"))
+                return
+            total += flushed
+        self.stdout.write(self.style.SUCCESS("已写回 %d 次阅读" % total))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import reconcile_num_posts
+from blog.models import Category, Tag, change_post_updated_at
+from blog.response_cache import response_cache
+
+
+class Command(BaseCommand):
+    help = "按文章表重新统计分类和标签下的文章数，修复 num_posts 字段（可由 cron 定时执行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="只列出数量不一致的分类和标签，不写回数据库"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="每批写回数据库的记录数量"
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        total = 0
+        for model in (Category, Tag):
+            drifted = reconcile_num_posts(model, dry_run=dry_run, batch_size=options["batch_size"])
+            if drifted and not dry_run:
+                # bulk_update 不发送信号，计数接口的响应缓存和侧边栏（依赖 post_updated_at）需要手动失效
+                response_cache.invalidate("%s:list" % model._meta.model_name)
+                change_post_updated_at()
+            for obj, num_posts in drifted:
+                self.stdout.write(
+                    "%s「%s」：%d -> %d" % (model._meta.verbose_name, obj.name, num_posts, obj.num_posts)
+                )
+            total += len(drifted)
+        if dry_run:
+            self.stdout.write(self.style.WARNING("共 %d 条记录的文章数不一致" % total))
+        else:
+            self.stdout.write(self.style.SUCCESS("已修复 %d 条记录的文章数" % total))
@@ -0,0 +1,196 @@
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from blog.models import About, Post, change_post_updated_at
+from blog.rendering import generate_rich_contents, render_cache
+from blog.response_cache import response_cache
+
+
+class SerialExecutor:
+    """
+    --workers 1 时使用，在当前进程中直接渲染，接口与 ProcessPoolExecutor 一致
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Command(BaseCommand):
+    help = "重新渲染文章正文，回填 body_html、toc 和 excerpt 字段，并预热关于页面的渲染缓存"
+    fields = ["body_html", "toc", "excerpt"]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--missing-only",
+            action="store_true",
+            help="只渲染还没有 body_html 的文章（例如新增字段后的存量数据）",
+        )
+        parser.add_argument(
+            "--since", help="只渲染在该时间之后修改过的内容，例如 2020-10-01 或 2020-10-01T08:00:00"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100, help="每批渲染并写回数据库的文章数量"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1, help="渲染进程数，1 表示在当前进程中渲染"
+        )
+        parser.add_argument(
+            "--use-cache",
+            action="store_true",
+            help="使用已有的渲染缓存（例如只是回填 body_html 时），默认不读取缓存，全部重新渲染",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="断点文件路径，每写回一批记录一次进度，中断后使用相同参数重新执行会从断点继续",
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        self.workers = options["workers"]
+        self.use_cache = options["use_cache"]
+        if self.batch_size < 1 or self.workers < 1:
+            raise CommandError("--batch-size 和 --workers 必须大于 0")
+
+        since = self.parse_since(options["since"])
+        self.checkpoint_path = options["checkpoint"]
+        self.checkpoint_options = {"since": options["since"], "missing_only": options["missing_only"]}
+        last_pk = self.load_checkpoint()
+
+        queryset = Post.objects.order_by("pk")
+        if options["missing_only"]:
+            queryset = queryset.filter(body_html="")
+        if since is not None:
+            queryset = queryset.filter(modified_time__gte=since)
+
+        with self.executor() as executor:
+            total = self.rerender_posts(executor, queryset, last_pk)
+            # 关于页面不存储渲染结果，重新渲染后写入渲染缓存，访问时直接命中
+            about_total = 0
+            if not options["missing_only"]:
+                abouts = About.objects.order_by("pk")
+                if since is not None:
+                    abouts = abouts.filter(modified_time__gte=since)
+                about_total = self.rerender_abouts(executor, abouts)
+
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(
+            self.style.SUCCESS("已重新渲染 %d 篇文章，%d 个关于页面" % (total, about_total))
+        )
+
+    def parse_since(self, value):
+        if value is None:
+            return None
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError("无法解析 --since 的值：%s" % value)
+            since = timezone.datetime(date.year, date.month, date.day)
+        if settings.USE_TZ and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def executor(self):
+        if self.workers == 1:
+            return SerialExecutor()
+        # 使用 spawn 启动子进程，子进程不会继承父进程的数据库连接；
+        # 子进程只负责渲染，不访问数据库，启动时初始化 Django 即可
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        )
+
+    def chunks(self, queryset, last_pk):
+        """
+        按主键分批读取文章，每次只取一批的 id 和正文，不会一次性把全部文章读入内存
+        """
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).values_list("pk", "body")[: self.batch_size]
+            )
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1][0]
+
+    def rerender_posts(self, executor, queryset, last_pk):
+        # 同时在渲染中的批次数有上限，并且按提交顺序写回数据库，
+        # 这样断点之前的文章一定都已写回，从断点继续时不会遗漏
+        pending = deque()
+        total = 0
+        for chunk in self.chunks(queryset, last_pk):
+            pks = [pk for pk, _ in chunk]
+            pending.append((pks, executor.submit(generate_rich_contents, [body for _, body in chunk], self.use_cache)))
+            if len(pending) >= self.workers * 2:
+                total += self.write_back(*pending.popleft())
+        while pending:
+            total += self.write_back(*pending.popleft())
+        return total
+
+    def write_back(self, pks, future):
+        posts = []
+        for pk, rich_content in zip(pks, future.result()):
+            post = Post(pk=pk)
+            post.set_rich_content(rich_content)
+            posts.append(post)
+        # 直接 bulk_update 渲染结果，不走 Post.save，避免修改 modified_time
+        Post.objects.bulk_update(posts, self.fields)
+        # bulk_update 不发送信号，接口响应缓存和依赖 post_updated_at 的缓存（侧边栏、归档、条件请求）需要手动失效
+        response_cache.invalidate("post:list", *["post:%s" % pk for pk in pks])
+        change_post_updated_at()
+        self.save_checkpoint(pks[-1])
+        if self.verbosity > 1:
+            self.stdout.write("已渲染到 id=%d 的文章" % pks[-1])
+        return len(posts)
+
+    def rerender_abouts(self, executor, queryset):
+        bodies = list(queryset.values_list("body", flat=True))
+        if not bodies:
+            return 0
+        for body, rich_content in zip(bodies, executor.submit(generate_rich_contents, bodies, self.use_cache).result()):
+            render_cache.set(render_cache.make_key(body), rich_content)
+        return len(bodies)
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint["options"] != self.checkpoint_options:
+            raise CommandError(
+                "断点文件 %s 是用不同的参数生成的，请使用相同的参数或删除该文件" % self.checkpoint_path
+            )
+        self.stdout.write("从断点继续：id=%d 之后的文章" % checkpoint["last_pk"])
+        return checkpoint["last_pk"]
+
+    def save_checkpoint(self, last_pk):
+        if not self.checkpoint_path:
+            return
+        # 先写临时文件再替换，中断时也不会留下写了一半的断点文件
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_pk": last_pk, "options": self.checkpoint_options}, f)
+        os.replace(tmp_path, self.checkpoint_path)
@@ -0,0 +1,200 @@
+"""
+函数结果缓存
+
+    @memoize("blog.archive", timeout=24 * 60 * 60, depends_on=["post_updated_at"])
+    def get_archive(year=None):
+        ...
+
+缓存键由命名空间、版本号和参数的摘要组成：
+- 参数先按函数签名绑定到参数名上并补上默认值，f(1) 和 f(year=1) 得到同样的键，省略有默认值的参数也一样；
+- 再转换为 JSON 计算摘要，只支持基本类型、列表、字典、集合、日期时间和模型实例（按主键），
+  不会像 repr 那样把对象的内存地址带进键里，不同进程、重启前后对同样的参数得到同样的键；
+- 版本号由命名空间自己的更新时间和 depends_on 中各项的更新时间（见 utils.get_updated_at）组成，
+  调用 bump() 或者依赖的更新时间改变后，旧的缓存不再被读到，等待过期淘汰。
+
+结果为 None 时按 negative_timeout 缓存，查不到的数据不会每次都去查数据库，又能较快地看到新数据。
+设置了 stale_timeout 时，超过 timeout 但未超过 timeout + stale_timeout 的结果仍然会返回，
+同时在后台线程中重新计算（同一时刻只有一个进程重算），调用方不必等待计算。
+"""
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections, models
+
+from . import metrics
+from .cache_backends import shared_only
+from .utils import get_updated_at
+
+logger = logging.getLogger(__name__)
+
+MemoEntry = namedtuple("MemoEntry", ["value", "fresh_until", "stale_until"])
+
+_registry = {}
+
+
+def normalize(value):
+    """
+    把参数转换为可以稳定序列化为 JSON 的结构，无法转换时抛出 TypeError
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((normalize(item) for item in value), key=dump)
+    if isinstance(value, dict):
+        # 键保留原来的类型，{1: x} 和 {"1": x} 是不同的参数
+        return {"dict": sorted(([normalize(key), normalize(item)] for key, item in value.items()), key=dump)}
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, models.Model):
+        return [value._meta.label_lower, value.pk]
+    raise TypeError("无法为 %s 类型的参数生成稳定的缓存键" % type(value).__name__)
+
+
+def dump(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def stable_hash(value):
+    return hashlib.sha1(dump(normalize(value)).encode("utf-8")).hexdigest()
+
+
+class Memoized:
+    key_prefix = "memo"
+    version_prefix = "memo_version"
+
+    def __init__(self, func, namespace, timeout, negative_timeout, stale_timeout, depends_on):
+        self.func = func
+        self.namespace = namespace
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.stale_timeout = stale_timeout
+        self.depends_on = tuple(depends_on)
+        self.signature = inspect.signature(func)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.latency = 0.0
+        self.computes = 0
+        self.compute_time = 0.0
+        self._refresh_thread = None
+        functools.update_wrapper(self, func)
+
+    @property
+    def version_key(self):
+        return "%s:%s" % (self.version_prefix, self.namespace)
+
+    def version(self):
+        keys = (self.version_key,) + self.depends_on
+        return "-".join("%.6f" % get_updated_at(key).timestamp() for key in keys)
+
+    def make_key(self, args, kwargs):
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        return "%s:%s:%s:%s" % (self.key_prefix, self.namespace, self.version(), stable_hash(arguments))
+
+    def bump(self):
+        """
+        使这个命名空间下已有的缓存全部失效
+        """
+        cache.set(self.version_key, datetime.datetime.utcnow(), None)
+
+    def __call__(self, *args, **kwargs):
+        start = time.time()
+        key = self.make_key(args, kwargs)
+        entry = cache.get(key)
+        if entry is not None and start < entry.fresh_until:
+            self.hits += 1
+        elif entry is not None and start < entry.stale_until:
+            self.stale_hits += 1
+            self.refresh_in_background(key, args, kwargs)
+        else:
+            self.misses += 1
+            if entry is not None:
+                # 已经超出可以返回旧值的时间，不能让 get_or_set 直接返回它
+                cache.delete(key)
+            entry = cache.get_or_set(key, lambda: self.compute(args, kwargs), self.max_timeout)
+        self.latency += time.time() - start
+        return entry.value
+
+    @property
+    def max_timeout(self):
+        return max(self.timeout, self.negative_timeout) + self.stale_timeout
+
+    def compute(self, args, kwargs):
+        start = time.time()
+        value = self.func(*args, **kwargs)
+        now = time.time()
+        self.computes += 1
+        self.compute_time += now - start
+        fresh_until = now + (self.negative_timeout if value is None else self.timeout)
+        return MemoEntry(value, fresh_until, fresh_until + self.stale_timeout)
+
+    def refresh_in_background(self, key, args, kwargs):
+        lock_key = "%s:refresh" % key
+        if not cache.add(lock_key, 1, timeout=max(self.stale_timeout, 1)):
+            return
+        thread = threading.Thread(target=self._refresh, args=(key, lock_key, args, kwargs), daemon=True)
+        self._refresh_thread = thread
+        thread.start()
+
+    def _refresh(self, key, lock_key, args, kwargs):
+        try:
+            cache.set(key, self.compute(args, kwargs), self.max_timeout)
+        except Exception:
+            logger.exception("重新计算 %s 的缓存失败", self.namespace)
+        finally:
+            cache.delete(lock_key)
+            # 后台线程使用的数据库连接不会被请求结束时的信号关闭，需要手动关闭
+            connections.close_all()
+
+    def stats(self):
+        calls = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / calls if calls else 0.0,
+            "avg_latency_ms": self.latency * 1000 / calls if calls else 0.0,
+            "avg_compute_ms": self.compute_time * 1000 / self.computes if self.computes else 0.0,
+        }
+
+
+def memoize(namespace, timeout=5 * 60, negative_timeout=60, stale_timeout=0, depends_on=()):
+    """
+    缓存函数的结果，namespace 在项目内必须唯一
+
+    timeout 是结果的有效期，negative_timeout 是结果为 None 时的有效期，stale_timeout 是过期后
+    仍可返回旧值（同时在后台重算）的时间，depends_on 是结果所依赖的更新时间的键
+    """
+
+    def decorator(func):
+        if namespace in _registry:
+            raise ValueError("缓存命名空间 %s 已被 %r 使用" % (namespace, _registry[namespace].func))
+        memoized = Memoized(func, namespace, timeout, negative_timeout, stale_timeout, depends_on)
+        _registry[namespace] = memoized
+        return memoized
+
+    return decorator
+
+
+def stats():
+    return {namespace: memoized.stats() for namespace, memoized in sorted(_registry.items())}
+
+
+# bump() 之后各进程都要立即使用新的版本号
+shared_only(Memoized.version_prefix)
+metrics.register("memoize", stats)
@@ -0,0 +1,20 @@
+"""
+运行时指标
+
+各模块把自己的统计函数（例如缓存命中数）注册到这里，由 MetricsViewSet 统一输出，方便监控系统抓取。
+注意这些统计都是进程级的，每个 gunicorn worker 各自计数。
+"""
+import os
+
+_collectors = {}
+
+
+def register(name, collector):
+    _collectors[name] = collector
+
+
+def collect():
+    data = {"pid": os.getpid()}
+    for name, collector in _collectors.items():
+        data[name] = collector()
+    return data
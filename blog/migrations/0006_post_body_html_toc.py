@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-17 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_treehole'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='正文 HTML'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='toc',
+            field=models.TextField(blank=True, editable=False, verbose_name='文章目录'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 3.2.3 on 2026-10-17 03:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_counts_to_counters(apps, schema_editor):
+    # 已有的计数存入每篇文章的 0 号分片，其它分片在计数时按需创建
+    Post = apps.get_model("blog", "Post")
+    PostCounter = apps.get_model("blog", "PostCounter")
+    PostCounter.objects.bulk_create(
+        [
+            PostCounter(
+                post_id=post["id"],
+                shard=0,
+                views=post["views"],
+                like_count=post["like_count"],
+                comment_count=post["comment_count"],
+            )
+            for post in Post.objects.values("id", "views", "like_count", "comment_count").iterator()
+        ],
+        batch_size=500,
+    )
+
+
+def copy_counters_to_counts(apps, schema_editor):
+    Post = apps.get_model("blog", "Post")
+    PostCounter = apps.get_model("blog", "PostCounter")
+    rows = PostCounter.objects.values("post_id").annotate(
+        views_total=models.Sum("views"),
+        like_count_total=models.Sum("like_count"),
+        comment_count_total=models.Sum("comment_count"),
+    )
+    for row in rows.iterator():
+        Post.objects.filter(pk=row["post_id"]).update(
+            views=row["views_total"],
+            like_count=row["like_count_total"],
+            comment_count=row["comment_count_total"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_body_html_toc'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='分片')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='阅读量')),
+                ('like_count', models.IntegerField(default=0, verbose_name='点赞数')),
+                ('comment_count', models.IntegerField(default=0, verbose_name='评论数')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='blog.post', verbose_name='文章')),
+            ],
+            options={
+                'verbose_name': '文章计数',
+                'verbose_name_plural': '文章计数',
+                'unique_together': {('post', 'shard')},
+            },
+        ),
+        migrations.RunPython(copy_counts_to_counters, copy_counters_to_counts),
+        migrations.RemoveField(
+            model_name='post',
+            name='comment_count',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='like_count',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='views',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-17 03:13
+
+from django.db import migrations, models
+
+from blog.threads import backfill_paths
+
+
+def backfill_treehole_paths(apps, schema_editor):
+    backfill_paths(apps.get_model("blog", "TreeHole"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_postcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treehole',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='深度'),
+        ),
+        migrations.AddField(
+            model_name='treehole',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=180, verbose_name='路径'),
+        ),
+        migrations.RunPython(backfill_treehole_paths, migrations.RunPython.noop),
+    ]
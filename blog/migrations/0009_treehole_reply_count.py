@@ -0,0 +1,25 @@
+# Generated by Django 3.2.3 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+from blog.threads import backfill_reply_counts
+
+
+def backfill_treehole_reply_counts(apps, schema_editor):
+    backfill_reply_counts(apps.get_model("blog", "TreeHole"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_treehole_path_depth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treehole',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='回复数'),
+        ),
+        migrations.RunPython(backfill_treehole_reply_counts, migrations.RunPython.noop),
+    ]
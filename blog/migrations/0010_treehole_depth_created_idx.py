@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_treehole_reply_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treehole',
+            index=models.Index(fields=['depth', 'created_time'], name='treehole_depth_created_idx'),
+        ),
+    ]
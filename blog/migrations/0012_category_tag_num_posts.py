@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-17 09:10
+
+from django.db import migrations, models
+
+from blog.counters import reconcile_num_posts
+
+
+def backfill_num_posts(apps, schema_editor):
+    reconcile_num_posts(apps.get_model("blog", "Category"))
+    reconcile_num_posts(apps.get_model("blog", "Tag"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='num_posts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='num_posts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数'),
+        ),
+        migrations.RunPython(backfill_num_posts, migrations.RunPython.noop),
+    ]
@@ -1,35 +1,22 @@
 from abc import abstractmethod
+from collections import Counter
 
-import re
 from datetime import datetime
 
-import markdown
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.db import models
-from django.db.models.signals import post_delete, post_save
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
-from django.utils.html import strip_tags
-from django.utils.text import slugify
-from markdown.extensions.toc import TocExtension
 from mdeditor.fields import MDTextField
 
-
-def generate_rich_content(value):
-    md = markdown.Markdown(
-        extensions=[
-            "markdown.extensions.extra",
-            "markdown.extensions.codehilite",
-            # 记得在顶部引入 TocExtension 和 slugify
-            TocExtension(slugify=slugify),
-        ]
-    )
-    content = md.convert(value)
-    m = re.search(r'<div class="toc">\s*<ul>(.*)</ul>\s*</div>', md.toc, re.S)
-    toc = m.group(1) if m is not None else ""
-    return {"content": content, "toc": toc}
+from .counters import adjust_num_posts, post_counters, view_counter
+from .projection import warn_deferred_refetch
+from .response_cache import response_cache
+from .rendering import generate_rich_content
+from .threads import PATH_STEP, ThreadedModel, decrease_reply_count
 
 
 class BaseModel(models.Model):
@@ -59,13 +46,44 @@ class BaseModel(models.Model):
     #
     class Meta:
         abstract = True
+
+    def refresh_from_db(self, using=None, fields=None):
+        # 访问 only()/defer() 没有取出的字段时，Django 会调用这里单独再查一次
+        if fields is not None:
+            deferred = self.get_deferred_fields().intersection(fields)
+            if deferred:
+                warn_deferred_refetch(self, deferred)
+        super().refresh_from_db(using=using, fields=fields)
     #
     # @abstractmethod
     # def get_absolute_url(self):
     #     pass
 
 
-class Category(BaseModel):
+class PostCountModel(BaseModel):
+    """
+    带有文章数 num_posts 的模型（分类、标签）
+
+    num_posts 在文章的保存、删除和标签修改时用 F 表达式增减，保存已有记录时不写回内存中可能已经过期的值
+    """
+
+    num_posts = models.PositiveIntegerField("文章数", default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "num_posts" and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class Category(PostCountModel):
     """
     Django 要求模型必须继承 models.Model 类。
     Category 只需要一个简单的分类名 name 就可以了。
@@ -92,7 +110,7 @@ class Category(BaseModel):
         return self.name
 
 
-class Tag(BaseModel):
+class Tag(PostCountModel):
     """
     标签 Tag 也比较简单，和 Category 一样。
     """
@@ -148,20 +166,28 @@ class Post(BaseModel):
     # 因为我们规定一篇文章只能有一个作者，而一个作者可能会写多篇文章，因此这是一对多的关联关系，和 Category 类似。
     author = models.ForeignKey(User, verbose_name="作者", on_delete=models.CASCADE)
 
-    # 新增 views 字段记录阅读量
-    views = models.PositiveIntegerField(default=0, editable=False)
-
     pub_time = models.DateTimeField(
         '发布时间', blank=False, null=False, default=timezone.now)
 
-    # 点赞和评论时，记着更新like_count，comment_count。自增1/自减1
-    like_count = models.IntegerField(default=0)
-    comment_count = models.IntegerField(default=0)
+    # 阅读量、点赞数和评论数存放在单独的计数表 PostCounter 中，见下方的 views、like_count、comment_count
+
+    # 正文渲染后的 HTML 和目录，在保存文章时生成并存入数据库，
+    # 读取文章时直接使用，避免每次请求都重新渲染一遍 Markdown。
+    body_html = models.TextField("正文 HTML", blank=True, editable=False)
+    toc = models.TextField("文章目录", blank=True, editable=False)
 
     class Meta:
         verbose_name = "文章"
         verbose_name_plural = verbose_name
         ordering = ["-pub_time"]
+        indexes = [
+            models.Index(fields=["pub_time"], name="post_pub_time_idx"),
+            models.Index(fields=["category", "pub_time"], name="post_category_pub_time_idx"),
+            models.Index(fields=["created_time"], name="post_created_time_idx"),
+        ]
+
+    # 决定文章出现在哪些列表中以及排列顺序的字段
+    list_fields = ("category_id", "pub_time", "created_time")
 
     def __str__(self):
         return self.title
@@ -169,18 +195,41 @@ class Post(BaseModel):
     def save(self, *args, **kwargs):
         self.modified_time = timezone.now()
 
-        # 首先实例化一个 Markdown 类，用于渲染 body 的文本。
-        # 由于摘要并不需要生成文章目录，所以去掉了目录拓展。
-        md = markdown.Markdown(
-            extensions=["markdown.extensions.extra", "markdown.extensions.codehilite", ]
-        )
-
-        # 先将 Markdown 文本渲染成 HTML 文本
-        # strip_tags 去掉 HTML 文本的全部 HTML 标签
-        # 从文本摘取前 54 个字符赋给 excerpt
-        self.excerpt = strip_tags(md.convert(self.body))[:54]
-
-        super().save(*args, **kwargs)
+        # 只更新部分字段（例如阅读量）且不涉及正文时，无需重新渲染
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "body" in update_fields:
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"excerpt", "body_html", "toc"}
+            # 正文只渲染一次，HTML、目录和摘要都来自同一次渲染的结果
+            self.render_body()
+
+        if update_fields is not None and {"category", *self.list_fields}.isdisjoint(update_fields):
+            self._list_changed = False
+            super().save(*args, **kwargs)
+            return
+
+        # 新增文章或修改分类时，分类的文章数与文章在同一个事务中更新
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                old = Post.objects.filter(pk=self.pk).values_list(*self.list_fields).first()
+            # 由 invalidate_post_responses 决定是否让文章列表的缓存失效
+            self._list_changed = old != tuple(getattr(self, field) for field in self.list_fields)
+            old_category_id = old[0] if old else None
+            super().save(*args, **kwargs)
+            if old_category_id != self.category_id:
+                adjust_num_posts(Category, {self.category_id: 1, old_category_id: -1})
+
+    def render_body(self):
+        """
+        渲染正文，将生成的 HTML、目录和摘要存入 body_html、toc 和 excerpt 字段（不保存到数据库）
+        """
+        self.set_rich_content(generate_rich_content(self.body))
+
+    def set_rich_content(self, rich_content):
+        self.body_html = rich_content["content"]
+        self.toc = rich_content["toc"]
+        self.excerpt = rich_content["excerpt"]
 
     # 自定义 get_absolute_url 方法
     # 记得从 django.urls 中导入 reverse 函数 todo
@@ -188,28 +237,75 @@ class Post(BaseModel):
         return reverse("blog:detail", kwargs={"pk": self.pk})
 
     def increase_views(self):
-        self.views += 1
-        self.save(update_fields=["views"])
+        # 只累加到缓存中，由 view_counter 批量写回数据库，访问文章时不写数据库
+        view_counter.incr(self.pk)
+        self.__dict__.pop("_pending_views", None)
 
     def increase_comment_count(self):
-        self.comment_count += 1
-        self.save(update_fields=["comment_count"])
+        post_counters.incr(self.pk, "comment_count")
+        self.__dict__.pop("_counts", None)
 
     def increase_like_count(self):
-        self.like_count += 1
-        self.save(update_fields=["like_count"])
+        post_counters.incr(self.pk, "like_count")
+        self.__dict__.pop("_counts", None)
 
     @property
-    def toc(self):
-        return self.rich_content.get("toc", "")
+    def counts(self):
+        # 列表接口会用 prefetch_counts 一次性取出整页文章的计数，存放在 _counts 中
+        counts = self.__dict__.get("_counts")
+        if counts is None:
+            counts = post_counters.get(self.pk)
+        return counts
 
     @property
-    def body_html(self):
-        return self.rich_content.get("content", "")
+    def views(self):
+        """
+        已写回数据库的阅读量
+        """
+        return self.counts["views"]
 
-    @cached_property
-    def rich_content(self):
-        return generate_rich_content(self.body)
+    @property
+    def view_count(self):
+        """
+        阅读量，包括尚未写回数据库的部分
+        """
+        pending = self.__dict__.get("_pending_views")
+        if pending is None:
+            pending = view_counter.pending(self.pk)
+        return self.views + pending
+
+    @property
+    def like_count(self):
+        return self.counts["like_count"]
+
+    @property
+    def comment_count(self):
+        return self.counts["comment_count"]
+
+
+class PostCounter(models.Model):
+    """
+    文章的阅读量、点赞数和评论数
+
+    每篇文章对应多行（分片），计数时随机更新其中一行，热门文章的计数不会都争抢同一行的锁，
+    也不会锁住并重写包含正文的文章行。读取时把各分片相加，结果由 counters.post_counters 缓存。
+    """
+
+    post = models.ForeignKey(
+        Post, verbose_name="文章", related_name="counter_shards", on_delete=models.CASCADE
+    )
+    shard = models.PositiveSmallIntegerField("分片")
+    views = models.PositiveIntegerField("阅读量", default=0)
+    like_count = models.IntegerField("点赞数", default=0)
+    comment_count = models.IntegerField("评论数", default=0)
+
+    class Meta:
+        verbose_name = "文章计数"
+        verbose_name_plural = verbose_name
+        unique_together = [("post", "shard")]
+
+    def __str__(self):
+        return "{}#{}".format(self.post_id, self.shard)
 
 
 # todo
@@ -219,6 +315,76 @@ def change_post_updated_at(sender=None, instance=None, *args, **kwargs):
 
 post_save.connect(receiver=change_post_updated_at, sender=Post)
 post_delete.connect(receiver=change_post_updated_at, sender=Post)
+# 文章列表和侧边栏中也显示分类、标签及其文章数
+post_save.connect(receiver=change_post_updated_at, sender=Category)
+post_delete.connect(receiver=change_post_updated_at, sender=Category)
+post_save.connect(receiver=change_post_updated_at, sender=Tag)
+post_delete.connect(receiver=change_post_updated_at, sender=Tag)
+m2m_changed.connect(receiver=change_post_updated_at, sender=Post.tags.through)
+
+
+def decrease_num_posts(sender=None, instance=None, *args, **kwargs):
+    # pre_delete 与删除在同一个事务中发送，此时文章与标签的关联还没有删除
+    adjust_num_posts(Category, {instance.category_id: -1})
+    tag_ids = Post.tags.through.objects.filter(post_id=instance.pk).values_list("tag_id", flat=True)
+    adjust_num_posts(Tag, {tag_id: -1 for tag_id in tag_ids})
+
+
+def change_tag_num_posts(sender=None, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    """
+    文章的标签增删时更新标签的文章数，m2m_changed 与关联的增删在同一个事务中发送
+
+    post_add 的 pk_set 只包含实际新增的关联；remove 和 clear 在删除前从关联表中查出实际存在的关联
+    """
+    # reverse 为 True 时 instance 是标签，pk_set 是文章的 id
+    instance_field, other_field = ("tag_id", "post_id") if reverse else ("post_id", "tag_id")
+    if action == "post_add":
+        links = [(instance.pk, pk) for pk in pk_set]
+    elif action in ("pre_remove", "pre_clear"):
+        queryset = sender.objects.filter(**{instance_field: instance.pk})
+        if pk_set is not None:
+            queryset = queryset.filter(**{other_field + "__in": pk_set})
+        links = [(instance.pk, pk) for pk in queryset.values_list(other_field, flat=True)]
+    else:
+        return
+    delta = 1 if action == "post_add" else -1
+    counts = Counter(instance_pk if reverse else other_pk for instance_pk, other_pk in links)
+    adjust_num_posts(Tag, {tag_id: count * delta for tag_id, count in counts.items()})
+
+
+pre_delete.connect(receiver=decrease_num_posts, sender=Post)
+m2m_changed.connect(receiver=change_tag_num_posts, sender=Post.tags.through)
+
+
+def invalidate_post_responses(sender=None, instance=None, signal=None, **kwargs):
+    tags = ["post:%s" % instance.pk]
+    # 文章的增删和分类、发布时间的修改会改变列表中的文章以及分类、标签的文章数
+    if signal is post_delete or instance.__dict__.pop("_list_changed", True):
+        tags += ["post:list", "category:list", "tag:list"]
+    response_cache.invalidate(*tags)
+
+
+def invalidate_named_responses(sender=None, instance=None, **kwargs):
+    # 分类或标签改名后，包含它的文章和计数列表都要更新
+    name = sender._meta.model_name
+    response_cache.invalidate("%s:%s" % (name, instance.pk), "%s:list" % name)
+
+
+def invalidate_tagged_responses(sender=None, instance=None, action=None, reverse=False, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    # reverse 为 True 时 instance 是标签，依赖这个标签的文章数据都要更新
+    tag = "tag:%s" % instance.pk if reverse else "post:%s" % instance.pk
+    response_cache.invalidate(tag, "post:list", "tag:list")
+
+
+post_save.connect(receiver=invalidate_post_responses, sender=Post)
+post_delete.connect(receiver=invalidate_post_responses, sender=Post)
+post_save.connect(receiver=invalidate_named_responses, sender=Category)
+post_delete.connect(receiver=invalidate_named_responses, sender=Category)
+post_save.connect(receiver=invalidate_named_responses, sender=Tag)
+post_delete.connect(receiver=invalidate_named_responses, sender=Tag)
+m2m_changed.connect(receiver=invalidate_tagged_responses, sender=Post.tags.through)
 
 
 class About(BaseModel):
@@ -235,6 +401,11 @@ class About(BaseModel):
     # def __str__(self):
     #     return self.name
 
+    def save(self, *args, **kwargs):
+        # 修改时间用于条件请求的校验
+        self.modified_time = timezone.now()
+        super().save(*args, **kwargs)
+
     @property
     def body_html(self):
         return self.rich_content.get("content", "")
@@ -244,7 +415,7 @@ class About(BaseModel):
         return generate_rich_content(self.body)
 
 
-class TreeHole(BaseModel):
+class TreeHole(ThreadedModel, BaseModel):
     """
     TreeHole 存储树洞的信息
     """
@@ -257,7 +428,49 @@ class TreeHole(BaseModel):
         verbose_name = "树洞"
         verbose_name_plural = verbose_name
         ordering = ["-created_time"]
+        # 按月份查询顶层树洞
+        indexes = [
+            models.Index(fields=["depth", "created_time"], name="treehole_depth_created_idx"),
+        ]
 
     def __str__(self):
         return "{}: {}".format(self.id, self.content[:20])
 
+    @property
+    def root_created_time(self):
+        """
+        所在树洞串的顶层树洞的创建时间，树洞按顶层树洞的创建月份归档
+        """
+        if not self.parent_id:
+            return self.created_time
+        path = self.path or (
+            TreeHole.objects.filter(pk=self.parent_id).values_list("path", flat=True).first()
+        )
+        if not path:
+            return None
+        return (
+            TreeHole.objects.filter(path=path[:PATH_STEP])
+            .values_list("created_time", flat=True)
+            .first()
+        )
+
+
+def treehole_month_key(month):
+    return "treehole_updated_at:%s" % month
+
+
+def change_treehole_updated_at(sender=None, instance=None, *args, **kwargs):
+    now = datetime.utcnow()
+    if not instance.parent_id:
+        # 顶层树洞增删时归档月份的列表可能变化
+        cache.set("treehole_updated_at", now)
+    created_time = instance.root_created_time
+    if created_time is not None:
+        cache.set(treehole_month_key(created_time.strftime("%Y-%m")), now)
+
+
+post_save.connect(receiver=change_treehole_updated_at, sender=TreeHole)
+post_delete.connect(receiver=change_treehole_updated_at, sender=TreeHole)
+# 只为树形模型连接，其它模型的级联删除仍可使用 Django 的快速删除
+post_delete.connect(receiver=decrease_reply_count, sender=TreeHole)
+
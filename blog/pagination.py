@@ -0,0 +1,140 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class KeysetPagination(CursorPagination):
+    """
+    按 (排序字段, id) 定位的游标分页
+
+    DRF 的 CursorPagination 只按第一个排序字段定位，排序字段的值相同时要借助 OFFSET，
+    这里把主键作为最后一个排序字段，游标中记录最后一条记录全部排序字段的值，
+    翻页时用 (a, id) < (va, vid) 这样的条件直接定位，不需要 COUNT 和 OFFSET，
+    并且排序字段的值重复时游标也是稳定的。
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    # 为 True 时使用视图的 OrderingFilter 给出的排序（例如 ?ordering=-views）
+    use_view_ordering = False
+
+    def get_ordering(self, request, queryset, view):
+        if self.use_view_ordering:
+            ordering = super().get_ordering(request, queryset, view)
+        elif isinstance(self.ordering, str):
+            ordering = (self.ordering,)
+        else:
+            ordering = tuple(self.ordering)
+        # 以主键作为最后一个排序字段，保证每条记录的位置唯一
+        if ordering[-1].lstrip("-") not in ("id", "pk"):
+            ordering += ("-id" if ordering[0].startswith("-") else "id",)
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [getattr(instance, term.lstrip("-")) for term in ordering]
+        return json.dumps([str(value) for value in values])
+
+    def position_filter(self, position, reverse):
+        """
+        位于 position 之后（reverse 为 True 时为之前）的记录，按排序字段逐个展开为
+        a > va OR (a = va AND b > vb) OR ...，每个分支都能使用排序字段上的索引
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            return None
+        condition = Q(pk__in=[])
+        equal = {}
+        for term, value in zip(self.ordering, values):
+            field = term.lstrip("-")
+            descending = term.startswith("-") != reverse
+            condition |= Q(**equal, **{field + ("__lt" if descending else "__gt"): value})
+            equal[field] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # 与 CursorPagination.paginate_queryset 相同，只是按全部排序字段组成的位置过滤
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            condition = self.position_filter(current_position, reverse)
+            if condition is None:
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(condition)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class PostCursorPagination(KeysetPagination):
+    ordering = ("-pub_time", "-id")
+    use_view_ordering = True
+
+
+class CommentCursorPagination(KeysetPagination):
+    ordering = ("-created_time", "-id")
+
+
+class VersionedPaginationMixin:
+    """
+    /api/v1/ 保持原来的页码（或 limit/offset）分页，兼容旧的客户端；
+    其它版本中 cursor_pagination_classes 里列出的 action 使用游标分页
+    """
+
+    cursor_pagination_classes = {}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            pagination_class = self.cursor_pagination_classes.get(self.action)
+            if pagination_class is not None and self.request.version != "v1":
+                self._paginator = pagination_class()
+        return super().paginator
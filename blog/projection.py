@@ -0,0 +1,66 @@
+"""
+按序列化类用到的字段决定查询哪些列
+
+序列化类的 fields 中对应模型字段的部分（包括嵌套序列化的外键）会被换算成列名，查询时用 only()
+只取这些列，文章列表这样的接口就不会把正文等大字段也取出来。序列化时用到的属性（property）
+如果依赖其它列，需要在序列化类的 Meta.required_columns 中声明。
+
+访问查询时没有取出的字段，Django 会为每个对象再查一次数据库，此时会发出 DeferredFieldRefetchWarning。
+"""
+import warnings
+
+from django.core.exceptions import FieldDoesNotExist
+
+
+class DeferredFieldRefetchWarning(RuntimeWarning):
+    pass
+
+
+def warn_deferred_refetch(instance, fields):
+    warnings.warn(
+        "%s(pk=%s) 的字段 %s 没有在查询中取出，访问时又查询了一次数据库，"
+        "请检查序列化类的 fields 或 Meta.required_columns"
+        % (type(instance).__name__, instance.pk, ", ".join(sorted(fields))),
+        DeferredFieldRefetchWarning,
+        stacklevel=4,
+    )
+
+
+def serializer_columns(serializer, model, prefix=""):
+    """
+    返回序列化 model 时需要取出的列，嵌套序列化的外键以 prefix 为前缀，例如 category__name
+
+    多对多和反向关联不在这里处理，它们由 prefetch_related 单独查询
+    """
+    columns = [prefix + model._meta.pk.name]
+    meta = getattr(serializer, "Meta", None)
+    columns.extend(prefix + column for column in getattr(meta, "required_columns", ()))
+    for field in serializer.fields.values():
+        if field.source == "*":
+            continue
+        path, current = prefix, model
+        for attr in field.source_attrs:
+            try:
+                model_field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                # 属性或方法，依赖的列由 Meta.required_columns 声明
+                break
+            if not model_field.concrete or model_field.many_to_many:
+                break
+            columns.append(path + attr)
+            if not model_field.is_relation:
+                break
+            path, current = path + attr + "__", model_field.related_model
+        else:
+            # source 指向外键，嵌套的序列化类还需要关联模型中的列
+            if hasattr(field, "fields"):
+                columns.extend(serializer_columns(field, current, path))
+    return columns
+
+
+def project(queryset, serializer_class, extra=()):
+    """
+    只取出 serializer_class 序列化时需要的列，extra 是视图另外用到的列，例如游标分页的排序字段
+    """
+    columns = serializer_columns(serializer_class(), queryset.model)
+    return queryset.only(*columns, *extra)
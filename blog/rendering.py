@@ -0,0 +1,445 @@
+"""
+Markdown 渲染
+
+文章正文、关于页面等 Markdown 内容统一在这里渲染，一次解析同时得到 HTML、目录、纯文本和摘要。
+渲染结果以「Markdown 源文本 + 扩展配置」的哈希值为键缓存：进程内先查一层 LRU，
+未命中再查 Django 缓存，所以相同的内容在各个 gunicorn worker 之间、重启之后都不会被重复渲染。
+"""
+import re
+import sys
+import threading
+from contextlib import contextmanager
+from hashlib import md5
+
+import markdown
+import pygments
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import strip_tags
+from django.utils.text import slugify
+from markdown.blockprocessors import ReferenceProcessor
+from markdown.extensions import codehilite, fenced_code
+from markdown.extensions.toc import nest_toc_tokens
+
+from . import metrics
+from .utils import LRUCache
+
+# 渲染结果的结构发生变化时递增，使旧结构的缓存失效
+RENDER_PIPELINE_VERSION = 2
+
+# 摘要的长度（字符数）
+EXCERPT_LENGTH = 54
+
+MARKDOWN_EXTENSIONS = [
+    "markdown.extensions.extra",
+    "markdown.extensions.codehilite",
+    "markdown.extensions.toc",
+]
+MARKDOWN_EXTENSION_CONFIGS = {
+    "markdown.extensions.toc": {"slugify": slugify},
+}
+
+
+def _describe(value):
+    # 函数类的配置项（例如 slugify）用其完整路径表示，保证不同进程中算出的指纹一致
+    if callable(value):
+        return "%s.%s" % (value.__module__, value.__qualname__)
+    return repr(value)
+
+
+def config_fingerprint():
+    """
+    渲染配置的指纹，扩展、扩展配置或 Markdown/Pygments 版本变化时指纹随之变化，旧的缓存自动失效
+    """
+    parts = [str(RENDER_PIPELINE_VERSION), markdown.__version__, pygments.__version__]
+    parts.extend(MARKDOWN_EXTENSIONS)
+    for name in sorted(MARKDOWN_EXTENSION_CONFIGS):
+        config = MARKDOWN_EXTENSION_CONFIGS[name]
+        parts.append(name)
+        parts.extend("%s=%s" % (k, _describe(config[k])) for k in sorted(config))
+    return md5("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _sizeof(rich_content):
+    return sum(sys.getsizeof(value) for value in rich_content.values())
+
+
+class RenderCache:
+    """
+    两级渲染结果缓存：进程内按字节数淘汰的 LRU + Django 缓存
+    """
+
+    def __init__(self, max_bytes, timeout, key_prefix="rich_content"):
+        self.key_prefix = key_prefix
+        self.local = LRUCache(max_bytes=max_bytes, sizeof=_sizeof)
+        self.timeout = timeout
+        self.fingerprint = config_fingerprint()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def make_key(self, value):
+        digest = md5(value.encode("utf-8")).hexdigest()
+        return "%s:%s:%s" % (self.key_prefix, self.fingerprint, digest)
+
+    def get(self, key):
+        rich_content = self.local.get(key)
+        if rich_content is not None:
+            self.local_hits += 1
+            return rich_content
+
+        rich_content = cache.get(key)
+        if rich_content is not None:
+            self.shared_hits += 1
+            self.local.set(key, rich_content)
+            return rich_content
+
+        self.misses += 1
+        return None
+
+    def set(self, key, rich_content):
+        self.local.set(key, rich_content)
+        cache.set(key, rich_content, self.timeout)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        hits = self.local_hits + self.shared_hits
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.current_bytes,
+        }
+
+
+render_cache = RenderCache(
+    max_bytes=getattr(settings, "RENDER_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+    timeout=getattr(settings, "RENDER_CACHE_TIMEOUT", 7 * 24 * 60 * 60),
+)
+metrics.register("render_cache", render_cache.stats)
+
+# 按块缓存的渲染结果，用于增量渲染（见 render_markdown_incremental）
+block_cache = RenderCache(
+    max_bytes=getattr(settings, "RENDER_BLOCK_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+    timeout=getattr(settings, "RENDER_CACHE_TIMEOUT", 7 * 24 * 60 * 60),
+    key_prefix="rich_block",
+)
+metrics.register("render_block_cache", block_cache.stats)
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    """
+    按代码块缓存高亮结果的 CodeHilite
+
+    渲染耗时的大头是 Pygments 对代码块的高亮，而修改文章时代码块通常不变，
+    所以以「语言 + 代码 + 高亮选项」的哈希值为键缓存高亮后的 HTML，只修改正文文字时无需重新高亮。
+    """
+
+    def cache_key(self):
+        options = sorted((k, repr(v)) for k, v in self.options.items())
+        raw = repr((self.src, self.guess_lang, self.use_pygments, self.lang_prefix, options))
+        return (self.lang, md5(raw.encode("utf-8")).hexdigest())
+
+    def hilite(self):
+        # 必须在 hilite 之前计算键：hilite 会修改 src，并可能从代码首行解析出 lang
+        key = self.cache_key()
+        html = highlight_cache.get(key)
+        if html is None:
+            html = super().hilite()
+            highlight_cache.set(key, html)
+        return html
+
+
+highlight_cache = LRUCache(max_bytes=getattr(settings, "HIGHLIGHT_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+metrics.register("highlight_cache", highlight_cache.stats)
+
+# fenced_code 和 codehilite 扩展在内部直接使用各自模块中的 CodeHilite 类，
+# 替换为带缓存的子类后，围栏代码块和缩进代码块的高亮都会经过缓存（输出与原来完全一致）。
+fenced_code.CodeHilite = CachedCodeHilite
+codehilite.CodeHilite = CachedCodeHilite
+
+
+def build_markdown():
+    return markdown.Markdown(
+        extensions=MARKDOWN_EXTENSIONS,
+        extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+    )
+
+
+def reset_markdown(md):
+    md.reset()
+    # abbr 扩展会把文中定义的缩写注册为行内模式，md.reset() 不会移除它们，
+    # 不手动清掉的话上一篇文章的缩写会被带到下一篇文章里
+    for name in [name for name in md.inlinePatterns._data if name.startswith("abbr-")]:
+        md.inlinePatterns.deregister(name)
+
+
+# 每个线程各自持有一组 Markdown 实例，用完 reset 后放回，供该线程下一次渲染复用。
+# 实例只在创建它的线程中使用，因此在 gunicorn 的 gthread worker 下也不需要加锁。
+_pool = threading.local()
+
+
+@contextmanager
+def pooled_markdown():
+    """
+    从当前线程的实例池中取出一个 Markdown 实例，省去每次渲染都要重新初始化扩展（Pygments 等）的开销
+    """
+    instances = getattr(_pool, "instances", None)
+    if instances is None:
+        instances = _pool.instances = []
+    md = instances.pop() if instances else build_markdown()
+    try:
+        yield md
+    finally:
+        reset_markdown(md)
+        instances.append(md)
+
+
+def render_markdown(value):
+    """
+    渲染 Markdown，返回 HTML 正文（content）、目录（toc）、纯文本（text）和摘要（excerpt）
+    """
+    with pooled_markdown() as md:
+        content = md.convert(value)
+        md_toc = md.toc
+    return _build_rich_content(content, md_toc)
+
+
+def _build_rich_content(content, md_toc):
+    m = re.search(r'<div class="toc">\s*<ul>(.*)</ul>\s*</div>', md_toc, re.S)
+    toc = m.group(1) if m is not None else ""
+    # 纯文本和摘要直接从渲染好的 HTML 中得到，无需再解析一遍 Markdown
+    text = strip_tags(content)
+    return {"content": content, "toc": toc, "text": text, "excerpt": text[:EXCERPT_LENGTH]}
+
+
+# ---------------------------------------------------------------------------
+#   增量渲染
+# ---------------------------------------------------------------------------
+#
+# 把正文按空行切分成互不影响的顶层块，每个块单独渲染并按内容缓存，
+# 修改文章时只有改动过的块需要重新渲染，最后拼接各块的 HTML 并重新生成目录。
+# 拼接结果必须与整篇渲染逐字节一致，因此只在能确定各块互相独立时才切分，否则退回整篇渲染。
+
+# 追加在每个块后面的哨兵段落。convert 会去掉输出首尾的空白，而块与块之间的空白
+# 是整篇输出的一部分（例如代码高亮结果末尾的换行），借助哨兵可以保留这部分空白。
+BLOCK_SENTINEL = "md-block-sentinel-7f1d2e"
+BLOCK_SENTINEL_HTML = "<p>%s</p>" % BLOCK_SENTINEL
+
+# 出现这些内容时各块之间存在依赖，只能整篇渲染：原始 HTML 块、脚注、缩写定义、[TOC] 标记
+NON_INCREMENTAL_RE = re.compile(r"^ {0,3}<[A-Za-z!?/]|\[\^|^ {0,3}\*\[|\[TOC\]", re.MULTILINE)
+# 可能被解析为链接定义的行（包括列表项、引用中的）
+REFERENCE_LIKE_RE = re.compile(r"^[ >]*(?:(?:[*+-]|\d+\.)[ ]+)?[ >]*\[[^\]]*\]:", re.MULTILINE)
+LIST_ITEM_RE = re.compile(r"^[ ]{0,3}(?:[*+-]|\d+\.)[ ]+")
+QUOTE_RE = re.compile(r"^[ ]{0,3}>")
+DEFINITION_RE = re.compile(r"^[ ]{0,3}:[ ]{1,3}")
+REFERENCE_START_RE = re.compile(r"^[ ]{0,3}\[[^\]]*\]:")
+ID_ATTR_RE = re.compile(r'\sid="([^"]*)"')
+
+# 跨空行时会与前面同类元素合并的块：列表（ul 与 ol 之间也会合并）、引用、定义列表
+MERGING_KINDS = ("list", "quote", "definition")
+
+
+def _normalize(text):
+    # 与 Markdown 的 NormalizeWhitespace 预处理保持一致
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.expandtabs(4)
+    return re.sub(r"(?<=\n) +\n", "\n", text)
+
+
+def _line_kind(line):
+    if LIST_ITEM_RE.match(line):
+        return "list"
+    if QUOTE_RE.match(line):
+        return "quote"
+    if DEFINITION_RE.match(line):
+        return "definition"
+    return "other"
+
+
+def _split_groups(text):
+    """
+    按空行把文本分成若干组。围栏代码块内部的空行不分组，缩进的行是上一组的延续，也不分组。
+    """
+    lines = text.split("\n")
+    fenced = set()
+    for m in fenced_code.FencedBlockPreprocessor.FENCED_BLOCK_RE.finditer(text):
+        first = text.count("\n", 0, m.start())
+        fenced.update(range(first, first + text.count("\n", m.start(), m.end()) + 1))
+
+    groups = []
+    current = []
+    after_blank = True
+    for i, line in enumerate(lines):
+        if not line and i not in fenced:
+            after_blank = True
+            if current:
+                current.append(line)
+            continue
+        if after_blank and current and not line[0].isspace():
+            groups.append("\n".join(current).strip("\n"))
+            current = []
+        current.append(line)
+        after_blank = False
+    if current:
+        groups.append("\n".join(current).strip("\n"))
+    return groups
+
+
+def _is_reference_group(group):
+    return (
+        REFERENCE_START_RE.match(group) is not None
+        and not ReferenceProcessor.RE.sub("", group).strip()
+        and "|" not in group
+        and not any(DEFINITION_RE.match(line) for line in group.split("\n"))
+    )
+
+
+def split_blocks(text):
+    """
+    把规范化后的 Markdown 文本切分成可以独立渲染的顶层块
+
+    在 _split_groups 的基础上，以下情况不切分，与前一组合并成一个块：
+    - 只包含链接定义的组不生成任何元素，其后缩进的内容仍然接在再前面的元素上；
+    - 列表、引用、定义列表会与前面含有同类元素的组合并成一个元素；
+    - 以定义（": "）开头的组会把前一段文字当作术语，术语所在的组也不能与前面的定义列表分开。
+    """
+    groups = _split_groups(text)
+    first_kinds = [_line_kind(group) for group in groups]
+    # 链接定义组不生成元素，判断“下一组”时要跳过它们
+    next_kinds = [None] * len(groups)
+    following = None
+    for i in range(len(groups) - 1, -1, -1):
+        next_kinds[i] = following
+        if not _is_reference_group(groups[i]):
+            following = first_kinds[i]
+    blocks = []
+    current = []
+    current_kinds = set()
+    for i, group in enumerate(groups):
+        kinds = {_line_kind(line) for line in group.split("\n") if line and not line.startswith("    ")}
+        kind = first_kinds[i]
+        merge = (
+            _is_reference_group(group)
+            or kind == "definition"
+            or (kind in MERGING_KINDS and kind in current_kinds)
+            or ("definition" in kinds and "definition" in current_kinds)
+            or ("definition" in current_kinds and next_kinds[i] == "definition")
+        )
+        if current and not merge:
+            blocks.append("\n\n".join(current))
+            current = []
+            current_kinds = set()
+        current.append(group)
+        current_kinds |= kinds
+    if current:
+        blocks.append("\n\n".join(current))
+    return blocks
+
+
+def _flatten_toc_tokens(tokens):
+    flat = []
+    for token in tokens:
+        flat.append({"level": token["level"], "id": token["id"], "name": token["name"]})
+        flat.extend(_flatten_toc_tokens(token["children"]))
+    return flat
+
+
+def _render_block(block, references):
+    """
+    渲染单个块，返回该块的 HTML（包含其后的空白）和目录条目
+    """
+    source = "\n\n".join(part for part in (block, references, BLOCK_SENTINEL) if part)
+    with pooled_markdown() as md:
+        html = md.convert(source)
+        toc_tokens = _flatten_toc_tokens(md.toc_tokens)
+    if not html.endswith(BLOCK_SENTINEL_HTML):
+        return None
+    return {"content": html[: -len(BLOCK_SENTINEL_HTML)], "toc_tokens": toc_tokens}
+
+
+def _render_toc(toc_tokens):
+    # 与 TocTreeprocessor.run 生成 md.toc 的方式相同
+    with pooled_markdown() as md:
+        div = md.treeprocessors["toc"].build_toc_div(nest_toc_tokens(toc_tokens))
+        toc = md.serializer(div)
+        for pp in md.postprocessors:
+            toc = pp.run(toc)
+    return toc
+
+
+def render_markdown_incremental(value):
+    """
+    按块增量渲染 Markdown，结果与 render_markdown 完全一致；无法安全切分时退回整篇渲染
+    """
+    text = _normalize(value)
+    if not text.strip() or NON_INCREMENTAL_RE.search(text):
+        return render_markdown(value)
+
+    # 链接定义对整篇文章生效，把它们附加到每个块后面，保证各块中的引用链接都能解析。
+    # 只有单独成组的链接定义才能确定会被解析为定义，其它位置出现疑似定义的行时整篇渲染。
+    references = []
+    for group in _split_groups(text):
+        if _is_reference_group(group):
+            references.append(group)
+        elif REFERENCE_LIKE_RE.search(
+            fenced_code.FencedBlockPreprocessor.FENCED_BLOCK_RE.sub("", group)
+        ):
+            return render_markdown(value)
+    references = "\n\n".join(references)
+
+    pieces = []
+    toc_tokens = []
+    seen_ids = set()
+    for block in split_blocks(text):
+        key = block_cache.make_key(block + "\x00" + references)
+        rendered = block_cache.get(key)
+        if rendered is None:
+            rendered = _render_block(block, references)
+            if rendered is None:
+                return render_markdown(value)
+            block_cache.set(key, rendered)
+
+        # 标题 id 在整篇文章中需要唯一，不同块之间出现重复 id 时整篇渲染的结果会不同
+        ids = set(ID_ATTR_RE.findall(rendered["content"]))
+        if ids & seen_ids:
+            return render_markdown(value)
+        seen_ids |= ids
+
+        pieces.append(rendered["content"])
+        toc_tokens.extend(rendered["toc_tokens"])
+
+    content = "".join(pieces).strip()
+    return _build_rich_content(content, _render_toc(toc_tokens))
+
+
+def generate_rich_content(value):
+    key = render_cache.make_key(value)
+    rich_content = render_cache.get(key)
+    if rich_content is None:
+        rich_content = render_markdown_incremental(value)
+        render_cache.set(key, rich_content)
+    return rich_content
+
+
+def generate_rich_contents(values, cached=True):
+    """
+    批量渲染，供 rerender_posts 命令在子进程中调用
+
+    cached 为 False 时不读取任何渲染缓存，整篇重新渲染（代码高亮也重新计算），并用结果替换渲染缓存中的旧条目。
+    升级后输出改变而配置指纹不变时（例如 Pygments 样式、模板过滤器），只有这样才能真正得到新的结果
+    """
+    if cached:
+        return [generate_rich_content(value) for value in values]
+    highlight_cache.clear()
+    rich_contents = []
+    for value in values:
+        rich_content = render_markdown(value)
+        render_cache.set(render_cache.make_key(value), rich_content)
+        rich_contents.append(rich_content)
+    return rich_contents
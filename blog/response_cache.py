@@ -0,0 +1,168 @@
+"""
+按依赖失效的接口响应缓存
+
+每条缓存记录带有它所依赖的对象的标签，例如文章详情依赖 post:1、category:2、tag:3，文章列表还依赖
+post:list（文章的增删、分类和发布时间的变化会改变列表中有哪些文章）。某个对象变化时只记下它的标签的
+更新时间（invalidate），读取缓存时如果某个依赖的标签在记录开始生成之后更新过，就视为失效，
+不依赖这个对象的缓存不受影响。用开始生成的时间比较，生成期间发生的修改也不会被漏掉。
+
+缓存的是序列化后的数据而不是渲染后的响应，阅读量等计数由视图在返回前重新填入，计数变化不会使缓存失效。
+"""
+import functools
+import hashlib
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import metrics
+from .cache_backends import shared_only
+from .conditional import content_digest, make_validators, not_modified, set_validators
+
+
+class ResponseCache:
+    key_prefix = "response"
+    tag_prefix = "response_tag"
+
+    def __init__(self):
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.stale = defaultdict(int)
+
+    @property
+    def timeout(self):
+        return getattr(settings, "API_CACHE_TIMEOUT", 5 * 60)
+
+    def make_key(self, name, request):
+        # 路径中包含接口版本，不同的查询参数分别缓存
+        digest = hashlib.md5(request.get_full_path().encode("utf-8")).hexdigest()
+        return "%s:%s:%s" % (self.key_prefix, name, digest)
+
+    def make_tag_key(self, tag):
+        return "%s:%s" % (self.tag_prefix, tag)
+
+    def updated_at(self, tags, default):
+        """
+        返回各标签最后一次更新的时间，缓存中没有记录的标签记为 default
+        """
+        keys = {self.make_tag_key(tag): tag for tag in tags}
+        found = cache.get_many(list(keys))
+        for key in keys:
+            # 用 add 而不是 set，不会覆盖并发的 invalidate 写入的时间
+            if key not in found and not cache.add(key, default, None):
+                found[key] = cache.get(key, default)
+            found.setdefault(key, default)
+        return {keys[key]: value for key, value in found.items()}
+
+    def invalidate(self, *tags):
+        self._touch(tags)
+        # 事务提交前并发的请求仍会读到旧数据并写入缓存，提交后再记一次
+        transaction.on_commit(lambda: self._touch(tags))
+
+    def _touch(self, tags):
+        now = time.time()
+        cache.set_many({self.make_tag_key(tag): now for tag in tags}, None)
+
+    def get(self, name, key):
+        """
+        返回缓存的数据和它开始生成的时间，没有缓存或者已经失效时返回 None
+        """
+        entry = cache.get(key)
+        if entry is None:
+            self.misses[name] += 1
+            return None
+        data, started_at, tags = entry
+        # 标签的记录被淘汰后无法知道它是否更新过，只能当作刚刚更新
+        if any(value >= started_at for value in self.updated_at(tags, time.time()).values()):
+            self.stale[name] += 1
+            return None
+        self.hits[name] += 1
+        return data, started_at
+
+    def set(self, key, data, started_at, tags):
+        tags = sorted(set(tags))
+        # 到现在还没有记录的标签在生成期间没有更新过，记为从未更新，刚生成的缓存不会因此失效
+        self.updated_at(tags, 0)
+        cache.set(key, (data, started_at, tags), self.timeout)
+
+    def stats(self):
+        names = set(self.hits) | set(self.misses) | set(self.stale)
+        data = {}
+        for name in sorted(names):
+            lookups = self.hits[name] + self.misses[name] + self.stale[name]
+            data[name] = {
+                "hits": self.hits[name],
+                "misses": self.misses[name],
+                "stale": self.stale[name],
+                "hit_ratio": self.hits[name] / lookups if lookups else 0.0,
+            }
+        hits = sum(self.hits.values())
+        lookups = hits + sum(self.misses.values()) + sum(self.stale.values())
+        data["hit_ratio"] = hits / lookups if lookups else 0.0
+        return data
+
+
+response_cache = ResponseCache()
+# 各进程都要立即看到标签的更新，缓存的响应数据本身可以放在进程内缓存中
+shared_only(ResponseCache.tag_prefix)
+metrics.register("response_cache", response_cache.stats)
+
+
+def cached_response(name, tags, refresh=None, cacheable=None, conditional=False, on_not_modified=None):
+    """
+    缓存视图方法返回的数据
+
+    tags(view, data) 返回数据所依赖的标签；refresh(view, data) 在每次返回前调用（包括命中缓存时），
+    用于填入计数等不参与缓存的内容；cacheable(request) 返回 False 时不使用缓存。
+
+    conditional 为 True 时处理条件请求：ETag 是缓存的数据（不含 refresh 填入的内容）的摘要，
+    Last-Modified 是数据开始生成的时间，客户端缓存的版本仍然有效时返回 304，
+    返回前调用 on_not_modified(view, data)，例如累加阅读量。
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(view, request, *args, **kwargs):
+            if cacheable is not None and not cacheable(request):
+                response = func(view, request, *args, **kwargs)
+                if refresh is not None and response.status_code == 200:
+                    refresh(view, response.data)
+                return response
+
+            key = response_cache.make_key(name, request)
+            entry = response_cache.get(name, key)
+            if entry is None:
+                started_at = time.time()
+                response = func(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                data = response.data
+                response_cache.set(key, data, started_at, tags(view, data))
+            else:
+                data, started_at = entry
+                response = None
+
+            validators = None
+            if conditional and request.method in ("GET", "HEAD"):
+                # 在 refresh 填入计数之前计算摘要
+                validators = make_validators(
+                    [request.get_full_path(), request.accepted_media_type, content_digest(data)], [started_at]
+                )
+                not_modified_response = not_modified(request, validators)
+                if not_modified_response is not None:
+                    if on_not_modified is not None and not_modified_response.status_code == 304:
+                        on_not_modified(view, data)
+                    return not_modified_response
+
+            if response is None:
+                response = Response(data)
+            if refresh is not None:
+                refresh(view, response.data)
+            return set_validators(response, validators)
+
+        return wrapper
+
+    return decorator
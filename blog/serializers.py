@@ -1,8 +1,10 @@
 from django.contrib.auth.models import User
+from django.db import models
 from drf_haystack.serializers import HaystackSerializerMixin
 from rest_framework import serializers
 from rest_framework.fields import CharField
 
+from .counters import prefetch_counts
 from .models import Category, Post, Tag, About, TreeHole
 from .utils import Highlighter
 
@@ -18,8 +20,6 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class CategoryWithCountSerializer(serializers.ModelSerializer):
-    # 当需要额外的属性，比如聚合函数所赋予的新属性时，序列化类也要声明相应的属性，否则无法序列化
-    num_posts = serializers.IntegerField()
 
     class Meta:
         model = Category
@@ -50,7 +50,6 @@ class TagSerializer(serializers.ModelSerializer):
         ]
 
 class TagsWithCountSerializer(serializers.ModelSerializer):
-    num_posts = serializers.IntegerField()
 
     class Meta:
         model = Tag
@@ -61,14 +60,30 @@ class TagsWithCountSerializer(serializers.ModelSerializer):
         ]
 
 
+class PostCountsListSerializer(serializers.ListSerializer):
+    """
+    序列化文章列表前一次性取出整页文章的计数，而不是每篇文章各查一次
+    """
+
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.Manager) else data)
+        prefetch_counts([post for post in posts if isinstance(post, Post)])
+        return super().to_representation(posts)
+
+
 class PostListSerializer(serializers.ModelSerializer):
     category = CategorySerializer()
     author = UserSerializer()
     created_time = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", required=False, read_only=True)
     tags = TagSerializer(many=True)
+    # 阅读量包括尚未写回数据库的部分
+    views = serializers.IntegerField(source="view_count", label="阅读量", read_only=True)
+    like_count = serializers.IntegerField(label="点赞数", read_only=True)
+    comment_count = serializers.IntegerField(label="评论数", read_only=True)
 
     class Meta:
         model = Post
+        list_serializer_class = PostCountsListSerializer
         # fields = "__all__"  # todo 显示所有的字段
         fields = [
             "id",
@@ -88,11 +103,16 @@ class PostRetrieveSerializer(serializers.ModelSerializer):
     category = CategorySerializer()
     author = UserSerializer()
     tags = TagSerializer(many=True)
-    toc = serializers.CharField(label="文章目录", help_text="HTML 格式，每个目录条目均由 li 标签包裹。")
+    toc = serializers.CharField(
+        label="文章目录", help_text="HTML 格式，每个目录条目均由 li 标签包裹。", read_only=True
+    )
     body_html = serializers.CharField(
-        label="文章内容", help_text="HTML 格式，从 `body` 字段解析而来。"
+        label="文章内容", help_text="HTML 格式，从 `body` 字段解析而来。", read_only=True
     )
     created_time = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", required=False, read_only=True)
+    views = serializers.IntegerField(source="view_count", label="阅读量", read_only=True)
+    like_count = serializers.IntegerField(label="点赞数", read_only=True)
+    comment_count = serializers.IntegerField(label="评论数", read_only=True)
 
     class Meta:
         model = Post
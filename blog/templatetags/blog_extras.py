@@ -1,36 +1,72 @@
+import functools
+
 from django import template
-from django.db.models.aggregates import Count
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 from ..models import Post, Category, Tag
+from ..utils import get_updated_at
 
 register = template.Library()
 
 
-@register.inclusion_tag('blog/inclusions/_recent_posts.html', takes_context=True)
+def cached_inclusion_tag(filename):
+    """
+    与 register.inclusion_tag 相同，但缓存渲染后的 HTML
+
+    缓存键中带有 post_updated_at，文章、分类或标签保存或删除后缓存随之失效，
+    其余时候渲染侧边栏不需要查询数据库。被装饰的函数本身不变，仍然返回模板上下文。
+    """
+
+    def decorator(func):
+        def render(context, *args, **kwargs):
+            key = "sidebar:%s:%s:%s" % (
+                func.__name__,
+                ":".join(str(arg) for arg in list(args) + sorted(kwargs.items())),
+                get_updated_at("post_updated_at").timestamp(),
+            )
+            html = cache.get(key)
+            if html is None:
+                html = render_to_string(filename, func(context, *args, **kwargs))
+                cache.set(key, html, settings.SIDEBAR_CACHE_TIMEOUT)
+            return mark_safe(html)
+
+        # 模板标签的参数按 func 的签名解析
+        functools.update_wrapper(render, func)
+        register.simple_tag(render, takes_context=True, name=func.__name__)
+        return func
+
+    return decorator
+
+
+@cached_inclusion_tag('blog/inclusions/_recent_posts.html')
 def show_recent_posts(context, num=5):
     return {
-        'recent_post_list': Post.objects.all()[:num],
+        # 只显示标题和链接
+        'recent_post_list': Post.objects.only('id', 'title')[:num],
     }
 
 
-@register.inclusion_tag('blog/inclusions/_archives.html', takes_context=True)
+@cached_inclusion_tag('blog/inclusions/_archives.html')
 def show_archives(context):
     return {
         'date_list': Post.objects.dates('created_time', 'month', order='DESC'),
     }
 
 
-@register.inclusion_tag('blog/inclusions/_categories.html', takes_context=True)
+@cached_inclusion_tag('blog/inclusions/_categories.html')
 def show_categories(context):
-    category_list = Category.objects.annotate(num_posts=Count('post')).filter(num_posts__gt=0)
+    category_list = Category.objects.filter(num_posts__gt=0)
     return {
         'category_list': category_list,
     }
 
 
-@register.inclusion_tag('blog/inclusions/_tags.html', takes_context=True)
+@cached_inclusion_tag('blog/inclusions/_tags.html')
 def show_tags(context):
-    tag_list = Tag.objects.annotate(num_posts=Count('post')).filter(num_posts__gt=0)
+    tag_list = Tag.objects.filter(num_posts__gt=0)
     return {
         'tag_list': tag_list,
     }
@@ -1,14 +1,25 @@
+import time
 from datetime import datetime
+from io import StringIO
+from unittest import mock
 
 from django.apps import apps
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 from django.utils.timezone import utc
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from blog.models import Category, Post, Tag
+from blog.conditional import make_validators, not_modified, set_validators
+from blog.models import About, Category, Post, Tag, TreeHole
+from blog.response_cache import response_cache
 from blog.serializers import (
     CategorySerializer,
     PostListSerializer,
@@ -19,6 +30,7 @@ from comments.models import Comment
 from comments.serializers import CommentSerializer
 
 
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
 class PostViewSetTestCase(APITestCase):
     def setUp(self):
         # 断开 haystack 的 signal，测试生成的文章无需生成索引
@@ -140,6 +152,540 @@ class PostViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class PostOrderingTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="category 1")
+        self.tag = Tag.objects.create(name="tag1")
+        self.post1 = Post.objects.create(title="title 1", body="post 1", category=cate, author=user)
+        self.post1.tags.add(self.tag)
+        self.post2 = Post.objects.create(title="title 2", body="post 2", category=cate, author=user)
+        self.post2.tags.add(self.tag)
+        self.post3 = Post.objects.create(title="title 3", body="post 3", category=cate, author=user)
+
+    def test_ordering_by_counters(self):
+        self.post1.increase_like_count()
+        self.post1.increase_like_count()
+        self.post2.increase_like_count()
+        url = reverse("v1:post-list")
+        response = self.client.get(url, {"tags": self.tag.pk, "ordering": "-like_count"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([post["id"] for post in results], [self.post1.pk, self.post2.pk])
+        self.assertEqual([post["like_count"] for post in results], [2, 1])
+
+        response = self.client.get(url, {"ordering": "like_count"})
+        self.assertEqual(
+            [post["id"] for post in response.data["results"]],
+            [self.post3.pk, self.post2.pk, self.post1.pk],
+        )
+
+    def test_list_reads_counts_in_one_query(self):
+        self.post1.increase_views()
+        url = reverse("v1:post-list")
+        response = self.client.get(url)
+        counts = {post["id"]: post["views"] for post in response.data["results"]}
+        self.assertEqual(counts[self.post1.pk], 1)
+        # 计数已缓存，再次请求时不再查询计数表
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any("blog_postcounter" in q["sql"] for q in queries.captured_queries))
+
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="category 1")
+        self.post1 = Post.objects.create(
+            title="title 1", body="post 1", category=cate, author=user,
+            created_time=datetime(year=2019, month=12, day=31, hour=8),
+        )
+        self.post2 = Post.objects.create(
+            title="title 2", body="post 2", category=cate, author=user,
+            created_time=datetime(year=2020, month=7, day=10),
+        )
+        self.post3 = Post.objects.create(
+            title="title 3", body="post 3", category=cate, author=user,
+            created_time=datetime(year=2020, month=7, day=31),
+        )
+        self.url = reverse("v1:post-archives")
+
+    def test_list_archive(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "2020-07": [
+                        {"id": self.post3.pk, "title": "title 3", "created_time": "2020-07-31 00:00:00"},
+                        {"id": self.post2.pk, "title": "title 2", "created_time": "2020-07-10 00:00:00"},
+                    ]
+                },
+                {"2019-12": [{"id": self.post1.pk, "title": "title 1", "created_time": "2019-12-31 08:00:00"}]},
+            ],
+        )
+
+    def test_list_archive_by_year(self):
+        response = self.client.get(self.url, {"year": 2019})
+        self.assertEqual(list(response.data[0]), ["2019-12"])
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(self.url, {"year": 2018})
+        self.assertEqual(response.data, [])
+        response = self.client.get(self.url, {"year": "abc"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_posts_by_created_date(self):
+        url = reverse("v1:post-list")
+        cases = [
+            ({"created_year": 2020}, [self.post3, self.post2]),
+            ({"created_year": 2019, "created_month": 12}, [self.post1]),
+            ({"created_year": 2020, "created_month": 12}, []),
+            ({"created_month": 7}, [self.post3, self.post2]),
+            ({"created_year": 2020, "created_month": 13}, []),
+        ]
+        for params, posts in cases:
+            response = self.client.get(url, params)
+            self.assertEqual(
+                [post["id"] for post in response.data["results"]], [post.pk for post in posts], params
+            )
+
+    def test_archive_is_cached_and_invalidated(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertEqual(len([q for q in queries.captured_queries if "blog_post" in q["sql"]]), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any("blog_post" in q["sql"] for q in queries.captured_queries))
+
+        self.post1.title = "new title"
+        self.post1.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[-1]["2019-12"][0]["title"], "new title")
+        self.post1.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.data[-1]), ["2020-07"])
+
+
+class AllCommentsTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="category 1")
+        self.post = Post.objects.create(title="title 1", body="post 1", category=cate, author=user)
+        self.roots = []
+        for i in range(3):
+            root = self.comment(created_time=datetime(2020, 7, 10 + i))
+            reply = self.comment(parent=root, created_time=datetime(2020, 7, 20 + i))
+            self.comment(parent=reply, created_time=datetime(2020, 7, 25 + i))
+            self.roots.append(root)
+        self.url = reverse("v1:post-allcomments", kwargs={"pk": self.post.pk})
+
+    def comment(self, **kwargs):
+        return Comment.objects.create(
+            name="评论者", email="a@a.com", content="评论内容", post=self.post, **kwargs
+        )
+
+    def test_list_all_comments(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c["id"] for c in response.data], [r.pk for r in reversed(self.roots)])
+        self.assertEqual(len(response.data[0]["children"][0]["children"]), 1)
+
+    def test_paginate_by_root_comments(self):
+        response = self.client.get(self.url, {"limit": 2, "offset": 1})
+        self.assertEqual(response.data["count"], 3)
+        results = response.data["results"]
+        self.assertEqual([c["id"] for c in results], [self.roots[1].pk, self.roots[0].pk])
+        self.assertEqual(len(results[0]["children"][0]["children"]), 1)
+
+    def test_filter_by_depth(self):
+        response = self.client.get(self.url, {"limit": 10, "depth": 1})
+        self.assertNotIn("children", response.data["results"][0]["children"][0])
+        response = self.client.get(self.url, {"depth": "a"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CommentThreadsTestCase(AllCommentsTestCase):
+    @override_settings(COMMENT_THREAD_REPLIES=1)
+    def test_list_threads(self):
+        url = reverse("v1:post-threads", kwargs={"pk": self.post.pk})
+        response = self.client.get(url, {"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 3)
+        results = response.data["results"]
+        self.assertEqual([c["id"] for c in results], [self.roots[2].pk, self.roots[1].pk])
+        self.assertEqual(results[0]["reply_count"], 2)
+        self.assertEqual(len(results[0]["replies"]), 1)
+        self.assertEqual(results[0]["replies"][0]["reply_count"], 1)
+
+    def test_list_threads_queries_are_bounded(self):
+        url = reverse("v1:post-threads", kwargs={"pk": self.post.pk})
+        # 文章、计数、顶层评论、回复各一次，与顶层评论数无关
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+
+class TreeHoleFeedTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.aug = TreeHole.objects.create(content="八月", created_time=datetime(2020, 8, 10))
+        self.reply = TreeHole.objects.create(
+            content="九月的回复", parent=self.aug, created_time=datetime(2020, 9, 2)
+        )
+        self.jul = TreeHole.objects.create(content="七月", created_time=datetime(2020, 7, 31))
+        self.jun = TreeHole.objects.create(content="六月", created_time=datetime(2020, 6, 1))
+        self.url = reverse("v2:treeholes-alltreeholes")
+
+    def test_v1_returns_all_months(self):
+        response = self.client.get(reverse("v1:treeholes-alltreeholes"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([list(r)[0] for r in response.data], ["2020-08", "2020-07", "2020-06"])
+        self.assertEqual(response.data[0]["2020-08"][0]["children"][0]["id"], self.reply.pk)
+
+    def test_paginate_by_month(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 回复挂在顶层树洞下，按顶层树洞的月份归档
+        self.assertEqual(list(response.data["results"][0]), ["2020-08"])
+        treeholes = response.data["results"][0]["2020-08"]
+        self.assertEqual([t["id"] for t in treeholes], [self.aug.pk])
+        self.assertEqual(treeholes[0]["children"][0]["id"], self.reply.pk)
+
+        response = self.client.get(response.data["next"] + "&months=2")
+        self.assertEqual([list(r)[0] for r in response.data["results"]], ["2020-07", "2020-06"])
+        self.assertIsNone(response.data["next"])
+
+    def test_get_month(self):
+        response = self.client.get(self.url, {"month": "2020-07"})
+        self.assertEqual(response.data["results"], [{"2020-07": [
+            {
+                "id": self.jul.pk,
+                "content": "七月",
+                "parent": None,
+                "created_time": "2020-07-31 00:00:00",
+                "children": None,
+            }
+        ]}])
+        response = self.client.get(self.url, {"month": "2020-13"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"months": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_month_cache_invalidation(self):
+        self.client.get(self.url, {"month": "2020-08"})
+        self.client.get(self.url, {"month": "2020-07"})
+        TreeHole.objects.create(content="新回复", parent=self.reply)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"month": "2020-07"})
+        # 七月的缓存不受八月树洞变化的影响
+        self.assertEqual(len(queries), 0)
+        response = self.client.get(self.url, {"month": "2020-08"})
+        children = response.data["results"][0]["2020-08"][0]["children"]
+        self.assertEqual(children[0]["children"][0]["content"], "新回复")
+
+        self.jun.delete()
+        response = self.client.get(self.url, {"months": 12})
+        self.assertEqual([list(r)[0] for r in response.data["results"]], ["2020-08", "2020-07"])
+
+
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate1 = Category.objects.create(name="category 1")
+        cate2 = Category.objects.create(name="category 2")
+        # 发布时间两两相同，检验游标在排序字段的值重复时是否稳定
+        self.posts = [
+            Post.objects.create(
+                title="title %d" % i,
+                body="post %d" % i,
+                category=self.cate1 if i % 3 else cate2,
+                author=user,
+                pub_time=datetime(2020, 7, 1 + i // 2),
+            )
+            for i in range(9)
+        ]
+        self.url = reverse("v2:post-list")
+
+    def collect(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        pages = [[item["id"] for item in response.data["results"]]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            pages.append([item["id"] for item in response.data["results"]])
+        return pages
+
+    def test_list_posts_with_cursor(self):
+        pages = self.collect(self.url, {"page_size": 2})
+        self.assertEqual(len(pages), 5)
+        expected = sorted(self.posts, key=lambda post: (post.pub_time, post.pk), reverse=True)
+        self.assertEqual(sum(pages, []), [post.pk for post in expected])
+
+        # 上一页
+        response = self.client.get(self.url, {"page_size": 2})
+        response = self.client.get(response.data["next"])
+        response = self.client.get(response.data["previous"])
+        self.assertEqual([item["id"] for item in response.data["results"]], pages[0])
+
+    def test_cursor_with_filter_and_ordering(self):
+        for post in self.posts[:4]:
+            post.increase_like_count()
+        pages = self.collect(
+            self.url, {"page_size": 2, "category": self.cate1.pk, "ordering": "-like_count"}
+        )
+        ids = sum(pages, [])
+        liked = [post.pk for post in self.posts[:4] if post.category == self.cate1]
+        self.assertEqual(sorted(ids[: len(liked)]), sorted(liked))
+        self.assertEqual(sorted(ids), sorted(post.pk for post in self.posts if post.category == self.cate1))
+
+    def test_list_comments_with_cursor(self):
+        post = self.posts[0]
+        comments = [
+            Comment.objects.create(
+                name="评论者", email="a@a.com", content="评论", post=post,
+                created_time=datetime(2020, 7, 1 + i // 3),
+            )
+            for i in range(5)
+        ]
+        url = reverse("v2:post-comment", kwargs={"pk": post.pk})
+        pages = self.collect(url, {"page_size": 2})
+        expected = sorted(comments, key=lambda c: (c.created_time, c.pk), reverse=True)
+        self.assertEqual(sum(pages, []), [c.pk for c in expected])
+
+    def test_v1_keeps_page_number_pagination(self):
+        response = self.client.get(reverse("v1:post-list"), {"page": 1})
+        self.assertEqual(response.data["count"], 9)
+        self.assertEqual(len(response.data["results"]), 9)
+        response = self.client.get(reverse("v1:post-comment", kwargs={"pk": self.posts[0].pk}))
+        self.assertEqual(response.data["count"], 0)
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="category 1")
+        self.tag = Tag.objects.create(name="tag1")
+        self.post1 = Post.objects.create(title="title 1", body="post 1", category=self.cate, author=user)
+        self.post2 = Post.objects.create(title="title 2", body="post 2", category=self.cate, author=user)
+        self.post1.tags.add(self.tag)
+        self.list_url = reverse("v1:post-list")
+        self.detail_url1 = reverse("v1:post-detail", kwargs={"pk": self.post1.pk})
+        self.detail_url2 = reverse("v1:post-detail", kwargs={"pk": self.post2.pk})
+
+    def assertCached(self, url, cached=True):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if cached:
+            self.assertEqual(len(queries), 0)
+        else:
+            self.assertGreater(len(queries), 0)
+        return response
+
+    def test_cached_until_dependency_changes(self):
+        for url in [self.list_url, self.detail_url1, self.detail_url2]:
+            self.assertCached(url, cached=False)
+            self.assertCached(url)
+
+        self.post1.title = "new title"
+        self.post1.save()
+        response = self.assertCached(self.detail_url1, cached=False)
+        self.assertEqual(response.data["title"], "new title")
+        self.assertEqual(self.assertCached(self.list_url, cached=False).data["results"][1]["title"], "new title")
+        # 不依赖 post1 的缓存不受影响
+        self.assertCached(self.detail_url2)
+
+    def test_list_membership(self):
+        self.assertCached(self.list_url, cached=False)
+        Post.objects.create(title="title 3", body="post 3", category=self.cate, author=self.post1.author)
+        self.assertEqual(self.assertCached(self.list_url, cached=False).data["count"], 3)
+
+    def test_tag_and_category_changes(self):
+        self.assertCached(self.detail_url1, cached=False)
+        self.assertCached(self.detail_url2, cached=False)
+        self.tag.name = "new tag"
+        self.tag.save()
+        response = self.assertCached(self.detail_url1, cached=False)
+        self.assertEqual(response.data["tags"][0]["name"], "new tag")
+        self.assertCached(self.detail_url2)
+
+        self.post2.tags.add(self.tag)
+        self.assertEqual(len(self.assertCached(self.detail_url2, cached=False).data["tags"]), 1)
+
+        self.cate.name = "new category"
+        self.cate.save()
+        response = self.assertCached(self.detail_url2, cached=False)
+        self.assertEqual(response.data["category"]["name"], "new category")
+
+    def test_counts_are_live(self):
+        self.assertEqual(self.assertCached(self.detail_url1, cached=False).data["views"], 1)
+        self.assertEqual(self.assertCached(self.detail_url1).data["views"], 2)
+        self.post1.increase_like_count()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.data["results"][1]["views"], 2)
+        self.assertEqual(response.data["results"][1]["like_count"], 1)
+
+    def test_comments(self):
+        url1 = reverse("v1:post-comment", kwargs={"pk": self.post1.pk})
+        url2 = reverse("v1:post-comment", kwargs={"pk": self.post2.pk})
+        self.assertCached(url1, cached=False)
+        self.assertCached(url2, cached=False)
+        Comment.objects.create(name="name", email="a@b.com", content="comment", post=self.post1)
+        self.assertEqual(self.assertCached(url1, cached=False).data["count"], 1)
+        self.assertCached(url2)
+
+    def test_count_endpoints(self):
+        url = reverse("v1:category-getCategoryAndCount")
+        self.assertEqual(self.assertCached(url, cached=False).data[0]["num_posts"], 2)
+        self.assertCached(url)
+        self.post2.delete()
+        self.assertEqual(self.assertCached(url, cached=False).data[0]["num_posts"], 1)
+
+        url = reverse("v1:tag-getTagsAndCount")
+        self.assertEqual(self.assertCached(url, cached=False).data[0]["num_posts"], 1)
+        self.post1.tags.clear()
+        self.assertEqual(self.assertCached(url, cached=False).data, [])
+
+    def test_ordered_by_counters_not_cached(self):
+        url = self.list_url + "?ordering=-views"
+        self.assertCached(url, cached=False)
+        self.assertCached(url, cached=False)
+
+    def test_stats(self):
+        self.client.get(self.detail_url1)
+        self.client.get(self.detail_url1)
+        stats = response_cache.stats()
+        self.assertGreaterEqual(stats["post-detail"]["hits"], 1)
+        self.assertGreater(stats["hit_ratio"], 0)
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="category 1")
+        self.post = Post.objects.create(title="title 1", body="post 1", category=self.cate, author=user)
+        self.about = About.objects.create(body="# 关于我")
+        self.list_url = reverse("v1:post-list")
+        self.detail_url = reverse("v1:post-detail", kwargs={"pk": self.post.pk})
+        self.about_url = reverse("v1:about-about-info")
+
+    def assertNotModified(self, url, modified=False, **headers):
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"], **headers)
+        if modified:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        else:
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b"")
+        return queries
+
+    def get_later(self, url):
+        # 修改发生在当前这一秒内时不返回 Last-Modified，先生成响应缓存，再模拟一段时间之后的请求
+        self.client.get(url)
+        with mock.patch("blog.conditional.time.time", return_value=time.time() + 2):
+            return self.client.get(url)
+
+    def test_validators(self):
+        for url in [self.list_url, self.detail_url, self.about_url]:
+            response = self.get_later(url)
+            self.assertTrue(response["ETag"].startswith('W/"'))
+            self.assertIn("Last-Modified", response)
+            # 文章的校验只读取缓存，关于我只取出一行，不渲染 Markdown
+            self.assertLessEqual(len(self.assertNotModified(url)), 1)
+
+    def test_if_modified_since(self):
+        last_modified = self.get_later(self.detail_url)["Last-Modified"]
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_edits_within_one_second(self):
+        # 第一次修改后立即请求，同一秒内又修改一次
+        first = make_validators(["first"], [1000.2])
+        second = make_validators(["second"], [1000.7])
+        with mock.patch("blog.conditional.time.time", return_value=1000.4):
+            response = set_validators(HttpResponse(), first)
+        self.assertNotIn("Last-Modified", response)
+        request = RequestFactory().get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertIsNone(not_modified(request, second))
+
+        # 修改时间早于当前这一秒时返回向下取整的 Last-Modified，按整秒比较
+        with mock.patch("blog.conditional.time.time", return_value=1001.5):
+            response = set_validators(HttpResponse(), second)
+        self.assertEqual(response["Last-Modified"], http_date(1000))
+        request = RequestFactory().get("/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified(request, second).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIsNone(not_modified(request, make_validators(["third"], [1001.1])))
+
+    def test_changes(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        self.post.title = "new title"
+        self.post.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["title"], "new title")
+
+        etag = self.client.get(self.list_url)["ETag"]
+        self.cate.name = "new category"
+        self.cate.save()
+        self.assertEqual(self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(self.about_url)["ETag"]
+        self.about.body = "# 新的关于我"
+        self.about.save()
+        self.assertEqual(self.client.get(self.about_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_rerendered(self):
+        # rerender_posts 直接批量写回 body_html，不经过 Post.save
+        etags = {url: self.client.get(url)["ETag"] for url in [self.list_url, self.detail_url]}
+        Post.objects.filter(pk=self.post.pk).update(body="# 重新渲染的正文")
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        for url, etag in etags.items():
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        self.assertIn("重新渲染的正文", self.client.get(self.detail_url).data["body_html"])
+
+    def test_not_modified_counts_view(self):
+        self.assertNotModified(self.detail_url)
+        self.assertEqual(self.client.get(self.detail_url).data["views"], 3)
+
+    def test_ordered_by_counters(self):
+        self.assertNotIn("ETag", self.client.get(self.list_url + "?ordering=-views"))
+
+    def test_not_found(self):
+        url = reverse("v1:post-detail", kwargs={"pk": 100})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        About.objects.all().delete()
+        self.assertEqual(self.client.get(self.about_url).status_code, status.HTTP_404_NOT_FOUND)
+
+
 class CategoryViewSetTestCase(APITestCase):
     def setUp(self) -> None:
         self.cate1 = Category.objects.create(name="category 1")
@@ -164,3 +710,25 @@ class TagViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         serializer = CategorySerializer([self.tag1, self.tag2], many=True)
         self.assertEqual(response.data, serializer.data)
+
+
+class MetricsViewSetTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+
+    def test_only_admin_can_access(self):
+        url = reverse("v1:metrics-list")
+        response = self.client.get(url)
+        self.assertIn(
+            response.status_code,
+            [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN],
+        )
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("render_cache", response.data)
+        self.assertIn("hit_ratio", response.data["render_cache"])
+        self.assertIn("hit_ratio", response.data["response_cache"])
@@ -0,0 +1,114 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from ..cache_backends import CacheEntry, TwoTierCache, shared_only
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.back = caches["shared"]
+        self.back.clear()
+        self.cache = self.make_cache()
+        self.cache.clear()
+
+    def make_cache(self, **options):
+        options.setdefault("BACK", "shared")
+        return TwoTierCache("test", {"OPTIONS": options})
+
+    def test_read_through(self):
+        self.back.set("key", {"a": 1})
+        self.assertEqual(self.cache.get("key"), {"a": 1})
+        # 之后从进程内缓存读取，修改取出的对象不影响缓存
+        self.cache.get("key")["a"] = 2
+        with mock.patch.object(self.back, "get") as back_get:
+            self.assertEqual(self.cache.get("key"), {"a": 1})
+        back_get.assert_not_called()
+        self.assertEqual(self.cache.get("missing", "default"), "default")
+
+    def test_front_expires(self):
+        self.cache.set("key", 1)
+        # 模拟其它进程修改了共享缓存
+        self.back.set("key", 2)
+        self.assertEqual(self.cache.get("key"), 1)
+        with mock.patch("blog.cache_backends.time.time", return_value=time.time() + 6):
+            self.assertEqual(self.cache.get("key"), 2)
+
+    def test_get_many(self):
+        self.cache.set("a", 1)
+        self.back.set("b", 2)
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+
+    def test_writes_go_to_both_tiers(self):
+        self.cache.set_many({"a": 1, "b": 2})
+        self.assertEqual(self.back.get_many(["a", "b"]), {"a": 1, "b": 2})
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.incr("b"), 3)
+        self.assertEqual(self.cache.get("b"), 3)
+        self.assertFalse(self.cache.add("b", 10))
+        self.assertTrue(self.cache.add("c", 10))
+        self.assertEqual(self.back.get("c"), 10)
+
+    def test_front_max_bytes(self):
+        # 进程内缓存按位置共用，用单独的位置才能使用不同的容量
+        cache = TwoTierCache("test_front_max_bytes", {"OPTIONS": {"BACK": "shared", "FRONT_MAX_BYTES": 1000}})
+        cache.clear()
+        for i in range(10):
+            cache.set("key%d" % i, "x" * 300)
+        self.assertLessEqual(cache.front.current_bytes, 1000)
+        self.assertGreaterEqual(cache.front.current_bytes, 300 * len(cache.front))
+        self.assertNotIn(cache.make_key("key0"), cache.front)
+        self.assertIn(cache.make_key("key9"), cache.front)
+        # 超过容量的值只放在共享缓存中
+        cache.set("big", "x" * 2000)
+        self.assertNotIn(cache.make_key("big"), cache.front)
+        self.assertEqual(cache.get("big"), "x" * 2000)
+        self.assertEqual(cache.get("key0"), "x" * 300)
+
+    def test_shared_only(self):
+        shared_only("test_shared:")
+        self.cache.set("test_shared:key", 1)
+        self.back.set("test_shared:key", 2)
+        self.assertEqual(self.cache.get("test_shared:key"), 2)
+
+    def test_get_or_set_caches_none(self):
+        func = mock.Mock(return_value=None)
+        self.assertIsNone(self.cache.get_or_set("key", func, 60))
+        self.assertIsNone(self.cache.get_or_set("key", func, 60))
+        func.assert_called_once_with()
+        self.assertIsInstance(self.back.get("key"), CacheEntry)
+
+    def test_single_flight(self):
+        # 模拟其它进程正在计算：锁已被占用，稍后写入结果
+        self.back.add("key:lock", 1)
+        timer = threading.Timer(0.1, lambda: self.back.set("key", "computed elsewhere"))
+        timer.start()
+        func = mock.Mock(return_value="computed here")
+        self.assertEqual(self.cache.get_or_set("key", func, 60), "computed elsewhere")
+        func.assert_not_called()
+        timer.join()
+
+    def test_lock_timeout(self):
+        cache = self.make_cache(LOCK_TIMEOUT=0.1)
+        self.back.add("key:lock", 1)
+        self.assertEqual(cache.get_or_set("key", lambda: "value", 60), "value")
+
+    def test_early_recompute(self):
+        now = time.time()
+        self.back.set("key", CacheEntry("old", 1.0, now + 0.5))
+        with mock.patch("blog.cache_backends.random.random", return_value=0.9):
+            # 离过期很远时不会提前重算
+            self.assertFalse(self.cache.should_recompute(CacheEntry("old", 1.0, now + 60)))
+            self.assertEqual(self.cache.get_or_set("key", lambda: "new", 60), "new")
+        self.assertEqual(self.cache.get("key"), "new")
+
+    def test_early_recompute_in_progress(self):
+        self.back.set("key", CacheEntry("old", 1.0, time.time() + 0.5))
+        self.back.add("key:lock", 1)
+        with mock.patch("blog.cache_backends.random.random", return_value=0.9):
+            # 其它进程正在重算，直接使用当前值
+            self.assertEqual(self.cache.get_or_set("key", lambda: "new", 60), "old")
@@ -0,0 +1,203 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..models import About, Category, Post, Tag
+from ..rendering import render_cache
+from ..response_cache import response_cache
+
+
+class RerenderPostsCommandTestCase(TestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="测试")
+        self.post1 = Post.objects.create(
+            title="测试标题一", body="# 标题一", category=cate, author=user,
+        )
+        self.post2 = Post.objects.create(
+            title="测试标题二", body="# 标题二", category=cate, author=user,
+        )
+        # 模拟新增字段后尚未回填的存量数据
+        Post.objects.update(body_html="", toc="")
+
+    def test_backfill_all_posts(self):
+        out = StringIO()
+        call_command("rerender_posts", "--workers", "1", stdout=out)
+        self.assertIn("2", out.getvalue())
+
+        self.post1.refresh_from_db()
+        self.assertHTMLEqual(self.post1.body_html, "<h1 id='标题一'>标题一</h1>")
+        self.assertHTMLEqual(self.post1.toc, '<li><a href="#标题一">标题一</li>')
+
+    def test_invalidates_caches(self):
+        cache.set("post_updated_at", timezone.datetime(2000, 1, 1), None)
+        tags = ["post:%s" % self.post1.pk, "post:list"]
+        cache.set_many({response_cache.make_tag_key(tag): 0 for tag in tags}, None)
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        self.assertGreater(cache.get("post_updated_at"), timezone.datetime(2000, 1, 1))
+        self.assertTrue(all(response_cache.updated_at(tags, 0).values()))
+
+    def test_missing_only(self):
+        Post.objects.filter(pk=self.post2.pk).update(body_html="<p>stale</p>")
+        call_command("rerender_posts", "--missing-only", "--workers", "1", stdout=StringIO())
+
+        self.post1.refresh_from_db()
+        self.post2.refresh_from_db()
+        self.assertHTMLEqual(self.post1.body_html, "<h1 id='标题一'>标题一</h1>")
+        self.assertEqual(self.post2.body_html, "<p>stale</p>")
+
+    def test_does_not_touch_modified_time(self):
+        modified_time = Post.objects.get(pk=self.post1.pk).modified_time
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.modified_time, modified_time)
+
+    def test_since(self):
+        Post.objects.filter(pk=self.post1.pk).update(
+            modified_time=timezone.now() - timedelta(days=10)
+        )
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        call_command("rerender_posts", "--since", since, "--workers", "1", stdout=StringIO())
+
+        self.post1.refresh_from_db()
+        self.post2.refresh_from_db()
+        self.assertEqual(self.post1.body_html, "")
+        self.assertHTMLEqual(self.post2.body_html, "<h1 id='标题二'>标题二</h1>")
+
+    def test_invalid_since(self):
+        with self.assertRaises(CommandError):
+            call_command("rerender_posts", "--since", "yesterday", stdout=StringIO())
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = os.path.join(tmp_dir, "rerender.json")
+            with open(checkpoint, "w") as f:
+                json.dump(
+                    {"last_pk": self.post1.pk, "options": {"since": None, "missing_only": False}}, f
+                )
+            out = StringIO()
+            call_command(
+                "rerender_posts", "--checkpoint", checkpoint, "--workers", "1", stdout=out
+            )
+            # 全部完成后删除断点文件
+            self.assertFalse(os.path.exists(checkpoint))
+
+        self.assertIn("已重新渲染 1 篇文章", out.getvalue())
+        self.post1.refresh_from_db()
+        self.post2.refresh_from_db()
+        self.assertEqual(self.post1.body_html, "")
+        self.assertHTMLEqual(self.post2.body_html, "<h1 id='标题二'>标题二</h1>")
+
+    def test_checkpoint_with_other_options(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = os.path.join(tmp_dir, "rerender.json")
+            with open(checkpoint, "w") as f:
+                json.dump({"last_pk": 1, "options": {"since": None, "missing_only": True}}, f)
+            with self.assertRaises(CommandError):
+                call_command("rerender_posts", "--checkpoint", checkpoint, stdout=StringIO())
+
+    def test_warm_about_render_cache(self):
+        about = About.objects.create(body="# 关于我")
+        render_cache.clear()
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        self.assertIsNotNone(render_cache.local.get(render_cache.make_key(about.body)))
+
+    def test_replaces_stale_render_cache(self):
+        # 渲染输出改变而配置指纹不变时，缓存中是旧的结果
+        key = render_cache.make_key(self.post1.body)
+        stale = {"content": "<p>旧的渲染结果</p>", "toc": "", "text": "旧的渲染结果", "excerpt": "旧的渲染结果"}
+        render_cache.set(key, stale)
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        self.post1.refresh_from_db()
+        self.assertHTMLEqual(self.post1.body_html, "<h1 id='标题一'>标题一</h1>")
+        self.assertHTMLEqual(render_cache.get(key)["content"], "<h1 id='标题一'>标题一</h1>")
+
+        # --use-cache 时直接使用缓存中的结果
+        render_cache.set(key, stale)
+        call_command("rerender_posts", "--use-cache", "--workers", "1", stdout=StringIO())
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.body_html, stale["content"])
+
+    def test_render_in_process_pool(self):
+        out = StringIO()
+        call_command("rerender_posts", "--workers", "2", "--batch-size", "1", stdout=out)
+        self.assertIn("已重新渲染 2 篇文章", out.getvalue())
+        self.post2.refresh_from_db()
+        self.assertHTMLEqual(self.post2.body_html, "<h1 id='标题二'>标题二</h1>")
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class FlushViewsCommandTestCase(TestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="测试")
+        self.post = Post.objects.create(title="测试标题", body="正文", category=cate, author=user)
+
+    def test_flush_views(self):
+        self.post.increase_views()
+        self.post.increase_views()
+        out = StringIO()
+        call_command("flush_views", stdout=out)
+        self.assertIn("已写回 2 次阅读", out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 2)
+        self.assertEqual(self.post.view_count, 2)
+
+
+class ReconcileNumPostsCommandTestCase(TestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="测试")
+        self.tag = Tag.objects.create(name="测试")
+        for i in range(2):
+            post = Post.objects.create(title="测试标题", body="正文", category=self.cate, author=user)
+            post.tags.add(self.tag)
+        # 模拟不经过 Post.save 的批量修改造成的偏差
+        Category.objects.update(num_posts=5)
+        Tag.objects.update(num_posts=0)
+
+    def test_reconcile(self):
+        out = StringIO()
+        call_command("reconcile_num_posts", stdout=out)
+        self.assertIn("已修复 2 条记录的文章数", out.getvalue())
+        self.cate.refresh_from_db()
+        self.tag.refresh_from_db()
+        self.assertEqual(self.cate.num_posts, 2)
+        self.assertEqual(self.tag.num_posts, 2)
+
+    def test_invalidates_caches(self):
+        cache.set("post_updated_at", timezone.datetime(2000, 1, 1), None)
+        tags = ["category:list", "tag:list"]
+        cache.set_many({response_cache.make_tag_key(tag): 0 for tag in tags}, None)
+        call_command("reconcile_num_posts", "--dry-run", stdout=StringIO())
+        self.assertEqual(cache.get("post_updated_at"), timezone.datetime(2000, 1, 1))
+        call_command("reconcile_num_posts", stdout=StringIO())
+        self.assertGreater(cache.get("post_updated_at"), timezone.datetime(2000, 1, 1))
+        self.assertTrue(all(response_cache.updated_at(tags, 0).values()))
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("reconcile_num_posts", "--dry-run", stdout=out)
+        self.assertIn("分类「测试」：5 -> 2", out.getvalue())
+        self.cate.refresh_from_db()
+        self.assertEqual(self.cate.num_posts, 5)
@@ -0,0 +1,93 @@
+import time
+from datetime import date, datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .. import metrics
+from ..memoize import memoize, stable_hash
+from ..models import Category
+
+
+class MemoizeTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.func = mock.Mock(side_effect=lambda *args, **kwargs: len(self.func.call_args_list))
+
+    def memoize(self, namespace, **options):
+        def func(year=None, month=None):
+            return self.func(year, month)
+
+        # 命名空间不能重复，每个测试用自己的命名空间
+        return memoize("test.%s.%s" % (self._testMethodName, namespace), **options)(func)
+
+    def test_stable_hash(self):
+        self.assertEqual(stable_hash({"a": 1, "b": [2, 3]}), stable_hash({"b": [2, 3], "a": 1}))
+        self.assertEqual(stable_hash({3, 1, 2}), stable_hash({2, 3, 1}))
+        self.assertNotEqual(stable_hash(1), stable_hash("1"))
+        # 字典的键保留类型
+        self.assertNotEqual(stable_hash({1: "x"}), stable_hash({"1": "x"}))
+        self.assertNotEqual(stable_hash({"a": 1}), stable_hash([["a", 1]]))
+        self.assertEqual(stable_hash(Category(pk=1, name="a")), stable_hash(Category(pk=1, name="b")))
+        self.assertNotEqual(stable_hash(date(2020, 1, 1)), stable_hash(datetime(2020, 1, 1)))
+        with self.assertRaises(TypeError):
+            stable_hash(object())
+
+    def test_hit_and_miss(self):
+        func = self.memoize("hit")
+        self.assertEqual(func(1), 1)
+        self.assertEqual(func(1), 1)
+        self.assertEqual(func(2), 2)
+        # 按参数名绑定并补上默认值，调用方式不同但参数相同时命中同一个缓存
+        self.assertEqual(func(year=1), 1)
+        self.assertEqual(func(1, None), 1)
+        self.assertEqual(func(month=1), 3)
+        self.assertEqual(func.stats()["hits"], 3)
+        self.assertEqual(func.stats()["misses"], 3)
+        self.assertIn(func.namespace, metrics.collect()["memoize"])
+
+    def test_duplicate_namespace(self):
+        self.memoize("duplicate")
+        with self.assertRaises(ValueError):
+            self.memoize("duplicate")
+
+    def test_bump(self):
+        func = self.memoize("bump")
+        func()
+        func.bump()
+        self.assertEqual(func(), 2)
+        self.assertEqual(func(), 2)
+
+    def test_depends_on(self):
+        func = self.memoize("depends", depends_on=["test_updated_at"])
+        func()
+        cache.set("test_updated_at", datetime(2100, 1, 1), None)
+        self.assertEqual(func(), 2)
+
+    def test_negative_timeout(self):
+        self.func.side_effect = None
+        self.func.return_value = None
+        func = self.memoize("negative", timeout=600, negative_timeout=10)
+        self.assertIsNone(func())
+        self.assertIsNone(func())
+        self.func.assert_called_once_with(None, None)
+        with mock.patch("blog.memoize.time.time", return_value=time.time() + 15):
+            func()
+        self.assertEqual(self.func.call_count, 2)
+
+    def test_stale_while_revalidate(self):
+        func = self.memoize("stale", timeout=10, stale_timeout=60)
+        func()
+        with mock.patch("blog.memoize.time.time", return_value=time.time() + 15):
+            # 过期后先返回旧值，在后台重新计算
+            self.assertEqual(func(), 1)
+            func._refresh_thread.join()
+            self.assertEqual(func(), 2)
+        self.assertEqual(func.stats()["stale_hits"], 1)
+
+    def test_expired_beyond_stale_timeout(self):
+        func = self.memoize("expired", timeout=10, stale_timeout=5)
+        func()
+        with mock.patch("blog.memoize.time.time", return_value=time.time() + 20):
+            self.assertEqual(func(), 2)
@@ -1,9 +1,14 @@
+from unittest import mock
+
 from django.apps import apps
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
-from ..models import Category, Post, Tag
+from .. import rendering
+from ..counters import post_counters, prefetch_counts, view_counter
+from ..models import Category, Post, PostCounter, Tag
 from ..search_indexes import PostIndex
 
 
@@ -51,18 +56,187 @@ class PostModelTestCase(TestCase):
         self.assertIsNotNone(self.post.excerpt)
         self.assertTrue(0 < len(self.post.excerpt) <= 54)
 
+    def test_auto_populate_body_html_and_toc(self):
+        self.post.body = "# 标题\n\n正文"
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertHTMLEqual(
+            self.post.body_html, "<h1 id='标题'>标题</h1><p>正文</p>"
+        )
+        self.assertHTMLEqual(self.post.toc, '<li><a href="#标题">标题</li>')
+
+    def test_render_body_once_on_save(self):
+        with mock.patch(
+            "blog.rendering.render_markdown_incremental", wraps=rendering.render_markdown_incremental
+        ) as render:
+            self.post.body = "# 只渲染一次的标题\n\n正文"
+            self.post.save()
+        render.assert_called_once()
+        self.assertEqual(self.post.excerpt, "只渲染一次的标题\n正文")
+
+    def test_partial_update_does_not_rerender_body(self):
+        Post.objects.filter(pk=self.post.pk).update(body_html="")
+        self.post.refresh_from_db()
+        self.post.save(update_fields=["title"])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.body_html, "")
+
     def test_get_absolute_url(self):
         expected_url = reverse("blog:detail", kwargs={"pk": self.post.pk})
         self.assertEqual(self.post.get_absolute_url(), expected_url)
 
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
     def test_increase_views(self):
+        cache.clear()
+        self.post.increase_views()
         self.post.increase_views()
         self.post.refresh_from_db()
-        self.assertEqual(self.post.views, 1)
+        self.assertEqual(self.post.views, 0)
+        self.assertEqual(self.post.view_count, 2)
 
-        self.post.increase_views()
+        self.assertEqual(view_counter.flush_dirty(), 2)
         self.post.refresh_from_db()
         self.assertEqual(self.post.views, 2)
+        self.assertEqual(self.post.view_count, 2)
+
+        # 写回期间新增的访问不会丢失
+        self.post.increase_views()
+        self.assertEqual(view_counter.flush([self.post.pk]), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+    def test_flush_views_skipped_while_locked(self):
+        cache.clear()
+        self.post.increase_views()
+        cache.add(view_counter.lock_key, 1)
+        self.assertIsNone(view_counter.flush([self.post.pk]))
+        cache.delete(view_counter.lock_key)
+        self.assertEqual(view_counter.flush([self.post.pk]), 1)
+
+
+class NumPostsTestCase(TestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        self.user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate1 = Category.objects.create(name="分类一")
+        self.cate2 = Category.objects.create(name="分类二")
+        self.tag1 = Tag.objects.create(name="标签一")
+        self.tag2 = Tag.objects.create(name="标签二")
+        self.post = self.create_post()
+
+    def create_post(self):
+        return Post.objects.create(
+            title="测试标题", body="测试内容", category=self.cate1, author=self.user
+        )
+
+    def assertNumPosts(self, obj, expected):
+        obj.refresh_from_db()
+        self.assertEqual(obj.num_posts, expected)
+
+    def test_create_and_change_category(self):
+        self.create_post()
+        self.assertNumPosts(self.cate1, 2)
+        self.post.category = self.cate2
+        self.post.save()
+        self.assertNumPosts(self.cate1, 1)
+        self.assertNumPosts(self.cate2, 1)
+        # 不涉及分类的保存不改变文章数
+        self.post.save(update_fields=["title"])
+        self.post.save()
+        self.assertNumPosts(self.cate2, 1)
+
+    def test_delete(self):
+        self.post.tags.set([self.tag1, self.tag2])
+        self.create_post().tags.add(self.tag1)
+        self.post.delete()
+        self.assertNumPosts(self.cate1, 1)
+        self.assertNumPosts(self.tag1, 1)
+        self.assertNumPosts(self.tag2, 0)
+        Post.objects.all().delete()
+        self.assertNumPosts(self.cate1, 0)
+        self.assertNumPosts(self.tag1, 0)
+
+    def test_change_tags(self):
+        self.post.tags.add(self.tag1, self.tag2)
+        # 重复添加和删除不存在的关联都不计数
+        self.post.tags.add(self.tag1)
+        self.assertNumPosts(self.tag1, 1)
+        self.post.tags.set([self.tag2])
+        self.assertNumPosts(self.tag1, 0)
+        self.post.tags.remove(self.tag1)
+        self.assertNumPosts(self.tag1, 0)
+        self.assertNumPosts(self.tag2, 1)
+        self.post.tags.clear()
+        self.assertNumPosts(self.tag2, 0)
+
+    def test_save_keeps_num_posts(self):
+        # self.cate1 是创建文章之前取出的，保存时不能覆盖已经更新的文章数
+        self.cate1.name = "新的分类名"
+        self.cate1.save()
+        self.assertNumPosts(self.cate1, 1)
+        self.assertEqual(self.cate1.name, "新的分类名")
+
+    def test_change_posts_of_tag(self):
+        post = self.create_post()
+        self.tag1.post_set.add(self.post, post)
+        self.assertNumPosts(self.tag1, 2)
+        self.tag1.post_set.remove(post)
+        self.assertNumPosts(self.tag1, 1)
+        self.tag1.post_set.clear()
+        self.assertNumPosts(self.tag1, 0)
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0, POST_COUNTER_SHARDS=4)
+class PostCounterTestCase(TestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="测试")
+        self.post = Post.objects.create(title="测试标题", body="正文", category=cate, author=user)
+        self.other = Post.objects.create(title="测试标题二", body="正文", category=cate, author=user)
+
+    def test_increments_spread_over_shards(self):
+        for _ in range(40):
+            self.post.increase_like_count()
+        self.post.increase_comment_count()
+
+        shards = PostCounter.objects.filter(post=self.post)
+        self.assertGreater(shards.count(), 1)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(self.post.like_count, 40)
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.views, 0)
+
+    def test_aggregated_counts_are_cached(self):
+        self.post.increase_like_count()
+        self.assertEqual(post_counters.get(self.post.pk)["like_count"], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(post_counters.get(self.post.pk)["like_count"], 1)
+
+        # 计数变化后缓存失效
+        self.post.increase_like_count()
+        self.assertEqual(post_counters.get(self.post.pk)["like_count"], 2)
+
+    def test_prefetch_counts(self):
+        self.post.increase_like_count()
+        self.other.increase_views()
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(1):
+            prefetch_counts(posts)
+        with self.assertNumQueries(0):
+            counts = {post.pk: (post.like_count, post.view_count) for post in posts}
+        self.assertEqual(counts, {self.post.pk: (1, 0), self.other.pk: (0, 1)})
+
+    def test_delete_post_deletes_counters(self):
+        self.post.increase_like_count()
+        self.post.delete()
+        self.assertFalse(PostCounter.objects.exists())
 
 
 class SearchIndexesTestCase(TestCase):
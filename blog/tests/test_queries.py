@@ -0,0 +1,289 @@
+import warnings
+from datetime import datetime
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory
+
+from comments.models import Comment
+
+from ..filters import PostFilter
+from ..models import About, Category, Post, Tag, TreeHole
+from ..projection import DeferredFieldRefetchWarning
+from ..utils import date_range
+from ..views import IndexPostListAPIView
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class QueryBudgetTestCase(TestCase):
+    """
+    各接口的查询次数不能随数据量（每页文章数、标签数、评论数）增长
+    """
+
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        self.user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="测试分类")
+        self.tags = [Tag.objects.create(name="测试标签%d" % i) for i in range(3)]
+        About.objects.create(body="# 关于")
+        self.post = self.create_posts(1)[0]
+
+    def create_posts(self, num):
+        posts = []
+        for i in range(num):
+            post = Post.objects.create(
+                title="测试标题%d" % i,
+                body="# 标题\n\n正文",
+                category=self.cate,
+                author=self.user,
+                created_time=datetime(2020, i % 12 + 1, 1),
+            )
+            post.tags.set(self.tags[: i % 3 + 1])
+            for j in range(2):
+                comment = Comment.objects.create(
+                    name="评论者", email="a@b.com", content="评论%d" % j, post=post
+                )
+                Comment.objects.create(
+                    name="评论者", email="a@b.com", content="回复", post=post, parent=comment
+                )
+            TreeHole.objects.create(content="树洞%d" % i)
+            posts.append(post)
+        return posts
+
+    def count_queries(self, request):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return len(queries)
+
+    def assertQueryBudget(self, request, budget):
+        """
+        数据量增加前后分别请求一次，查询次数不能增加，且不超过预算
+        """
+        before = self.count_queries(request)
+        self.create_posts(9)
+        after = self.count_queries(request)
+        self.assertEqual(before, after, "查询次数随数据量增长：%d -> %d" % (before, after))
+        self.assertLessEqual(after, budget)
+
+    def get(self, name, **kwargs):
+        return lambda: self.client.get(reverse(name, kwargs=kwargs or None))
+
+    def test_post_list(self):
+        self.assertQueryBudget(self.get("v1:post-list"), 6)
+
+    def test_post_list_ordering_by_counters(self):
+        url = reverse("v1:post-list")
+        self.assertQueryBudget(lambda: self.client.get(url, {"ordering": "-views"}), 6)
+
+    def test_post_detail(self):
+        self.post.tags.set(self.tags)
+        self.assertQueryBudget(self.get("v1:post-detail", pk=self.post.pk), 5)
+
+    @override_settings(POST_COUNTER_SHARDS=1)
+    def test_post_like(self):
+        # 只用一个分片并预先创建，否则随机选中的分片是否已存在会影响查询次数
+        self.post.increase_like_count()
+        url = reverse("v1:post-like", kwargs={"pk": self.post.pk})
+        self.assertQueryBudget(lambda: self.client.put(url), 8)
+
+    def test_post_comments(self):
+        self.assertQueryBudget(self.get("v1:post-comment", pk=self.post.pk), 3)
+
+    def test_post_all_comments(self):
+        self.assertQueryBudget(self.get("v1:post-allcomments", pk=self.post.pk), 2)
+
+    def add_busy_threads(self, num):
+        # 回复数超过 COMMENT_THREAD_REPLIES 的顶层评论
+        for i in range(num):
+            root = Comment.objects.create(name="评论者", email="a@b.com", content="评论%d" % i, post=self.post)
+            for j in range(5):
+                Comment.objects.create(name="评论者", email="a@b.com", content="回复", post=self.post, parent=root)
+
+    def assertThreadQueryBudget(self, request, budget):
+        """
+        回复很多的顶层评论从 2 条增加到 20 条，查询次数不能增加，且不超过预算
+        """
+        self.add_busy_threads(2)
+        before = self.count_queries(request)
+        self.add_busy_threads(18)
+        after = self.count_queries(request)
+        self.assertEqual(before, after, "查询次数随评论数增长：%d -> %d" % (before, after))
+        self.assertLessEqual(after, budget)
+
+    # 一页放得下全部顶层评论，前后都同时有回复多和回复少的顶层评论
+    def test_post_threads(self):
+        url = reverse("v1:post-threads", kwargs={"pk": self.post.pk})
+        self.assertThreadQueryBudget(lambda: self.client.get(url, {"limit": 30}), 5)
+
+    @override_settings(COMMENT_THREAD_ROOTS=30)
+    def test_detail_view_busy_threads(self):
+        self.assertThreadQueryBudget(self.get("blog:detail", pk=self.post.pk), 11)
+
+    def test_post_archive_dates(self):
+        self.assertQueryBudget(self.get("v1:post-archive-date"), 1)
+
+    def test_post_archives(self):
+        self.assertQueryBudget(self.get("v1:post-archives"), 2)
+
+    def test_index_api(self):
+        view = IndexPostListAPIView.as_view()
+        request = APIRequestFactory().get("/")
+        self.assertQueryBudget(lambda: view(request).render(), 5)
+
+    def test_categories(self):
+        self.assertQueryBudget(self.get("v1:category-list"), 1)
+        self.assertQueryBudget(self.get("v1:category-getCategoryAndCount"), 1)
+
+    def test_tags(self):
+        self.assertQueryBudget(self.get("v1:tag-list"), 1)
+        self.assertQueryBudget(self.get("v1:tag-getTagsAndCount"), 1)
+
+    def test_about(self):
+        self.assertQueryBudget(self.get("v1:about-list"), 1)
+        self.assertQueryBudget(self.get("v1:about-about-info"), 1)
+
+    def test_treeholes(self):
+        self.assertQueryBudget(self.get("v1:treeholes-list"), 2)
+        self.assertQueryBudget(self.get("v1:treeholes-alltreeholes"), 3)
+        self.assertQueryBudget(self.get("v2:treeholes-alltreeholes"), 3)
+
+    def test_index_view(self):
+        self.assertQueryBudget(self.get("blog:index"), 8)
+
+    def test_category_view(self):
+        self.assertQueryBudget(self.get("blog:category", pk=self.cate.pk), 9)
+
+    def test_tag_view(self):
+        self.assertQueryBudget(self.get("blog:tag", pk=self.tags[0].pk), 9)
+
+    def test_archive_view(self):
+        self.assertQueryBudget(self.get("blog:archive", year=2020, month=1), 8)
+
+    def test_detail_view(self):
+        self.assertQueryBudget(self.get("blog:detail", pk=self.post.pk), 10)
+
+    def test_rss(self):
+        self.assertQueryBudget(self.get("rss"), 2)
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+class ProjectionTestCase(TestCase):
+    """
+    文章列表类的查询不取出正文，序列化时也不会再去查询没有取出的字段
+    """
+
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="测试分类")
+        tag = Tag.objects.create(name="测试标签")
+        for i in range(3):
+            post = Post.objects.create(
+                title="测试标题%d" % i, body="# 标题\n\n正文", category=cate, author=user
+            )
+            post.tags.add(tag)
+        self.post = post
+
+    def assertBodyNotSelected(self, request):
+        cache.clear()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeferredFieldRefetchWarning)
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+        self.assertLess(response.status_code, 400)
+        for query in queries:
+            self.assertNotIn('"blog_post"."body",', query["sql"])
+            self.assertNotIn('"blog_post"."body" ', query["sql"])
+        return response
+
+    def test_post_list(self):
+        for name in ["v1:post-list", "v2:post-list"]:
+            response = self.assertBodyNotSelected(lambda: self.client.get(reverse(name)))
+            self.assertEqual(len(response.data["results"]), 3)
+
+    def test_post_like(self):
+        url = reverse("v1:post-like", kwargs={"pk": self.post.pk})
+        self.assertBodyNotSelected(lambda: self.client.put(url))
+
+    def test_index_api(self):
+        view = IndexPostListAPIView.as_view()
+        request = APIRequestFactory().get("/")
+        self.assertBodyNotSelected(lambda: view(request).render())
+
+    def test_index_view(self):
+        response = self.assertBodyNotSelected(lambda: self.client.get(reverse("blog:index")))
+        self.assertContains(response, "测试标题0")
+
+    def test_rss(self):
+        response = self.assertBodyNotSelected(lambda: self.client.get(reverse("rss")))
+        self.assertContains(response, "测试标题0")
+
+    def test_post_detail(self):
+        # 详情需要正文，但也不会再单独查询某个字段
+        cache.clear()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeferredFieldRefetchWarning)
+            response = self.client.get(reverse("v1:post-detail", kwargs={"pk": self.post.pk}))
+        self.assertEqual(response.data["body"], "# 标题\n\n正文")
+
+    def test_refetch_warning(self):
+        post = Post.objects.only("id", "title").get(pk=self.post.pk)
+        with self.assertWarns(DeferredFieldRefetchWarning):
+            post.body
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeferredFieldRefetchWarning)
+            post.title
+            # 已经取出过的字段不会再查询
+            post.body
+
+
+class IndexUsageTestCase(TestCase):
+    """
+    用 EXPLAIN 检查列表和归档查询是否使用了索引（只支持 SQLite 和 MySQL）
+    """
+
+    def setUp(self):
+        if connection.vendor not in ("sqlite", "mysql"):
+            self.skipTest("只检查 SQLite 和 MySQL 的执行计划")
+        apps.get_app_config("haystack").signal_processor.teardown()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="测试分类")
+        self.post = Post.objects.create(title="测试标题", body="正文", category=self.cate, author=user)
+
+    def assertUsesIndex(self, queryset, index_name):
+        # SQLite 的执行计划为 "SEARCH blog_post USING INDEX xxx"，MySQL 的执行计划中 key 列为索引名
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, "没有使用索引 %s：\n%s" % (index_name, plan))
+
+    def test_post_list_ordered_by_pub_time(self):
+        self.assertUsesIndex(Post.objects.all()[:10], "post_pub_time_idx")
+
+    def test_category_posts(self):
+        queryset = Post.objects.filter(category=self.cate)[:10]
+        self.assertUsesIndex(queryset, "post_category_pub_time_idx")
+
+    def test_archive_range(self):
+        start, end = date_range(2020, 7)
+        queryset = Post.objects.filter(created_time__gte=start, created_time__lt=end).order_by()
+        self.assertUsesIndex(queryset, "post_created_time_idx")
+
+    def test_filter_by_year_and_month(self):
+        queryset = PostFilter({"created_year": 2020, "created_month": 7}, Post.objects.order_by()).qs
+        self.assertUsesIndex(queryset, "post_created_time_idx")
+
+    def test_post_comments(self):
+        queryset = Comment.objects.filter(post=self.post)[:10]
+        self.assertUsesIndex(queryset, "comment_post_created_idx")
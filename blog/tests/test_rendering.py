@@ -0,0 +1,238 @@
+import os
+import random
+import threading
+import unittest
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .. import rendering
+from ..rendering import (
+    RenderCache,
+    build_markdown,
+    generate_rich_content,
+    highlight_cache,
+    pooled_markdown,
+    render_markdown,
+    render_markdown_incremental,
+    split_blocks,
+)
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.render_cache = RenderCache(max_bytes=1024 * 1024, timeout=60)
+        patcher = mock.patch.object(rendering, "render_cache", self.render_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generate_rich_content(self):
+        rich_content = generate_rich_content("# 标题")
+        self.assertEqual(rich_content["content"], '<h1 id="标题">标题</h1>')
+        self.assertEqual(rich_content["toc"].strip(), '<li><a href="#标题">标题</a></li>')
+
+    def test_text_and_excerpt(self):
+        rich_content = generate_rich_content("# 标题\n\n" + "正文" * 50)
+        self.assertEqual(rich_content["text"], "标题\n" + "正文" * 50)
+        self.assertEqual(rich_content["excerpt"], rich_content["text"][: rendering.EXCERPT_LENGTH])
+
+    def test_render_once_for_same_content(self):
+        with mock.patch.object(
+            rendering, "render_markdown_incremental", wraps=rendering.render_markdown_incremental
+        ) as render_markdown_incremental:
+            first = generate_rich_content("# 标题")
+            second = generate_rich_content("# 标题")
+            generate_rich_content("# 另一个标题")
+        self.assertEqual(first, second)
+        self.assertEqual(render_markdown_incremental.call_count, 2)
+
+        stats = self.render_cache.stats()
+        self.assertEqual(stats["local_hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_fallback_to_shared_cache(self):
+        generate_rich_content("# 标题")
+        # 模拟另一个 worker：进程内缓存为空，但共享缓存中已有渲染结果
+        self.render_cache.clear()
+        with mock.patch.object(rendering, "render_markdown_incremental") as render:
+            rich_content = generate_rich_content("# 标题")
+        render.assert_not_called()
+        self.assertEqual(rich_content["content"], '<h1 id="标题">标题</h1>')
+        self.assertEqual(self.render_cache.stats()["shared_hits"], 1)
+
+    def test_key_depends_on_extension_config(self):
+        key = self.render_cache.make_key("# 标题")
+        with mock.patch.object(
+            rendering, "MARKDOWN_EXTENSIONS", rendering.MARKDOWN_EXTENSIONS[:-1]
+        ):
+            other = RenderCache(max_bytes=1024, timeout=60)
+        self.assertNotEqual(key, other.make_key("# 标题"))
+
+
+class PooledMarkdownTestCase(unittest.TestCase):
+    documents = [
+        "# 标题\n\n正文\n\n# 标题",
+        "*[HTML]: Hyper Text Markup Language\n\nHTML 缩写",
+        "没有定义缩写的 HTML",
+        "脚注[^1]\n\n[^1]: 脚注内容",
+        "引用链接 [link]\n\n[link]: https://www.zmrenwu.com",
+        "没有定义的引用链接 [link]",
+        "```python\nprint('hello')\n```\n\n    indented = True",
+    ]
+
+    def test_same_output_as_new_instance(self):
+        for document in self.documents * 2:
+            expected_md = build_markdown()
+            expected = expected_md.convert(document)
+            with pooled_markdown() as md:
+                self.assertEqual(md.convert(document), expected)
+                self.assertEqual(md.toc, expected_md.toc)
+
+    def test_reuse_instance_in_same_thread(self):
+        with pooled_markdown() as first:
+            pass
+        with pooled_markdown() as second:
+            self.assertIs(first, second)
+            # 嵌套使用时取到的是另一个实例
+            with pooled_markdown() as nested:
+                self.assertIsNot(nested, second)
+
+    def test_instances_not_shared_between_threads(self):
+        with pooled_markdown() as md:
+            pass
+        other = []
+
+        def target():
+            with pooled_markdown() as md_in_thread:
+                other.append(md_in_thread)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], md)
+
+
+class HighlightCacheTestCase(unittest.TestCase):
+    code = "```python\nprint('hello')\n```\n\n    indented = True"
+
+    def setUp(self):
+        highlight_cache.clear()
+
+    def test_skip_highlight_for_unchanged_code_blocks(self):
+        first = render_markdown("第一版正文\n\n" + self.code)
+        misses = highlight_cache.misses
+        hits = highlight_cache.hits
+        self.assertEqual(len(highlight_cache), 2)
+
+        second = render_markdown("第二版正文\n\n" + self.code)
+        self.assertEqual(highlight_cache.misses, misses)
+        self.assertEqual(highlight_cache.hits, hits + 2)
+        self.assertEqual(
+            first["content"].replace("第一版正文", "第二版正文"), second["content"]
+        )
+
+    def test_same_code_in_other_language_is_highlighted_again(self):
+        python = render_markdown("```python\nfoo = 1\n```")["content"]
+        text = render_markdown("```text\nfoo = 1\n```")["content"]
+        self.assertEqual(len(highlight_cache), 2)
+        self.assertNotEqual(python, text)
+
+
+class IncrementalRenderTestCase(unittest.TestCase):
+    # 用于拼接测试文档的片段，覆盖各种会跨空行合并的元素（列表、引用、定义列表、链接定义等）
+    parts = [
+        "# 标题",
+        "## Sub *em* `code`",
+        "段落 **粗体** [link][a] 和 [inline](http://x) [b]",
+        "[b]: http://b.com",
+        "[a]: http://example.com \"Title\"",
+        "- a\n- b",
+        "- c\n\n    continued",
+        "1. one\n2. two",
+        "   - three-space list",
+        "> quote\n> more",
+        "> quote2\n>\n> - li",
+        "- nested\n    - deeper\n\n        deep para",
+        "```python\nx = 1\n\n\ny = 2\n```",
+        "```\nunclosed",
+        "    indented code\n\n    more code",
+        "\tTab code",
+        "| a | b |\n|---|---|\n| 1 | 2 |",
+        "Term\n:   Definition",
+        ": another def",
+        "para\nlazy line",
+        "***",
+        "Setext\n======",
+        "Title {#custom}",
+        "line\r\nwith crlf",
+        "    ",
+        "_emph_ __strong__",
+    ]
+
+    documents = [
+        "",
+        "   ",
+        "# 标题\n\n正文\n\n## 子标题\n\n正文",
+        "# 标题\n\n正文\n\n# 标题",
+        "- a\n\n- b\n\n[x]: http://x.com\n\n    continued",
+        "Term\n:   Definition\n\n段落\n\n[b]: http://b.com\n\n: another def",
+        "<div>原始 HTML</div>\n\n正文",
+        "脚注[^1]\n\n[^1]: 脚注内容",
+        "*[HTML]: Hyper Text Markup Language\n\nHTML 缩写",
+        "[TOC]\n\n# 标题",
+        "- [a]: http://a.com\n\n[a]",
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.block_cache = RenderCache(max_bytes=1024 * 1024, timeout=60, key_prefix="rich_block")
+        patcher = mock.patch.object(rendering, "block_cache", self.block_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertSameAsFullRender(self, document):
+        self.assertEqual(
+            render_markdown_incremental(document), render_markdown(document), repr(document)
+        )
+
+    def test_documents(self):
+        for document in self.documents:
+            self.assertSameAsFullRender(document)
+
+    def test_random_documents(self):
+        rng = random.Random(20201016)
+        for _ in range(300):
+            parts = [rng.choice(self.parts) for _ in range(rng.randint(1, 12))]
+            document = "\n\n".join(parts)
+            if rng.random() < 0.2:
+                document = document.replace("\n\n", "\n", rng.randint(1, 3))
+            self.assertSameAsFullRender(document)
+
+    def test_sample_document(self):
+        path = os.path.join(settings.BASE_DIR, "scripts", "md.sample")
+        with open(path, encoding="utf-8") as f:
+            self.assertSameAsFullRender(f.read())
+
+    def test_only_changed_block_is_rendered(self):
+        blocks = ["# 标题", "第一段", "```python\nprint('hello')\n```", "- a\n- b"]
+        render_markdown_incremental("\n\n".join(blocks))
+        self.assertEqual(self.block_cache.misses, 4)
+
+        blocks[1] = "修改后的第一段"
+        rich_content = render_markdown_incremental("\n\n".join(blocks))
+        self.assertEqual(self.block_cache.misses, 5)
+        self.assertEqual(self.block_cache.local_hits, 3)
+        self.assertEqual(rich_content, render_markdown("\n\n".join(blocks)))
+
+    def test_split_blocks(self):
+        self.assertEqual(split_blocks("# 标题\n\n正文"), ["# 标题", "正文"])
+        # 代码块中的空行不切分
+        self.assertEqual(
+            split_blocks("```\na\n\nb\n```\n\n正文"), ["```\na\n\nb\n```", "正文"]
+        )
+        # 空行分隔的列表项属于同一个列表
+        self.assertEqual(split_blocks("- a\n\n- b\n\n正文"), ["- a\n\n- b", "正文"])
+        # 定义会把前一段文字当作术语
+        self.assertEqual(split_blocks("术语\n\n: 定义"), ["术语\n\n: 定义"])
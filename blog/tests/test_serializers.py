@@ -1,7 +1,10 @@
 import unittest
 
-from blog.serializers import HighlightedCharField
+from blog.models import Post
+from blog.projection import serializer_columns
+from blog.serializers import HighlightedCharField, PostListSerializer, PostRetrieveSerializer
 from django.test import RequestFactory
+from rest_framework import serializers
 from rest_framework.request import Request
 
 
@@ -18,3 +21,33 @@ class HighlightedCharFieldTestCase(unittest.TestCase):
             '其他别的<span class="highlighted">关键词</span>别的无关的词。'
         )
         self.assertEqual(result, expected)
+
+
+class SerializerColumnsTestCase(unittest.TestCase):
+    def test_list_serializer(self):
+        columns = serializer_columns(PostListSerializer(), Post)
+        self.assertEqual(
+            set(columns),
+            {
+                "id", "title", "created_time", "excerpt",
+                "category", "category__id", "category__name",
+                "author", "author__id", "author__username",
+            },
+        )
+
+    def test_retrieve_serializer(self):
+        columns = serializer_columns(PostRetrieveSerializer(), Post)
+        self.assertTrue({"body", "body_html", "toc", "modified_time"} <= set(columns))
+        # 多对多由 prefetch_related 查询
+        self.assertNotIn("tags", columns)
+
+    def test_required_columns(self):
+        class ViewsSerializer(serializers.ModelSerializer):
+            views = serializers.IntegerField(source="view_count")
+
+            class Meta:
+                model = Post
+                fields = ["views"]
+                required_columns = ["pub_time"]
+
+        self.assertEqual(serializer_columns(ViewsSerializer(), Post), ["id", "pub_time"])
@@ -2,6 +2,7 @@ from datetime import timedelta
 
 from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.template import Context, Template
 from django.test import TestCase
 from django.urls import reverse
@@ -19,6 +20,7 @@ from ..templatetags.blog_extras import (
 class BlogExtrasTestCase(TestCase):
     def setUp(self):
         apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
         self.user = User.objects.create_superuser(
             username="admin", email="admin@hellogithub.com", password="admin"
         )
@@ -211,3 +213,58 @@ class BlogExtrasTestCase(TestCase):
             url, created_time.year, created_time.month
         )
         self.assertInHTML(frag, expected_html)
+
+
+class SidebarCacheTestCase(TestCase):
+    template = Template(
+        "{% load blog_extras %}"
+        "{% show_recent_posts 3 %}{% show_archives %}{% show_categories %}{% show_tags %}"
+    )
+
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        self.cate = Category.objects.create(name="测试分类")
+        self.tag = Tag.objects.create(name="测试标签")
+        self.create_post("测试标题")
+
+    def create_post(self, title):
+        post = Post.objects.create(title=title, body="测试内容", category=self.cate, author=self.user)
+        post.tags.add(self.tag)
+        return post
+
+    def test_cached_render_without_queries(self):
+        html = self.template.render(Context())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.template.render(Context()), html)
+
+    def test_invalidated_by_post_changes(self):
+        self.template.render(Context())
+        post = self.create_post("新的标题")
+        html = self.template.render(Context())
+        self.assertInHTML('<a href="{}">新的标题</a>'.format(post.get_absolute_url()), html)
+        self.assertIn("测试分类 <span class=\"post-count\">(2)</span>", html)
+
+        post.delete()
+        html = self.template.render(Context())
+        self.assertNotIn("新的标题", html)
+        self.assertIn("测试分类 <span class=\"post-count\">(1)</span>", html)
+
+    def test_invalidated_by_tag_changes(self):
+        self.template.render(Context())
+        self.tag.name = "新的标签"
+        self.tag.save()
+        self.assertIn("新的标签", self.template.render(Context()))
+        Post.objects.get().tags.clear()
+        self.assertIn("暂无标签！", self.template.render(Context()))
+
+    def test_arguments_in_key(self):
+        for i in range(4):
+            self.create_post("测试标题%d" % i)
+        template = Template("{% load blog_extras %}{% show_recent_posts %}")
+        self.template.render(Context())
+        self.assertIn("测试标题0", template.render(Context()))
+        self.assertNotIn("测试标题0", self.template.render(Context()))
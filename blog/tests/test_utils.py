@@ -3,7 +3,7 @@ from datetime import datetime
 
 from django.core.cache import cache
 
-from ..utils import Highlighter, UpdatedAtKeyBit
+from ..utils import Highlighter, LRUCache, TreeError, UpdatedAtKeyBit, build_tree
 
 
 class HighlighterTestCase(unittest.TestCase):
@@ -39,3 +39,99 @@ class UpdatedAtKeyBitTestCase(unittest.TestCase):
         now_str = str(now)
         cache.set(key_bit.key, now)
         self.assertEqual(key_bit.get_data(), now_str)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lru = LRUCache(max_bytes=10, sizeof=len)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.lru.get("a"))
+        self.lru.set("a", "xxx")
+        self.assertEqual(self.lru.get("a"), "xxx")
+        self.assertEqual(self.lru.current_bytes, 3)
+
+        self.lru.set("a", "xxxx")
+        self.assertEqual(self.lru.get("a"), "xxxx")
+        self.assertEqual(self.lru.current_bytes, 4)
+
+    def test_evict_least_recently_used_by_size(self):
+        self.lru.set("a", "xxxx")
+        self.lru.set("b", "xxxx")
+        # 访问 a 之后，最久未使用的是 b
+        self.lru.get("a")
+        self.lru.set("c", "xxxx")
+        self.assertIn("a", self.lru)
+        self.assertNotIn("b", self.lru)
+        self.assertIn("c", self.lru)
+        self.assertEqual(self.lru.current_bytes, 8)
+
+    def test_skip_value_larger_than_capacity(self):
+        self.lru.set("a", "xxxx")
+        self.lru.set("big", "x" * 11)
+        self.assertNotIn("big", self.lru)
+        self.assertIn("a", self.lru)
+
+    def test_delete_and_clear(self):
+        self.lru.set("a", "xxxx")
+        self.lru.set("b", "xx")
+        self.lru.delete("a")
+        self.assertNotIn("a", self.lru)
+        self.assertEqual(self.lru.current_bytes, 2)
+        self.lru.clear()
+        self.assertEqual(len(self.lru), 0)
+        self.assertEqual(self.lru.current_bytes, 0)
+
+
+class BuildTreeTestCase(unittest.TestCase):
+    def nodes(self, *pairs):
+        return [{"id": id, "parent_id": parent_id} for id, parent_id in pairs]
+
+    def shape(self, tree):
+        return [(node["id"], self.shape(node.get("children", []))) for node in tree]
+
+    def test_build_tree(self):
+        # 子节点可以出现在父节点之前
+        items = self.nodes((4, 2), (1, None), (2, 1), (3, 1), (5, None))
+        tree = build_tree(items)
+        self.assertEqual(self.shape(tree), [(1, [(2, [(4, [])]), (3, [])]), (5, [])])
+        self.assertNotIn("children", tree[1])
+
+    def test_order_by_key(self):
+        items = self.nodes((3, 1), (5, None), (2, 1), (1, None))
+        tree = build_tree(items, key=lambda node: node["id"])
+        self.assertEqual(self.shape(tree), [(1, [(2, []), (3, [])]), (5, [])])
+
+    def test_max_depth(self):
+        items = self.nodes((1, None), (2, 1), (3, 2), (4, 3), (5, 2), (6, 1))
+        tree = build_tree(items, max_depth=2)
+        self.assertEqual(self.shape(tree), [(1, [(2, []), (3, []), (4, []), (5, []), (6, [])])])
+        tree = build_tree(self.nodes((1, None), (2, 1), (3, 2)), max_depth=2)
+        self.assertEqual(self.shape(tree), [(1, [(2, []), (3, [])])])
+        tree = build_tree(self.nodes((1, None), (2, 1), (3, 2)), max_depth=3)
+        self.assertEqual(self.shape(tree), [(1, [(2, [(3, [])])])])
+        # 深度为 1 或 0 时回复会变成根节点，不允许
+        for max_depth in [1, 0, -1]:
+            with self.assertRaises(ValueError):
+                build_tree(self.nodes((1, None), (2, 1)), max_depth=max_depth)
+
+    def test_orphan(self):
+        items = self.nodes((1, None), (2, 99), (3, 2))
+        self.assertEqual(self.shape(build_tree(items)), [(1, []), (2, [(3, [])])])
+        with self.assertRaises(TreeError):
+            build_tree(self.nodes((1, None), (2, 99)), strict=True)
+
+    def test_cycle(self):
+        items = self.nodes((1, None), (2, 3), (3, 4), (4, 2), (5, 4))
+        tree = build_tree(items)
+        # 2、3、4 的父节点依次为 3、4、2，形成环，从环中第一个节点 2 处断开
+        self.assertEqual(self.shape(tree), [(1, []), (2, [(4, [(3, []), (5, [])])])])
+        with self.assertRaises(TreeError):
+            build_tree(items, strict=True)
+
+    def test_deep_chain(self):
+        items = self.nodes((1, None), *((i, i - 1) for i in range(2, 100001)))
+        tree = build_tree(items)
+        self.assertEqual(len(tree), 1)
+        tree = build_tree(items, max_depth=3)
+        self.assertEqual(len(tree[0]["children"][0]["children"]), 99998)
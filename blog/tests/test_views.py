@@ -1,18 +1,25 @@
 from datetime import timedelta
+from io import StringIO
 
 from django.apps import apps
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+from ..counters import view_counter
 from ..feeds import AllPostsRssFeed
 from ..models import Category, Post, Tag
 
 
+# 测试中由测试用例自己写回阅读量，不启动后台定时器
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
 class BlogDataTestCase(TestCase):
     def setUp(self):
         apps.get_app_config("haystack").signal_processor.teardown()
+        cache.clear()
 
         # User
         self.user = User.objects.create_superuser(
@@ -198,11 +205,36 @@ class PostDetailViewTestCase(BlogDataTestCase):
     def test_increase_views(self):
         self.client.get(self.url)
         self.md_post.refresh_from_db()
-        self.assertEqual(self.md_post.views, 1)
+        # 访问文章时不写数据库，但显示的阅读量包括尚未写回的部分
+        self.assertEqual(self.md_post.views, 0)
+        self.assertEqual(self.md_post.view_count, 1)
 
-        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertContains(response, "2 阅读")
+
+        view_counter.flush([self.md_post.pk])
         self.md_post.refresh_from_db()
         self.assertEqual(self.md_post.views, 2)
+        self.assertEqual(self.md_post.view_count, 2)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # 返回 304 时同样累加阅读量
+        self.assertEqual(self.md_post.view_count, 2)
+
+        # 新的评论会出现在页面中
+        self.md_post.comment_set.create(name="评论者", email="a@a.com", content="评论内容")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_body_html_updated(self):
+        # 正文被直接改写（不经过 Post.save）时页面也不能返回 304
+        etag = self.client.get(self.url)["ETag"]
+        Post.objects.filter(pk=self.md_post.pk).update(body_html="<p>改写的正文</p>")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "改写的正文")
 
     def test_markdownify_post_body_and_set_toc(self):
         response = self.client.get(self.url)
@@ -254,3 +286,18 @@ class RSSTestCase(BlogDataTestCase):
         )
         self.assertContains(response, self.post1.body)
         self.assertContains(response, self.post2.body)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post1.title = "新的标题"
+        self.post1.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rerendered(self):
+        etag = self.client.get(self.url)["ETag"]
+        Post.objects.filter(pk=self.post1.pk).update(body="重新渲染的正文")
+        call_command("rerender_posts", "--workers", "1", stdout=StringIO())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "重新渲染的正文")
@@ -0,0 +1,226 @@
+"""
+评论、树洞等多级回复的物化路径（materialized path）
+
+每个节点的 path 由根节点到它自身的 id 依次拼接而成，每段是定长的 36 进制 id，depth 为节点深度
+（根节点为 0）。这样某个节点的整棵子树就是 path 以该节点 path 开头的节点，可以直接用 path 上的
+索引做一次范围查询，不用把整篇文章的评论都取出来再在 Python 中组装。
+"""
+from collections import Counter
+
+from django.db import connections, models, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber, Substr
+
+PATH_STEP = 6
+# MySQL utf8mb4 下索引列最长 191 个字符，path 最多保存 30 层
+PATH_MAX_LENGTH = 180
+PATH_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_segment(pk):
+    segment = ""
+    value = pk
+    while value:
+        value, remainder = divmod(value, 36)
+        segment = PATH_DIGITS[remainder] + segment
+    if len(segment) > PATH_STEP:
+        raise ValueError("id %d 超出物化路径的表示范围" % pk)
+    return segment.rjust(PATH_STEP, "0")
+
+
+def child_path(parent_path, pk):
+    """
+    返回 id 为 pk 的节点挂在 parent_path 下时的 (path, depth)
+
+    超过 PATH_MAX_LENGTH 的回复在路径上记作父节点的兄弟节点（parent 外键不变），
+    所以 path 的深度最多 PATH_MAX_LENGTH // PATH_STEP 层
+    """
+    if len(parent_path) + PATH_STEP > PATH_MAX_LENGTH:
+        parent_path = parent_path[:-PATH_STEP]
+    path = parent_path + encode_segment(pk)
+    return path, len(path) // PATH_STEP - 1
+
+
+def ancestor_paths(path):
+    return [path[:end] for end in range(PATH_STEP, len(path), PATH_STEP)]
+
+
+def prefix_range(path):
+    """
+    以 path 开头的路径都落在 [path, path + "{") 中，"{" 排在所有 36 进制字符之后
+    """
+    return {"path__gte": path, "path__lt": path + "{"}
+
+
+class ThreadQuerySet(models.QuerySet):
+    def roots(self):
+        return self.filter(depth=0)
+
+    def subtree(self, node, include_self=True):
+        queryset = self.filter(**prefix_range(node.path))
+        if not include_self:
+            queryset = queryset.exclude(pk=node.pk)
+        return queryset
+
+    def subtrees(self, nodes):
+        """
+        多个节点的子树（包含节点自身），每个节点对应 path 索引上的一段范围
+        """
+        condition = models.Q(pk__in=[])
+        for node in nodes:
+            condition |= models.Q(**prefix_range(node.path))
+        return self.filter(condition)
+
+    def max_depth(self, depth):
+        return self.filter(depth__lte=depth)
+
+
+class ThreadedModel(models.Model):
+    """
+    带有物化路径的自关联模型，子类需要定义 parent 外键
+    """
+
+    path = models.CharField(
+        "路径", max_length=PATH_MAX_LENGTH, blank=True, db_index=True, editable=False
+    )
+    depth = models.PositiveSmallIntegerField("深度", default=0, editable=False)
+    # 子树中除自身以外的节点数，即全部层级的回复数
+    reply_count = models.PositiveIntegerField("回复数", default=0, editable=False)
+
+    objects = ThreadQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.path:
+                # path 中包含节点自身的 id，插入后才能确定
+                parent_path = self.parent.path if self.parent_id else ""
+                self.path, self.depth = child_path(parent_path, self.pk)
+                manager = type(self)._default_manager
+                manager.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                manager.filter(path__in=ancestor_paths(self.path)).update(
+                    reply_count=F("reply_count") + 1
+                )
+
+
+def decrease_reply_count(sender=None, instance=None, *args, **kwargs):
+    # 级联删除时每个被删除的节点都会触发一次，祖先的回复数依次减一；已被删除的祖先不受影响
+    if isinstance(instance, ThreadedModel) and instance.path:
+        sender._default_manager.filter(path__in=ancestor_paths(instance.path)).update(
+            reply_count=F("reply_count") - 1
+        )
+
+
+def attach_first_replies(nodes, limit):
+    """
+    为每个节点取出按时间顺序的前 limit 条回复（全部层级），放在 first_replies 中
+
+    回复不超过 limit 条的节点一起用一次查询取出全部回复；回复更多的节点也一起用一次查询，
+    每个节点的回复按时间编号后只取前 limit 条（见 first_replies_of）。没有回复的节点不查询
+    """
+    small, large = [], []
+    for node in nodes:
+        node.first_replies = []
+        if limit and node.reply_count:
+            (small if node.reply_count <= limit else large).append(node)
+    replies = []
+    if small:
+        replies.extend(type(small[0])._default_manager.subtrees(small).order_by("created_time", "id"))
+    if large:
+        replies.extend(first_replies_of(large, limit))
+
+    by_path = {node.path: node for node in small + large}
+    for reply in sorted(replies, key=lambda reply: (reply.created_time, reply.pk)):
+        if reply.path in by_path:
+            continue
+        # 沿着路径找到回复所属的节点
+        for path in ancestor_paths(reply.path):
+            if path in by_path:
+                by_path[path].first_replies.append(reply)
+                break
+
+
+def first_replies_of(nodes, limit):
+    """
+    用一次查询取出各节点按时间顺序的前 limit 条回复
+
+    数据库支持窗口函数时，按节点的路径前缀分区编号（ROW_NUMBER() OVER (PARTITION BY ...)），
+    再在外层只取编号不超过 limit 的行；不支持时（例如 MySQL 5.7）把各节点带 LIMIT 的查询 UNION 起来
+    """
+    model = type(nodes[0])
+    manager = model._default_manager
+    ordering = ["created_time", "id"]
+    connection = connections[manager.db]
+    if connection.features.supports_over_clause:
+        replies = []
+        # 路径长度相同的节点可以按同样长度的前缀分区，通常都是根节点，只有一组
+        lengths = sorted({len(node.path) for node in nodes})
+        for length in lengths:
+            group = [node for node in nodes if len(node.path) == length]
+            ranked = (
+                manager.subtrees(group)
+                .exclude(pk__in=[node.pk for node in group])
+                .annotate(
+                    reply_rank=Window(
+                        RowNumber(),
+                        partition_by=[Substr("path", 1, length)],
+                        order_by=[F(field).asc() for field in ordering],
+                    )
+                )
+            )
+            sql, params = ranked.query.sql_with_params()
+            replies.extend(
+                manager.raw(
+                    "SELECT * FROM (%s) ranked WHERE ranked.reply_rank <= %%s" % sql,
+                    tuple(params) + (limit,),
+                )
+            )
+        return replies
+    if connection.features.supports_slicing_ordering_in_compound:
+        querysets = [manager.subtree(node, include_self=False).order_by(*ordering)[:limit] for node in nodes]
+        return list(querysets[0].union(*querysets[1:], all=True))
+    replies = []
+    for node in nodes:
+        replies.extend(manager.subtree(node, include_self=False).order_by(*ordering)[:limit])
+    return replies
+
+
+def backfill_paths(model, batch_size=500):
+    """
+    为已有数据计算 path 和 depth，供数据迁移使用（model 是迁移中的历史模型）
+    """
+    parents = dict(model.objects.values_list("id", "parent_id").iterator())
+    paths = {}
+    depths = {}
+    for pk in parents:
+        # 沿着 parent 向上找到第一个已经计算过的祖先，再自上而下依次计算
+        chain = []
+        seen = set()
+        node = pk
+        # parent 形成环时，从环中第一个遇到的节点处断开，作为根节点
+        while node is not None and node not in paths and node not in seen:
+            chain.append(node)
+            seen.add(node)
+            node = parents.get(node)
+        parent_path = paths.get(node, "")
+        for node in reversed(chain):
+            paths[node], depths[node] = child_path(parent_path, node)
+            parent_path = paths[node]
+
+    objs = [model(pk=pk, path=path, depth=depths[pk]) for pk, path in paths.items()]
+    model.objects.bulk_update(objs, ["path", "depth"], batch_size=batch_size)
+
+
+def backfill_reply_counts(model, batch_size=500):
+    """
+    根据 path 为已有数据计算 reply_count，供数据迁移使用
+    """
+    paths = dict(model.objects.values_list("id", "path").iterator())
+    counts = Counter()
+    for path in paths.values():
+        counts.update(ancestor_paths(path))
+    objs = [model(pk=pk, reply_count=counts[path]) for pk, path in paths.items()]
+    model.objects.bulk_update(objs, ["reply_count"], batch_size=batch_size)
@@ -1,13 +1,20 @@
-from hashlib import md5
+import logging
+import sys
+import threading
+from collections import OrderedDict, defaultdict
 
 from datetime import datetime
 
+from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
 from django.utils.html import strip_tags
 from rest_framework_extensions.key_constructor.bits import KeyBitBase
 
 from haystack.utils import Highlighter as HaystackHighlighter
 
+logger = logging.getLogger(__name__)
+
 
 class Highlighter(HaystackHighlighter):
     """
@@ -23,53 +30,176 @@ class Highlighter(HaystackHighlighter):
         return self.render_html(highlight_locations, start_offset, end_offset)
 
 
-class UpdatedAtKeyBit(KeyBitBase):
-    key = "updated_at"
+class LRUCache:
+    """
+    线程安全的进程内 LRU 缓存，按条目占用的字节数（而不是条目数）淘汰最久未使用的条目
+    """
 
-    def get_data(self, **kwargs):
-        value = cache.get(self.key, None)
-        if not value:
-            value = datetime.utcnow()
-            cache.set(self.key, value=value)
-        return str(value)
+    def __init__(self, max_bytes, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
 
+    def __contains__(self, key):
+        return key in self._data
 
-def cache_decorator(expiration=3 * 60):
-    def wrapper(func):
-        def news(*args, **kwargs):
+    def get(self, key, default=None):
+        with self._lock:
             try:
-                view = args[0]
-                key = view.get_cache_key()
-            except BaseException:
-                key = None
-            if not key:
-                unique_str = repr((func, args, kwargs))
-
-                m = md5(unique_str.encode('utf-8'))
-                key = m.hexdigest()
-            value = cache.get(key)
-            if value is not None:
-                # logger.info('cache_decorator get cache:%s key:%s' % (func.__name__, key))
-                if str(value) == '__default_cache_value__':
-                    return None
-                else:
-                    return value
+                value, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        # 单个条目就超过容量的不缓存，否则会把其它条目全部挤出去
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+        }
+
+
+class TreeError(ValueError):
+    pass
+
+
+def build_tree(items, max_depth=None, key=None, strict=False):
+    """
+    把带有 id 和 parent_id 的节点列表组装成树，返回根节点列表，子节点放在父节点的 children 中
+    （没有子节点时不设置 children）。节点按 id 建立索引，整体只遍历常数次，时间复杂度为线性。
+
+    - 兄弟节点之间保持传入的顺序，传入 key 时按 key 排序
+    - 设置 max_depth 时，超过该深度的回复挂到 max_depth 层祖先的同一层，树的深度不超过 max_depth。
+      max_depth 至少为 2，否则回复会被当作根节点，小于 2 时抛出 ValueError
+    - 父节点不在列表中的节点（例如父评论已被删除）作为根节点；parent_id 形成环的节点从环中
+      第一个节点处断开，该节点作为根节点。strict 为 True 时这两种情况抛出 TreeError
+    """
+    if max_depth is not None and max_depth < 2:
+        raise ValueError("max_depth 至少为 2，当前为 %d" % max_depth)
+    items = list(items)
+    index = {}
+    for item in items:
+        item.pop("children", None)
+        index[item["id"]] = item
+    roots = []
+    children = defaultdict(list)
+    for item in items:
+        parent_id = item["parent_id"]
+        if not parent_id:
+            roots.append(item)
+        elif parent_id in index:
+            children[parent_id].append(item)
+        else:
+            if strict:
+                raise TreeError("节点 %s 的父节点 %s 不存在" % (item["id"], parent_id))
+            logger.warning("节点 %s 的父节点 %s 不存在，作为根节点处理", item["id"], parent_id)
+            roots.append(item)
+    if key is not None:
+        roots.sort(key=key)
+        for siblings in children.values():
+            siblings.sort(key=key)
+
+    tree = []
+    visited = set()
+
+    def walk(root):
+        # 栈中保存 (节点, 节点要放入的列表, 节点在结果中的深度)，子节点逆序入栈，出栈顺序即先序遍历顺序
+        stack = [(root, tree, 1)]
+        while stack:
+            node, siblings, depth = stack.pop()
+            if node["id"] in visited:
+                continue
+            visited.add(node["id"])
+            siblings.append(node)
+            kids = [kid for kid in children.get(node["id"], ()) if kid["id"] not in visited]
+            if not kids:
+                continue
+            if max_depth is None or depth < max_depth:
+                target = node.setdefault("children", [])
+                kid_depth = depth + 1
             else:
-                # logger.info(
-                #     'cache_decorator set cache:%s key:%s' %
-                #     (func.__name__, key))
-                value = func(*args, **kwargs)
-                if value is None:
-                    cache.set(key, '__default_cache_value__', expiration)
-                else:
-                    cache.set(key, value, expiration)
-                return value
-
-        return news
-
-    return wrapper
-
-# @cache_decorator()
-# def get_current_site():
-#     site = Site.objects.get_current()
-#     return site
+                target, kid_depth = siblings, depth
+            stack.extend((kid, target, kid_depth) for kid in reversed(kids))
+
+    for root in roots:
+        walk(root)
+    if len(visited) < len(index):
+        # 剩下的节点都无法追溯到根节点，说明 parent_id 形成了环
+        for item in items:
+            if item["id"] in visited:
+                continue
+            if strict:
+                raise TreeError("节点 %s 的祖先中存在环" % item["id"])
+            logger.warning("节点 %s 的祖先中存在环，作为根节点处理", item["id"])
+            walk(item)
+    return tree
+
+
+def date_range(year, month=None):
+    """
+    返回某年（或某年某月）左闭右开的时间范围 (start, end)。用 __year、__month 过滤时
+    字段会被包在函数里，无法使用索引，改用范围过滤即可。年份或月份不合法时抛出 ValueError
+    """
+    start = datetime(year, month or 1, 1)
+    if month is None or month == 12:
+        end = datetime(year + 1, 1, 1)
+    else:
+        end = datetime(year, month + 1, 1)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+def get_updated_at(key):
+    """
+    返回缓存中记录的更新时间，没有时以当前时间为准，用作缓存键的版本号
+
+    用 get_or_set 写入，多个进程同时发现没有记录时只有一个进程写入，各进程得到的版本号相同
+    """
+    return cache.get_or_set(key, datetime.utcnow, None)
+
+
+class UpdatedAtKeyBit(KeyBitBase):
+    key = "updated_at"
+
+    def get_data(self, **kwargs):
+        return str(get_updated_at(self.key))
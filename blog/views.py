@@ -1,4 +1,11 @@
-from django.db.models import Count
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import MAXYEAR, MINYEAR, datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
 from django.forms import model_to_dict
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
@@ -11,25 +18,32 @@ from drf_yasg.utils import swagger_auto_schema
 from pure_pagination.mixins import PaginationMixin
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.serializers import DateField
 from rest_framework.throttling import AnonRateThrottle
-from rest_framework_extensions.cache.decorators import cache_response
-from rest_framework_extensions.key_constructor.bits import ListSqlQueryKeyBit, PaginationKeyBit, RetrieveSqlQueryKeyBit
-from rest_framework_extensions.key_constructor.constructors import DefaultKeyConstructor
-
-from comments.serializers import CommentSerializer
-
-from .filters import PostFilter
-from .models import Category, Post, Tag, About, TreeHole
+from rest_framework.utils.urls import replace_query_param
+
+from comments.serializers import CommentSerializer, CommentThreadSerializer
+
+from . import metrics
+from .conditional import (
+    conditional, content_digest, make_validators, not_modified, set_validators, updated_at_timestamp)
+from .counters import fill_counts, prefetch_counts, view_counter
+from .filters import CounterOrderingFilter, PostFilter
+from .models import Category, Post, Tag, About, TreeHole, treehole_month_key
+from .memoize import memoize
+from .pagination import CommentCursorPagination, PostCursorPagination, VersionedPaginationMixin
+from .projection import project
+from .response_cache import cached_response, response_cache
 from .serializers import (
     CategorySerializer, PostHaystackSerializer, PostListSerializer, PostRetrieveSerializer, TagSerializer,
     AboutRetrieveSerializer, CategoryWithCountSerializer, TagsWithCountSerializer, TreeHoleSerializer)
-from .utils import UpdatedAtKeyBit
+from .threads import attach_first_replies
+from .utils import build_tree, date_range, get_updated_at
 
 
 class IndexView(PaginationMixin, ListView):
@@ -38,6 +52,22 @@ class IndexView(PaginationMixin, ListView):
     context_object_name = "post_list"
     paginate_by = 10
 
+    def get_queryset(self):
+        # 模板中用到了分类、作者和评论数，一次查出来，避免每篇文章各查一次；
+        # 首页展示的字段与文章列表接口相同，按 PostListSerializer 只取需要的列
+        queryset = super().get_queryset().select_related("category", "author")
+        return (
+            project(queryset, PostListSerializer)
+            .annotate(num_comments=Count("comment"))
+            # 带聚合的查询不会使用 Meta.ordering，需要显式指定排序
+            .order_by(*Post._meta.ordering)
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        prefetch_counts(list(context[self.context_object_name]))
+        return context
+
 
 class CategoryView(IndexView):
     def get_queryset(self):
@@ -47,13 +77,11 @@ class CategoryView(IndexView):
 
 class ArchiveView(IndexView):
     def get_queryset(self):
-        year = self.kwargs.get("year")
-        month = self.kwargs.get("month")
-        return (
-            super()
-                .get_queryset()
-                .filter(created_time__year=year, created_time__month=month)
-        )
+        try:
+            start, end = date_range(self.kwargs.get("year"), self.kwargs.get("month"))
+        except ValueError:
+            return super().get_queryset().none()
+        return super().get_queryset().filter(created_time__gte=start, created_time__lt=end)
 
 
 class TagView(IndexView):
@@ -69,19 +97,32 @@ class PostDetailView(DetailView):
     template_name = "blog/detail.html"
     context_object_name = "post"
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("category", "author")
+
     def get(self, request, *args, **kwargs):
         # 覆写 get 方法的目的是因为每当文章被访问一次，就得将文章阅读量 +1
         # get 方法返回的是一个 HttpResponse 实例
         # 之所以需要先调用父类的 get 方法，是因为只有当 get 方法被调用后，
         # 才有 self.object 属性，其值为 Post 模型实例，即被访问的文章 post
-        response = super().get(request, *args, **kwargs)
+        #
+        # 浏览器缓存的页面仍然有效时直接返回 304，不再查询和渲染，阅读量同样 +1
+        self.object = self.get_object()
+        validators = post_page_validators(request, self.object)
+        response = not_modified(request, validators)
+        if response is not None:
+            self.object.increase_views()
+            return response
+
+        context = self.get_context_data(object=self.object)
+        response = self.render_to_response(context)
 
         # 将文章阅读量 +1
         # 注意 self.object 的值就是被访问的文章 post
         self.object.increase_views()
 
         # 视图必须返回一个 HttpResponse 对象
-        return response
+        return set_validators(response, validators)
 
 
 # ---------------------------------------------------------------------------
@@ -89,47 +130,94 @@ class PostDetailView(DetailView):
 # ---------------------------------------------------------------------------
 
 
-class PostUpdatedAtKeyBit(UpdatedAtKeyBit):
-    key = "post_updated_at"
+def post_tags(data):
+    # 文章数据中包含分类和标签的名称
+    tags = ["post:%s" % data["id"], "category:%s" % data["category"]["id"]]
+    tags.extend("tag:%s" % tag["id"] for tag in data["tags"])
+    return tags
+
+
+def post_list_tags(view, data):
+    tags = ["post:list"]
+    for item in data["results"]:
+        tags.extend(post_tags(item))
+    return tags
+
+
+def fill_list_counts(view, data):
+    fill_counts(data["results"])
+
+
+def count_view(view, data):
+    # 命中缓存时也要累加阅读量
+    view_counter.incr(data["id"])
+    fill_counts([data])
+
+
+def not_ordered_by_counters(request):
+    # 按阅读量等计数排序的结果随计数变化，不缓存
+    return not request.query_params.get("ordering")
 
 
-class CommentUpdatedAtKeyBit(UpdatedAtKeyBit):
-    key = "comment_updated_at"
+def about_validators(view, request, queryset):
+    # 按正文计算摘要，不渲染 Markdown；取出的对象留给视图序列化，不再重复查询
+    view.about_objects = list(queryset)
+    if not view.about_objects:
+        return None
+    parts = [request.get_full_path(), request.accepted_media_type]
+    timestamps = []
+    for about in view.about_objects:
+        parts.extend([about.pk, about.modified_time, hashlib.md5(about.body.encode("utf-8")).hexdigest()])
+        timestamps.append(about.modified_time.timestamp())
+    return make_validators(parts, timestamps)
 
 
-class PostListKeyConstructor(DefaultKeyConstructor):
-    list_sql = ListSqlQueryKeyBit()
-    pagination = PaginationKeyBit()
-    updated_at = PostUpdatedAtKeyBit()
+def about_list_validators(view, request):
+    return about_validators(view, request, view.get_queryset())
 
 
-class PostObjectKeyConstructor(DefaultKeyConstructor):
-    retrieve_sql = RetrieveSqlQueryKeyBit()
-    updated_at = PostUpdatedAtKeyBit()
+def about_detail_validators(view, request):
+    pk = str(view.kwargs["pk"])
+    return about_validators(view, request, About.objects.filter(pk=pk)) if pk.isdigit() else None
 
 
-class AboutObjectKeyConstructor(DefaultKeyConstructor):
-    retrieve_sql = RetrieveSqlQueryKeyBit()
-    updated_at = PostUpdatedAtKeyBit()
+def about_info_validators(view, request):
+    return about_validators(view, request, About.objects.order_by("-created_time")[:1])
 
 
-class CommentListKeyConstructor(DefaultKeyConstructor):
-    list_sql = ListSqlQueryKeyBit()
-    pagination = PaginationKeyBit()
-    updated_at = CommentUpdatedAtKeyBit()
+def post_page_validators(request, post):
+    # 按页面中文章的内容计算摘要（正文被 rerender_posts 等直接改写时摘要也会改变），不渲染 Markdown；
+    # 页面中还有评论和侧边栏（文章、分类、标签变化时 post_updated_at 更新），登录与否页面内容也不同
+    digest = content_digest(
+        [post.title, post.body_html, post.toc, post.modified_time, post.category_id, post.author_id]
+    )
+    comments_tag = "comments:%s" % post.pk
+    timestamps = [
+        post.modified_time.timestamp(),
+        updated_at_timestamp("post_updated_at"),
+        # 没有记录的标签当作刚刚更新
+        response_cache.updated_at([comments_tag], time.time())[comments_tag],
+    ]
+    return make_validators([request.get_full_path(), request.user.pk, digest] + timestamps, timestamps)
 
 
 class IndexPostListAPIView(ListAPIView):
     serializer_class = PostListSerializer
     # 序列化博客文章（Post）列表（通过 queryset 指定）
-    queryset = Post.objects.all()
+    queryset = project(
+        Post.objects.select_related("category", "author").prefetch_related("tags"),
+        PostListSerializer,
+    )
     pagination_class = PageNumberPagination
     # 允许任何人访问该资源（AllowAny 权限类不对任何访问做拦截，即允许任何人调用这个 API 以访问其资源）
     permission_classes = [AllowAny]
 
 
 class PostViewSet(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    VersionedPaginationMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
     """
     博客文章视图集
@@ -146,6 +234,9 @@ class PostViewSet(
     list_comments_all:
     返回博客文章下的评论列表，树状数据结构
 
+    list_threads:
+    按顶层评论分页返回评论，每条顶层评论带有回复数和最早的几条回复
+
     list_archive_dates:
     返回博客文章归档日期列表
 
@@ -160,24 +251,56 @@ class PostViewSet(
         "list": PostListSerializer,
         "retrieve": PostRetrieveSerializer,
     }
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, CounterOrderingFilter]
     filterset_class = PostFilter
     ordering_fields = ['comment_count', 'like_count', 'views']
+    ordering = ["-pub_time", "-id"]
+    # v1 以外的版本中文章列表和评论列表使用游标分页
+    cursor_pagination_classes = {
+        "list": PostCursorPagination,
+        "list_comments": CommentCursorPagination,
+    }
 
     def get_serializer_class(self):
         return self.serializer_class_table.get(
             self.action, super().get_serializer_class()
         )
 
-    # @cache_response(timeout=5 * 60, key_func=PostListKeyConstructor())
+    def get_queryset(self):
+        # 按 action 调整查询：序列化时用到的关联对象一次查出，只取序列化类用到的列，
+        # 另外游标分页要读取排序字段的值
+        queryset = super().get_queryset()
+        if self.action in ["list", "like", "retrieve"]:
+            queryset = queryset.select_related("category", "author").prefetch_related("tags")
+            return project(
+                queryset,
+                self.get_serializer_class(),
+                extra=[term.lstrip("-") for term in self.ordering],
+            )
+        if self.action in ["list_comments", "list_comments_all", "list_threads"]:
+            # 只需要确认文章存在
+            return queryset.only("id")
+        return queryset
+
+    # 缓存的数据依赖页面中的文章及其分类、标签，计数在返回前重新填入
+    @cached_response(
+        "post-list", post_list_tags, refresh=fill_list_counts, cacheable=not_ordered_by_counters, conditional=True
+    )
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    # @cache_response(timeout=5 * 60, key_func=PostObjectKeyConstructor())
+    # 客户端缓存的版本仍然有效时返回 304，同样累加阅读量
+    @cached_response(
+        "post-detail",
+        lambda view, data: post_tags(data),
+        refresh=count_view,
+        conditional=True,
+        on_not_modified=lambda view, data: view_counter.incr(data["id"]),
+    )
     def retrieve(self, request, *args, **kwargs):
-        # 重写retrieve方法，增加阅读量+1的操作
+        # 重写retrieve方法，增加阅读量+1的操作（在 count_view 中，命中缓存时也会执行）
         instance = self.get_object()
-        instance.increase_views()
+        prefetch_counts([instance])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -197,7 +320,6 @@ class PostViewSet(
         # <Response status_code=200, "text/html; charset=utf-8">
         return Response(data=data, status=status.HTTP_200_OK)
 
-    # @cache_response(timeout=5 * 60, key_func=CommentListKeyConstructor())
     @action(
         methods=["GET"],
         detail=True,
@@ -208,11 +330,14 @@ class PostViewSet(
         pagination_class=LimitOffsetPagination,
         serializer_class=CommentSerializer,
     )
+    @cached_response(
+        "post-comments", lambda view, data: ["post:%s" % view.kwargs["pk"], "comments:%s" % view.kwargs["pk"]]
+    )
     def list_comments(self, request, *args, **kwargs):
         # 根据 URL 传入的参数值（文章 id）获取到博客文章记录
         post = self.get_object()
         # 获取文章下关联的全部评论
-        queryset = post.comment_set.all().order_by("-created_time")
+        queryset = post.comment_set.all().order_by("-created_time", "-id")
         # 对评论列表进行分页，根据 URL 传入的参数获取指定页的评论
         page = self.paginate_queryset(queryset)
         # 序列化评论
@@ -220,7 +345,6 @@ class PostViewSet(
         # 返回分页后的评论列表
         return self.get_paginated_response(serializer.data)
 
-    # @cache_response(timeout=5 * 60, key_func=CommentListKeyConstructor())
     @action(
         methods=["GET"],
         detail=True,
@@ -232,14 +356,47 @@ class PostViewSet(
     def list_comments_all(self, request, *args, **kwargs):
         # 根据 URL 传入的参数值（文章 id）获取到博客文章记录
         post = self.get_object()
-        # 获取文章下关联的全部评论
-        queryset = post.comment_set.all().order_by("-created_time")
-        comments_list = list_to_tree(list(queryset.values()))
-        return Response(data=comments_list, status=status.HTTP_200_OK)
+        queryset = post.comment_set.all().order_by("-created_time", "-id")
+        # ?depth=k 只返回深度不超过 k 的评论（顶层评论深度为 0）
+        depth = request.query_params.get("depth")
+        if depth is not None:
+            if not depth.isdigit():
+                raise ValidationError({"depth": "深度必须是非负整数"})
+            queryset = queryset.max_depth(int(depth))
+        max_depth = getattr(settings, "THREAD_MAX_DEPTH", None)
+        if "limit" not in request.query_params:
+            # 获取文章下关联的全部评论
+            comments_list = build_tree(queryset.values(), max_depth=max_depth)
+            return Response(data=comments_list, status=status.HTTP_200_OK)
+
+        # 传入 ?limit=&offset= 时按顶层评论分页，再按物化路径一次查出这一页评论的全部回复
+        paginator = LimitOffsetPagination()
+        roots = paginator.paginate_queryset(queryset.roots().only("id", "path"), request, view=self)
+        comments_list = build_tree(queryset.subtrees(roots).values(), max_depth=max_depth)
+        return paginator.get_paginated_response(comments_list)
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        url_path="threads",
+        url_name="threads",
+        suffix="List",  # 将这个 action 返回的结果标记为列表，否则 drf-yasg 会根据 detail=True 将结果误判为单个对象
+        pagination_class=LimitOffsetPagination,
+        serializer_class=CommentThreadSerializer,
+    )
+    def list_threads(self, request, *args, **kwargs):
+        # 按顶层评论分页，每条顶层评论只带上最早的几条回复和回复总数，
+        # 其余回复通过 /comments/<id>/replies/ 接口分页加载
+        post = self.get_object()
+        queryset = post.comment_set.roots().order_by("-created_time", "-id")
+        page = self.paginate_queryset(queryset)
+        attach_first_replies(page, getattr(settings, "COMMENT_THREAD_REPLIES", 3))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(methods=['put'], detail=True)
     def like(self, request, pk):
-        post = get_object_or_404(Post, pk=pk)
+        post = self.get_object()
         post.increase_like_count()
         serializer = self.get_serializer(post)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
@@ -247,81 +404,42 @@ class PostViewSet(
     @action(methods=['get'], detail=False, url_path="archives",
             url_name="archives", )
     def list_archive(self, request, *args, **kwargs):
-        # 获取所有文章，找出最早的年份，构造年份数组，
-        result = []
-
-        # 1. 获取所有日期
-        dates = Post.objects.dates("created_time", "month", order="DESC")
-        date_field = DateField()
-        date_list = [date_field.to_representation(date)[:7] for date in dates]
-        # print(date_list)
-        # 2. 查出所有文章
-        post_list = Post.objects.all()
-        # print(len(post_list))
-
-        # 构造返回的数据结构
-        # reuslt = [{2019:[{title1:'',created_time1:''},{title2:'',created_time2:''}]},{}...{}]
-        for date in date_list:
-            result.append({date: []})
-        # 3. 遍历将所有文章对象分配到相对应的年份
-        for post in post_list:
-            time_str = post.created_time.strftime('%Y-%m')
-            for i in range(len(date_list)):
-                if date_list[i] == time_str:
-                    result[i][date_list[i]].append({'id': post.id, 'title': post.title,
-                                                    'created_time': post.created_time.strftime('%Y-%m-%d %H:%M:%S')})
-                    # 这里直接装post对象会报没序列化，直接返回相关字段好了
-        # 返回对象为list
-        return Response(data=result, status=status.HTTP_200_OK)
+        # 返回 [{"2020-08": [{"id": 1, "title": "", "created_time": ""}, ...]}, ...]，按月份倒序，
+        # 可以用 ?year=2020 只取某一年的归档
+        year = request.query_params.get("year")
+        if year is not None:
+            try:
+                year = int(year)
+            except ValueError:
+                raise ValidationError({"year": "年份必须是整数"})
+            if not MINYEAR <= year < MAXYEAR:
+                raise ValidationError({"year": "年份超出范围"})
+        return Response(data=get_archive(year), status=status.HTTP_200_OK)
+
+
+@memoize("blog.archive", timeout=24 * 60 * 60, stale_timeout=60, depends_on=["post_updated_at"])
+def get_archive(year=None):
+    """
+    文章归档，文章保存或删除后 post_updated_at 改变，缓存随之失效
+    """
+    return build_archive(year)
 
 
-index = PostViewSet.as_view({"get": "list"})
+def build_archive(year=None):
+    # 只查询归档需要的字段，并且已按创建时间倒序排列，遍历一次即可按月份分组
+    queryset = Post.objects.order_by("-created_time", "-id").values("id", "title", "created_time")
+    if year is not None:
+        start, end = date_range(year)
+        queryset = queryset.filter(created_time__gte=start, created_time__lt=end)
+    months = OrderedDict()
+    for post in queryset:
+        month = post["created_time"].strftime("%Y-%m")
+        post["created_time"] = post["created_time"].strftime("%Y-%m-%d %H:%M:%S")
+        months.setdefault(month, []).append(post)
+    return [{month: posts} for month, posts in months.items()]
 
 
-def list_to_tree(list):
-    tree = []
-    # 遍历第一次，把所有根节点筛选出来
-    for item in list[:]:
-        if not item["parent_id"]:
-            tree.append(item)
-            list.remove(item)
-    #     print(tree)
-    #     print(list)
-    # 继续遍历剩下的数据，找出子节点,直至list为空
-    while len(list) > 0:
-        for item in list[:]:
-            # dfs 递归遍历寻找所有节点和子节点
-            parent_node = find_parent(tree, item)
-            # 找到其父节点，插入到children中
-            # print('***')
-            # print(parent_node)
-            # 可能存在找完一趟根节点后，遍历到一个比如三级回复，而二级回复此时还没找完，那就先跳过，因为有while循环，跳过的最后还会再找
-            # 相当于把深层的子节点寻找其父节点的任务后置了
-            if parent_node is None:
-                continue
-            if 'children' not in parent_node.keys():
-                parent_node['children'] = []
-            parent_node['children'].append(item)
-
-            list.remove(item)
-    #         print(len(list))
-    return tree
-
-
-def find_parent(tree, item):
-    # print(tree)
-    # print('-----')
-    result = None
-    for p_item in tree:
-        # 递归结束标志，找到该点
-        # print(type(p_item),p_item)
-        if p_item.get('id') == item.get('parent_id'):
-            result = p_item
-        elif 'children' in p_item.keys():
-            result = find_parent(p_item['children'], item)
-
-        if result is not None:
-            return result
+index = PostViewSet.as_view({"get": "list"})
 
 
 def format_comments(comment_list):
@@ -380,8 +498,10 @@ class CategoryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     @action(methods=["GET"], detail=False, url_path='getCategoryAndCount', url_name='getCategoryAndCount',
             serializer_class=CategoryWithCountSerializer
             )
+    @cached_response("category-count", lambda view, data: ["category:list"])
     def get_category_and_count(self, request, *args, **kwargs):
-        category_list = Category.objects.annotate(num_posts=Count('post')).filter(num_posts__gt=0)
+        # num_posts 随文章的增删维护，单表查询即可
+        category_list = Category.objects.filter(num_posts__gt=0)
         serializer = self.get_serializer(instance=category_list, many=True)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -404,8 +524,9 @@ class TagViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     @action(methods=["GET"], detail=False, url_path='getTagsAndCount', url_name='getTagsAndCount',
             serializer_class=TagsWithCountSerializer
             )
+    @cached_response("tag-count", lambda view, data: ["tag:list"])
     def get_tags_and_count(self, request, *args, **kwargs):
-        tags_list = Tag.objects.annotate(num_posts=Count('post')).filter(num_posts__gt=0)
+        tags_list = Tag.objects.filter(num_posts__gt=0)
         serializer = self.get_serializer(instance=tags_list, many=True)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -486,12 +607,24 @@ class AboutViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Ge
     pagination_class = None
     queryset = About.objects.all()
 
+    @conditional(about_list_validators)
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.about_objects, many=True)
+        return Response(serializer.data)
+
+    @conditional(about_detail_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(
         methods=["GET"],
         detail=False,
     )
+    @conditional(about_info_validators)
     def about_info(self, request, *args, **kwargs):
-        data = About.objects.latest("created_time")
+        if not self.about_objects:
+            raise NotFound("还没有关于我的信息")
+        data = self.about_objects[0]
         serializer = self.get_serializer(instance=data)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -506,7 +639,7 @@ class TreeHoleViewSet(
     返回树洞列表
 
     list_treeholes_all
-    返回所有树洞数据，树状数据结构
+    返回树洞数据，树状数据结构，按月份分组（v1 以外的版本按月份分页）
 
     """
     queryset = TreeHole.objects.all()
@@ -523,27 +656,111 @@ class TreeHoleViewSet(
         serializer_class=TreeHoleSerializer,
     )
     def list_treeholes_all(self, request, *args, **kwargs):
-        result = []
-        treeholes_list = TreeHole.objects.all()
-        treeholes_formated_list = list_to_tree(list(treeholes_list.values()))
-        print(treeholes_formated_list)
-        # 再根据日期分类
-        # 1. 获取所有日期
-        dates = TreeHole.objects.dates("created_time", "month", order="DESC")
-        date_field = DateField()
-        date_list = [date_field.to_representation(date)[:7] for date in dates]
-        for date in date_list:
-            result.append({date: []})
-        print(result)
-
-        for obj in treeholes_formated_list:
-            print(obj)
-            time_str = obj['created_time'].strftime('%Y-%m')
-            for i in range(len(date_list)):
-                if date_list[i] == time_str:
-                    result[i][date_list[i]].append({'id': obj['id'], 'content': obj['content'], 'parent': obj['parent_id'],
-                                                    'created_time': obj['created_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                                                    'children':obj.get('children')
-                                                    })
-
-        return Response(data=result, status=status.HTTP_200_OK)
+        # 树洞按顶层树洞的创建月份分组。/api/v1/ 保持原来的格式，一次返回全部月份的 [{"2020-08": [...]}, ...]，
+        # 兼容旧的客户端；其它版本每次只返回一个月（或 ?months=N 个月）的树洞，
+        # 返回 {"results": [{"2020-08": [...]}, ...], "next": 更早月份的地址}；
+        # ?month=2020-08 返回指定月份，?before=2020-08 返回该月之前的月份
+        if request.version == "v1":
+            months = get_treehole_months()
+            feed = get_treehole_feed(months)
+            return Response(data=[{month: feed[month]} for month in months], status=status.HTTP_200_OK)
+
+        month = request.query_params.get("month")
+        next_url = None
+        if month is not None:
+            months = [parse_month(month, "month")]
+        else:
+            before = request.query_params.get("before")
+            if before is not None:
+                before = parse_month(before, "before")
+            count = request.query_params.get("months", "1")
+            if not count.isdigit() or not 1 <= int(count) <= 12:
+                raise ValidationError({"months": "月份数必须是 1 到 12 之间的整数"})
+            remaining = [m for m in get_treehole_months() if before is None or m < before]
+            months = remaining[: int(count)]
+            if len(remaining) > len(months):
+                next_url = replace_query_param(request.build_absolute_uri(), "before", months[-1])
+        feed = get_treehole_feed(months)
+        results = [{month: feed[month]} for month in months]
+        return Response(data={"results": results, "next": next_url}, status=status.HTTP_200_OK)
+
+
+def parse_month(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise ValidationError({name: "月份的格式必须是 YYYY-MM"})
+
+
+def month_range(month):
+    start = datetime.strptime(month, "%Y-%m")
+    return date_range(start.year, start.month)
+
+
+@memoize("blog.treehole_months", timeout=24 * 60 * 60, depends_on=["treehole_updated_at"])
+def get_treehole_months():
+    """
+    有树洞的月份，时间倒序，顶层树洞增删后缓存失效
+    """
+    dates = TreeHole.objects.roots().dates("created_time", "month", order="DESC")
+    return [date.strftime("%Y-%m") for date in dates]
+
+
+def get_treehole_feed(months):
+    """
+    返回 {月份: 该月的树洞树}，每个月单独缓存，月份内的树洞变化时只有这个月的缓存失效
+    """
+    keys = {
+        "treeholes:%s:%s" % (month, get_updated_at(treehole_month_key(month)).timestamp()): month
+        for month in months
+    }
+    feed = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+    missing = [month for month in months if month not in feed]
+    if missing:
+        built = build_treehole_feed(missing)
+        cache.set_many(
+            {key: built[month] for key, month in keys.items() if month in built},
+            timeout=24 * 60 * 60,
+        )
+        feed.update(built)
+    return feed
+
+
+def build_treehole_feed(months):
+    # 先按创建时间范围查出这几个月的顶层树洞，再按物化路径一次查出它们的全部回复
+    condition = Q(pk__in=[])
+    for month in months:
+        start, end = month_range(month)
+        condition |= Q(created_time__gte=start, created_time__lt=end)
+    roots = list(TreeHole.objects.roots().filter(condition).only("id", "path"))
+    nodes = (
+        TreeHole.objects.subtrees(roots)
+        .order_by("-created_time", "-id")
+        .values("id", "content", "parent_id", "created_time")
+    )
+    feed = {month: [] for month in months}
+    for obj in build_tree(nodes, max_depth=getattr(settings, "THREAD_MAX_DEPTH", None)):
+        feed[obj["created_time"].strftime("%Y-%m")].append(
+            {
+                "id": obj["id"],
+                "content": obj["content"],
+                "parent": obj["parent_id"],
+                "created_time": obj["created_time"].strftime("%Y-%m-%d %H:%M:%S"),
+                "children": obj.get("children"),
+            }
+        )
+    return feed
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    运行时指标视图集（仅管理员可访问）
+
+    list:
+    返回当前 worker 进程的缓存命中率等统计数据
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def list(self, request, *args, **kwargs):
+        return Response(data=metrics.collect(), status=status.HTTP_200_OK)
@@ -96,6 +96,25 @@ DATABASES = {
             'charset': 'utf8mb4'},
     }}
 
+# 两级缓存：进程内 LRU 缓存 + 各进程共享的缓存，见 blog/cache_backends.py
+# 开发和测试时共享缓存用 LocMemCache 代替，生产环境在 production.py 中改为 Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'blog.cache_backends.TwoTierCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'BACK': 'shared',
+            # 进程内缓存的容量（字节）和保留时间（秒）
+            'FRONT_MAX_BYTES': 16 * 1024 * 1024,
+            'FRONT_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -152,6 +171,32 @@ HAYSTACK_CUSTOM_HIGHLIGHTER = "blog.utils.Highlighter"
 # HAYSTACK_DEFAULT_OPERATOR = 'AND'
 # HAYSTACK_FUZZY_MIN_SIM = 0.1
 
+# Markdown 渲染结果缓存
+# 进程内 LRU 缓存的容量（字节），超过后淘汰最久未使用的渲染结果
+RENDER_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# 渲染结果在 Django 缓存中的过期时间（秒）
+RENDER_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+# 代码块高亮结果的进程内 LRU 缓存容量（字节）
+HIGHLIGHT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# 增量渲染时按块缓存渲染结果的进程内 LRU 缓存容量（字节）
+RENDER_BLOCK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# 阅读量先累加在缓存中，每隔多少秒批量写回数据库一次，0 表示只由 flush_views 命令写回
+VIEW_COUNT_FLUSH_INTERVAL = 30
+# 每篇文章的计数分片数，以及各分片之和的缓存时间（秒）
+POST_COUNTER_SHARDS = 8
+POST_COUNTER_CACHE_TIMEOUT = 60
+# 侧边栏片段（最新文章、归档、分类、标签）渲染结果的缓存时间（秒），文章、分类或标签变化时立即失效
+SIDEBAR_CACHE_TIMEOUT = 24 * 60 * 60
+# 文章列表、详情、评论列表和分类、标签计数接口响应的缓存时间（秒），依赖的对象变化时立即失效
+API_CACHE_TIMEOUT = 5 * 60
+
+# 评论和树洞组装成树时的最大深度，更深的回复挂到该深度的同一层，至少为 2，None 表示不限制
+THREAD_MAX_DEPTH = 32
+# 文章详情页渲染的顶层评论数，以及每条顶层评论附带的回复数（接口中也使用）
+COMMENT_THREAD_ROOTS = 20
+COMMENT_THREAD_REPLIES = 3
+
 # django-rest-framework
 # ------------------------------------------------------------------------------
 REST_FRAMEWORK = {
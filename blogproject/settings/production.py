@@ -12,15 +12,16 @@ ALLOWED_HOSTS = [
 ]
 HAYSTACK_CONNECTIONS["default"]["URL"] = "http://elasticsearch:9200/"
 
-# CACHES = {
-#     "default": {
-#         "BACKEND": "redis_cache.RedisCache",
-#         "LOCATION": "redis://:UJaoRZlNrH40BDaWU6fi@redis:6379/0",
-#         "OPTIONS": {
-#             "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
-#             "CONNECTION_POOL_CLASS_KWARGS": {"max_connections": 50, "timeout": 20},
-#             "MAX_CONNECTIONS": 1000,
-#             "PICKLE_VERSION": -1,
-#         },
-#     },
-# }
+# 两级缓存中各进程共享的一级。gunicorn 有多个工作进程，必须使用 Redis，
+# 否则标签的更新时间、待写回的阅读量、锁等只对当前进程可见
+# 地址从环境变量读取，例如 redis://:<密码>@redis:6379/0
+CACHES["shared"] = {
+    "BACKEND": "redis_cache.RedisCache",
+    "LOCATION": os.environ["REDIS_URL"],
+    "OPTIONS": {
+        "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
+        "CONNECTION_POOL_CLASS_KWARGS": {"max_connections": 50, "timeout": 20},
+        "MAX_CONNECTIONS": 1000,
+        "PICKLE_VERSION": -1,
+    },
+}
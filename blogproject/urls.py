@@ -38,6 +38,7 @@ router.register(
     r"api-version", blog.views.ApiVersionTestViewSet, basename="api-version"
 )
 router.register(r"about", blog.views.AboutViewSet, basename="about")
+router.register(r"metrics", blog.views.MetricsViewSet, basename="metrics")
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-17 03:13
+
+from django.db import migrations, models
+
+from blog.threads import backfill_paths
+
+
+def backfill_comment_paths(apps, schema_editor):
+    backfill_paths(apps.get_model("comments", "Comment"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0005_auto_20210617_1117'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='深度'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=180, verbose_name='路径'),
+        ),
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
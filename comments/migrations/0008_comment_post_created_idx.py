@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-17 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0007_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_time'], name='comment_post_created_idx'),
+        ),
+    ]
@@ -1,12 +1,12 @@
-from datetime import datetime
-
-from django.core.cache import cache
 from django.db import models
 from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 
+from blog.response_cache import response_cache
+from blog.threads import ThreadedModel, decrease_reply_count
+
 
-class Comment(models.Model):
+class Comment(ThreadedModel):
     name = models.CharField("名字", max_length=50)
     email = models.EmailField("邮箱")
     url = models.URLField("网址", blank=True)
@@ -23,6 +23,9 @@ class Comment(models.Model):
         verbose_name = "评论"
         verbose_name_plural = verbose_name
         ordering = ["-created_time"]
+        indexes = [
+            models.Index(fields=["post", "created_time"], name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return "{}: {}".format(self.name, self.content[:20])
@@ -36,9 +39,10 @@ class Comment(models.Model):
         self.save(update_fields=["dislike_count"])
 
 
-def change_comment_updated_at(sender=None, instance=None, *args, **kwargs):
-    cache.set("comment_updated_at", datetime.utcnow())
+def invalidate_comment_responses(sender=None, instance=None, *args, **kwargs):
+    response_cache.invalidate("comments:%s" % instance.post_id)
 
 
-post_save.connect(receiver=change_comment_updated_at, sender=Comment)
-post_delete.connect(receiver=change_comment_updated_at, sender=Comment)
+post_save.connect(receiver=invalidate_comment_responses, sender=Comment)
+post_delete.connect(receiver=invalidate_comment_responses, sender=Comment)
+post_delete.connect(receiver=decrease_reply_count, sender=Comment)
@@ -19,6 +19,18 @@ class CommentSerializer(serializers.ModelSerializer):
             "post",
             "parent",
             "like_count",
-            "dislike_count"
+            "dislike_count",
+            "reply_count",
         ]
         extra_kwargs = {"post": {"write_only": True}}
+
+
+class CommentThreadSerializer(CommentSerializer):
+    """
+    顶层评论及其前几条回复，其余回复通过 replies 接口分页加载
+    """
+
+    replies = CommentSerializer(source="first_replies", many=True, read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ["replies"]
@@ -1,4 +1,8 @@
 from django import template
+from django.conf import settings
+
+from blog.threads import attach_first_replies
+
 from ..forms import CommentForm
 
 register = template.Library()
@@ -16,8 +20,14 @@ def show_comment_form(context, post, form=None):
 
 @register.inclusion_tag('comments/inclusions/_list.html', takes_context=True)
 def show_comments(context, post):
-    comment_list = post.comment_set.all()
-    comment_count = comment_list.count()
+    # 只渲染最新的一部分顶层评论，每条带上最早的几条回复，评论很多时页面大小也是有上限的
+    comment_count = post.comment_set.count()
+    comment_list = list(
+        post.comment_set.roots().order_by("-created_time", "-id")[
+            : getattr(settings, "COMMENT_THREAD_ROOTS", 20)
+        ]
+    )
+    attach_first_replies(comment_list, getattr(settings, "COMMENT_THREAD_REPLIES", 3))
     return {
         'comment_count': comment_count,
         'comment_list': comment_list,
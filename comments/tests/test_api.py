@@ -47,3 +47,38 @@ class CommentViewSetTestCase(APITestCase):
         response = self.client.post(self.url, invalid_data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(Comment.objects.count(), 0)
+
+
+class CommentRepliesTestCase(APITestCase):
+    def setUp(self):
+        apps.get_app_config("haystack").signal_processor.teardown()
+        user = User.objects.create_superuser(
+            username="admin", email="admin@hellogithub.com", password="admin"
+        )
+        cate = Category.objects.create(name="测试")
+        post = Post.objects.create(title="测试标题", body="测试内容", category=cate, author=user)
+        self.root = Comment.objects.create(name="评论者", email="a@a.com", content="评论", post=post)
+        self.replies = []
+        parent = self.root
+        for i in range(5):
+            # 一半是对顶层评论的回复，一半是对回复的回复
+            parent = self.root if i % 2 else parent
+            parent = Comment.objects.create(
+                name="评论者", email="a@a.com", content="回复%d" % i, post=post, parent=parent
+            )
+            self.replies.append(parent)
+
+    def test_list_replies_with_cursor(self):
+        url = reverse("v1:comment-replies", kwargs={"pk": self.root.pk})
+        response = self.client.get(url, {"page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [reply["id"] for reply in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            ids.extend(reply["id"] for reply in response.data["results"])
+        self.assertEqual(ids, [reply.pk for reply in self.replies])
+
+    def test_list_replies_of_nonexistent_comment(self):
+        url = reverse("v1:comment-replies", kwargs={"pk": 9999})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,3 +1,18 @@
+from unittest import mock
+
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.db.models.signals import post_delete
+
+from blog.threads import (
+    PATH_MAX_LENGTH,
+    PATH_STEP,
+    attach_first_replies,
+    backfill_paths,
+    backfill_reply_counts,
+    encode_segment,
+)
+
 from .base import CommentDataTestCase
 from ..models import Comment
 
@@ -11,3 +26,101 @@ class CommentModelTestCase(CommentDataTestCase):
 
     def test_str_representation(self):
         self.assertEqual(self.comment.__str__(), "评论者: 评论内容")
+
+
+class CommentPathTestCase(CommentDataTestCase):
+    def reply(self, parent=None):
+        return Comment.objects.create(
+            name="评论者", email="a@a.com", content="评论内容", post=self.post, parent=parent,
+        )
+
+    def test_path_and_depth(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.assertEqual(root.depth, 0)
+        self.assertEqual(grandchild.depth, 2)
+        self.assertEqual(
+            grandchild.path,
+            encode_segment(root.pk) + encode_segment(child.pk) + encode_segment(grandchild.pk),
+        )
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.path[:PATH_STEP * 2], child.path)
+
+    def test_thread_queries(self):
+        root1 = self.reply()
+        child1 = self.reply(root1)
+        grandchild1 = self.reply(child1)
+        root2 = self.reply()
+        child2 = self.reply(root2)
+        self.assertEqual(set(Comment.objects.roots()), {root1, root2})
+        self.assertEqual(set(Comment.objects.subtree(root1)), {root1, child1, grandchild1})
+        self.assertEqual(set(Comment.objects.subtree(child1, include_self=False)), {grandchild1})
+        self.assertEqual(set(Comment.objects.subtrees([child1, root2])), {child1, grandchild1, root2, child2})
+        self.assertEqual(set(Comment.objects.subtrees([])), set())
+        self.assertEqual(set(Comment.objects.max_depth(1)), {root1, child1, root2, child2})
+
+    def test_path_depth_is_limited(self):
+        comment = None
+        for _ in range(PATH_MAX_LENGTH // PATH_STEP + 2):
+            comment = self.reply(comment)
+        self.assertEqual(len(comment.path), PATH_MAX_LENGTH)
+        self.assertEqual(comment.depth, PATH_MAX_LENGTH // PATH_STEP - 1)
+
+    def test_backfill_paths(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        Comment.objects.update(path="", depth=0)
+        backfill_paths(Comment)
+        for comment in (root, child, grandchild):
+            saved = Comment.objects.get(pk=comment.pk)
+            self.assertEqual((saved.path, saved.depth), (comment.path, comment.depth))
+
+    def test_reply_count(self):
+        root = self.reply()
+        child = self.reply(root)
+        self.reply(child)
+        other = self.reply(root)
+        root.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((root.reply_count, child.reply_count, other.reply_count), (3, 1, 0))
+
+        # 删除 child 时级联删除了它的回复
+        child.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+
+        Comment.objects.update(reply_count=0)
+        backfill_reply_counts(Comment)
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+
+    def test_reply_count_receiver_senders(self):
+        # 回复数的信号只连接到树形模型，其它模型删除时仍可使用 Django 的快速删除
+        self.assertTrue(post_delete.has_listeners(Comment))
+        self.assertFalse(post_delete.has_listeners(Permission))
+
+    def test_attach_first_replies(self):
+        root = self.reply()
+        replies = [self.reply(root) for _ in range(3)]
+        other = self.reply()
+        other_replies = [self.reply(other), self.reply(self.reply(other))]
+        small = self.reply()
+        small_reply = self.reply(self.reply(small))
+        lonely = self.reply()
+        for node in [root, other, small]:
+            node.refresh_from_db()
+        # 回复较少的节点合并成一次查询，回复多的节点也合并成一次查询，没有回复的不查询
+        with self.assertNumQueries(2):
+            attach_first_replies([root, other, small, lonely], 2)
+        self.assertEqual(root.first_replies, replies[:2])
+        self.assertEqual(other.first_replies, [other_replies[0], other_replies[1].parent])
+        self.assertEqual(small.first_replies, [small_reply.parent, small_reply])
+        self.assertEqual(lonely.first_replies, [])
+
+        # 不支持窗口函数的数据库得到同样的结果
+        with mock.patch.object(connection.features, "supports_over_clause", False):
+            attach_first_replies([root, other], 2)
+        self.assertEqual(root.first_replies, replies[:2])
+        self.assertEqual(other.first_replies, [other_replies[0], other_replies[1].parent])
@@ -6,6 +6,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from blog.models import Post
+from blog.pagination import KeysetPagination
 
 from .forms import CommentForm
 from .models import Comment
@@ -55,12 +56,21 @@ def comment(request, post_pk):
     return render(request, "comments/preview.html", context=context)
 
 
+class ReplyCursorPagination(KeysetPagination):
+    # 按时间顺序加载回复，新增回复不会导致翻页时重复或遗漏
+    ordering = ("created_time", "id")
+    page_size = 10
+
+
 class CommentViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     """
     博客评论视图集
 
     create:
     创建博客评论
+
+    list_replies:
+    按时间顺序分页返回评论下的全部回复（游标分页）
     """
 
     serializer_class = CommentSerializer
@@ -100,3 +110,18 @@ class CommentViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
         comment.increase_dislike_count()
         serializer = self.get_serializer(comment)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        url_path="replies",
+        url_name="replies",
+        suffix="List",
+        pagination_class=ReplyCursorPagination,
+    )
+    def list_replies(self, request, pk):
+        comment = get_object_or_404(Comment.objects.only("id", "path"), pk=pk)
+        queryset = Comment.objects.subtree(comment, include_self=False)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
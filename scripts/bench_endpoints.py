@@ -0,0 +1,421 @@
+"""
+接口性能回归基准：在独立的测试数据库中生成大量数据，逐个请求全部接口和页面（依赖 Elasticsearch 的搜索除外），
+记录每个接口的查询次数、耗时（p50/p95）和内存分配峰值，并与基准文件对比。
+
+    $ python -m scripts.bench_endpoints                    # 与基准对比，有回归或无法对比时以非 0 状态退出
+    $ python -m scripts.bench_endpoints --update-baseline  # 把本次结果写入基准文件
+    $ python -m scripts.bench_endpoints --posts 500 --comments 20000  # 小规模快速运行
+
+数据写入的是 Django 测试数据库（test_ 前缀），不会影响开发数据库中的数据。
+每个接口分别测量缓存为空（cold）和缓存已预热（warm）两种情况，否则响应缓存命中后查询次数为 0，
+看不出查询的回归。查询次数只要增加就算回归；耗时和内存超过基准的 (1 + threshold) 倍才算回归。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+
+back = os.path.dirname
+BASE_DIR = back(back(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "scripts", "bench_baseline.json")
+
+# 耗时低于该值（毫秒）的差异视为噪声，不算回归
+LATENCY_NOISE_MS = 2.0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def seed(args):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from blog.counters import reconcile_num_posts
+    from blog.models import About, Category, Post, PostCounter, Tag, TreeHole
+    from blog.rendering import generate_rich_content
+    from blog.threads import backfill_reply_counts, child_path
+    from comments.models import Comment
+
+    rng = random.Random(args.seed)
+    now = timezone.now()
+    user = User.objects.create_superuser("admin", "admin@hellogithub.com", "admin")
+    categories = [Category.objects.create(name="分类%d" % i) for i in range(10)]
+    tags = [Tag.objects.create(name="标签%d" % i) for i in range(30)]
+    About.objects.create(body="# 关于我\n\n" + "正文。" * 100)
+
+    # 直接 bulk_create，不走 Post.save，正文只渲染一次
+    body = "# 标题\n\n" + "正文 **粗体** [链接](https://www.zmrenwu.com)。\n\n" * 20
+    rich_content = generate_rich_content(body)
+    print("create %d posts" % args.posts)
+    Post.objects.bulk_create(
+        [
+            Post(
+                id=i,
+                title="测试标题%d" % i,
+                body=body,
+                body_html=rich_content["content"],
+                toc=rich_content["toc"],
+                excerpt=rich_content["excerpt"],
+                category=rng.choice(categories),
+                author=user,
+                created_time=now - timedelta(days=rng.randint(0, 730)),
+                pub_time=now - timedelta(days=rng.randint(0, 730)),
+            )
+            for i in range(1, args.posts + 1)
+        ],
+        batch_size=1000,
+    )
+    Through = Post.tags.through
+    Through.objects.bulk_create(
+        [
+            Through(post_id=i, tag_id=tag.id)
+            for i in range(1, args.posts + 1)
+            for tag in rng.sample(tags, 3)
+        ],
+        batch_size=5000,
+    )
+    PostCounter.objects.bulk_create(
+        [
+            PostCounter(post_id=i, shard=0, views=rng.randint(0, 10000), like_count=rng.randint(0, 100))
+            for i in range(1, args.posts + 1)
+        ],
+        batch_size=5000,
+    )
+
+    # 每篇文章的评论中，每 depth 条组成一个嵌套回复链，用来模拟很深的评论树
+    print("create %d comments" % args.comments)
+    per_post = max(1, args.comments // args.posts)
+    batch = []
+    comment_id = 0
+    path = ""
+    for post_id in range(1, args.posts + 1):
+        for i in range(per_post):
+            comment_id += 1
+            path, depth = child_path(path if i % args.depth else "", comment_id)
+            batch.append(
+                Comment(
+                    id=comment_id,
+                    name="评论者",
+                    email="a@b.com",
+                    content="评论%d" % comment_id,
+                    post_id=post_id,
+                    parent_id=comment_id - 1 if i % args.depth else None,
+                    path=path,
+                    depth=depth,
+                    created_time=now - timedelta(minutes=comment_id),
+                )
+            )
+            if len(batch) >= 5000:
+                Comment.objects.bulk_create(batch)
+                batch = []
+    Comment.objects.bulk_create(batch)
+
+    print("create %d treeholes" % args.treeholes)
+    treeholes = []
+    path = ""
+    for i in range(1, args.treeholes + 1):
+        path, depth = child_path(path if (i - 1) % args.depth else "", i)
+        treeholes.append(
+            TreeHole(
+                id=i,
+                content="树洞%d" % i,
+                parent_id=i - 1 if (i - 1) % args.depth else None,
+                path=path,
+                depth=depth,
+                created_time=now - timedelta(hours=i),
+            )
+        )
+    TreeHole.objects.bulk_create(treeholes, batch_size=5000)
+
+    # bulk_create 不会维护分类、标签的文章数和评论、树洞的回复数，按迁移中的做法补上，
+    # 否则计数接口和侧边栏面对的都是 0，评论列表也走不到回复很多的分支
+    print("backfill num_posts and reply_count")
+    for model in (Category, Tag):
+        reconcile_num_posts(model)
+    for model in (Comment, TreeHole):
+        backfill_reply_counts(model)
+    return user
+
+
+def endpoints(args):
+    """
+    返回 (名称, 请求方法, URL, 是否需要登录, 请求数据)
+    """
+    from django.urls import reverse
+
+    from blog.models import About, Category, Tag
+
+    post_id = args.posts // 2
+    # 与 seed 中的规则一致：每篇文章的第一条评论是顶层评论
+    root_comment_id = (post_id - 1) * max(1, args.comments // args.posts) + 1
+    category_id = Category.objects.values_list("id", flat=True).first()
+    tag_id = Tag.objects.values_list("id", flat=True).first()
+    about_id = About.objects.values_list("id", flat=True).first()
+    api = [
+        ("post-list", "get", {}),
+        ("post-detail", "get", {"pk": post_id}),
+        ("post-comment", "get", {"pk": post_id}),
+        ("post-allcomments", "get", {"pk": post_id}),
+        ("post-threads", "get", {"pk": post_id}),
+        ("comment-replies", "get", {"pk": root_comment_id}),
+        ("comment-like", "put", {"pk": root_comment_id}),
+        ("comment-dislike", "put", {"pk": root_comment_id}),
+        ("post-archive-date", "get", {}),
+        ("post-archives", "get", {}),
+        ("post-like", "put", {"pk": post_id}),
+        ("category-list", "get", {}),
+        ("category-getCategoryAndCount", "get", {}),
+        ("tag-list", "get", {}),
+        ("tag-getTagsAndCount", "get", {}),
+        ("treeholes-list", "get", {}),
+        ("treeholes-alltreeholes", "get", {}),
+        ("about-list", "get", {}),
+        ("about-detail", "get", {"pk": about_id}),
+        ("about-about-info", "get", {}),
+        ("api-version-test", "get", {}),
+        ("metrics-list", "get", {}),
+        ("api-root", "get", {}),
+        # 搜索接口（search-list 和 /search/ 页面）依赖 Elasticsearch，不在基准范围内
+    ]
+    result = [
+        ("api " + name, method, reverse("v1:" + name, kwargs=kwargs or None), name == "metrics-list", None)
+        for name, method, kwargs in api
+    ]
+    result.append(
+        ("api post-list?ordering=-views", "get", reverse("v1:post-list") + "?ordering=-views", False, None)
+    )
+    result.append(
+        (
+            "api post-allcomments?limit=10",
+            "get",
+            reverse("v1:post-allcomments", kwargs={"pk": post_id}) + "?limit=10",
+            False,
+            None,
+        )
+    )
+    # v2 中文章列表和评论列表使用游标分页，树洞可以一次取多个月
+    result.append(("api v2 post-list", "get", reverse("v2:post-list"), False, None))
+    result.append(("api v2 post-comment", "get", reverse("v2:post-comment", kwargs={"pk": post_id}), False, None))
+    result.append(
+        (
+            "api v2 treeholes-alltreeholes?months=3",
+            "get",
+            reverse("v2:treeholes-alltreeholes") + "?months=3",
+            False,
+            None,
+        )
+    )
+    result.append(
+        (
+            "api comment-create",
+            "post",
+            reverse("v1:comment-list"),
+            False,
+            {"name": "评论者", "email": "a@b.com", "content": "基准评论", "post": post_id},
+        )
+    )
+    result.append(("api treeholes-create", "post", reverse("v1:treeholes-list"), False, {"content": "基准树洞"}))
+    html = [
+        ("blog:index", {}),
+        ("blog:detail", {"pk": post_id}),
+        ("blog:category", {"pk": category_id}),
+        ("blog:tag", {"pk": tag_id}),
+        ("blog:archive", {"year": 2020, "month": 1}),
+        ("rss", {}),
+    ]
+    result.extend(
+        ("html " + name, "get", reverse(name, kwargs=kwargs or None), False, None) for name, kwargs in html
+    )
+    return result
+
+
+def measure(client, method, url, data, repeat):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    def request():
+        response = getattr(client, method)(url, data)
+        if response.status_code >= 400:
+            raise RuntimeError("%s %s -> %d" % (method.upper(), url, response.status_code))
+        return response
+
+    def count_queries():
+        # queries_log 有长度上限，先清空，否则日志写满后计数不再增长
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        # 下一次请求开始时会清空 queries_log，需要立即取出查询次数
+        return len(queries)
+
+    def timings(cold):
+        values = []
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            start = time.perf_counter()
+            request()
+            values.append((time.perf_counter() - start) * 1000)
+        return values
+
+    # 先请求一次，让连接、模板等进程级的初始化不计入测量
+    request()
+
+    cache.clear()
+    cold_queries = count_queries()
+    warm_queries = count_queries()
+
+    cache.clear()
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cold = timings(cold=True)
+    warm = timings(cold=False)
+    return {
+        "queries": cold_queries,
+        "warm_queries": warm_queries,
+        "p50_ms": round(percentile(cold, 50), 3),
+        "p95_ms": round(percentile(cold, 95), 3),
+        "warm_p50_ms": round(percentile(warm, 50), 3),
+        "warm_p95_ms": round(percentile(warm, 95), 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results["endpoints"].items():
+        if "error" in current:
+            regressions.append("%s: %s" % (name, current["error"]))
+            continue
+        previous = baseline["endpoints"].get(name)
+        if previous is None or "error" in previous:
+            continue
+        for key in ["queries", "warm_queries"]:
+            if key in previous and current[key] > previous[key]:
+                regressions.append("%s: %s %d -> %d" % (name, key, previous[key], current[key]))
+        for key in ["p95_ms", "warm_p95_ms"]:
+            if (
+                key in previous
+                and current[key] > previous[key] * (1 + threshold)
+                and current[key] - previous[key] > LATENCY_NOISE_MS
+            ):
+                regressions.append("%s: %s %.1fms -> %.1fms" % (name, key, previous[key], current[key]))
+        if current["peak_kib"] > previous["peak_kib"] * (1 + threshold):
+            regressions.append(
+                "%s: peak memory %.1fKiB -> %.1fKiB"
+                % (name, previous["peak_kib"], current["peak_kib"])
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=10000, help="文章数量")
+    parser.add_argument("--comments", type=int, default=500000, help="评论数量")
+    parser.add_argument("--treeholes", type=int, default=2000, help="树洞数量")
+    parser.add_argument("--depth", type=int, default=25, help="嵌套回复链的深度")
+    parser.add_argument("--repeat", type=int, default=20, help="每个接口计时的请求次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准文件路径")
+    parser.add_argument("--update-baseline", action="store_true", help="把本次结果写入基准文件")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="耗时和内存允许超出基准的比例"
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "blogproject.settings.local")
+    django.setup()
+
+    from django.apps import apps
+    from django.test import Client, override_settings
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+    apps.get_app_config("haystack").signal_processor.teardown()
+    # 关闭 DEBUG，与线上一样不记录每条 SQL，计时和内存更接近真实情况
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity=1, interactive=False)
+    try:
+        # 基准运行期间不启动阅读量写回定时器，避免后台写库干扰计时
+        with override_settings(VIEW_COUNT_FLUSH_INTERVAL=0):
+            user = seed(args)
+            client = Client()
+            admin_client = Client()
+            admin_client.force_login(user)
+
+            results = {
+                "dataset": {
+                    "posts": args.posts,
+                    "comments": args.comments,
+                    "treeholes": args.treeholes,
+                    "depth": args.depth,
+                },
+                "endpoints": {},
+            }
+            for name, method, url, login, data in endpoints(args):
+                try:
+                    stats = measure(admin_client if login else client, method, url, data, args.repeat)
+                except Exception as e:
+                    # 出错的接口记录下来，对比时算作回归，其它接口继续测量
+                    results["endpoints"][name] = {"error": repr(e)}
+                    print("%-44s error: %r" % (name, e))
+                    continue
+                results["endpoints"][name] = stats
+                print(
+                    "%-44s %4d/%-4d queries  p95 %8.2fms/%8.2fms  peak %9.1fKiB"
+                    % (
+                        name,
+                        stats["queries"],
+                        stats["warm_queries"],
+                        stats["p95_ms"],
+                        stats["warm_p95_ms"],
+                        stats["peak_kib"],
+                    )
+                )
+    finally:
+        teardown_databases(old_config, verbosity=1)
+        teardown_test_environment()
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print("baseline written to %s" % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at %s, run with --update-baseline first" % args.baseline)
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("dataset") != results["dataset"]:
+        print(
+            "baseline was recorded with a different dataset %s, run with the same options or --update-baseline"
+            % baseline.get("dataset")
+        )
+        return 1
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("regressions:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print("no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Markdown 渲染微基准：对比每次新建 Markdown 实例与复用线程内实例池的耗时
+
+    $ python -m scripts.bench_markdown [-n 200]
+"""
+import argparse
+import os
+import pathlib
+import sys
+import timeit
+
+import django
+
+back = os.path.dirname
+BASE_DIR = back(back(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=200, help="每项测试的执行次数")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "blogproject.settings.local")
+    django.setup()
+
+    from blog.rendering import build_markdown, pooled_markdown, render_markdown
+
+    sample = pathlib.Path(BASE_DIR).joinpath("scripts", "md.sample").read_text(encoding="utf-8")
+    short = "# 标题\n\n一段很短的正文。"
+
+    def fresh(text):
+        return build_markdown().convert(text)
+
+    def pooled(text):
+        with pooled_markdown() as md:
+            return md.convert(text)
+
+    # 预热：导入扩展模块、加载 Pygments 词法分析器，并在池中放入一个实例
+    fresh(sample)
+    pooled(sample)
+
+    def report(name, func):
+        seconds = timeit.timeit(func, number=args.number)
+        print("%-36s %8.3f ms/op" % (name, seconds / args.number * 1000))
+
+    print("number=%d" % args.number)
+    report("construct only", build_markdown)
+    report("short body, new instance", lambda: fresh(short))
+    report("short body, pooled instance", lambda: pooled(short))
+    report("md.sample, new instance", lambda: fresh(sample))
+    report("md.sample, pooled instance", lambda: pooled(sample))
+    report("md.sample, render_markdown", lambda: render_markdown(sample))
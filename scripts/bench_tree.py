@@ -0,0 +1,98 @@
+"""
+评论树组装基准：对比按 id 建索引的 build_tree 与原来的 list_to_tree 在不同规模、不同形状的数据上的耗时
+
+    $ python -m scripts.bench_tree [--sizes 1000 10000 100000] [--legacy-limit 2000]
+
+原实现的耗时随节点数平方甚至立方增长，只在节点数不超过 --legacy-limit 时运行。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import django
+
+back = os.path.dirname
+BASE_DIR = back(back(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+
+def list_to_tree(list):
+    # 原 blog.views.list_to_tree 的实现，仅用于对比
+    tree = []
+    for item in list[:]:
+        if not item["parent_id"]:
+            tree.append(item)
+            list.remove(item)
+    while len(list) > 0:
+        for item in list[:]:
+            parent_node = find_parent(tree, item)
+            if parent_node is None:
+                continue
+            if "children" not in parent_node.keys():
+                parent_node["children"] = []
+            parent_node["children"].append(item)
+            list.remove(item)
+    return tree
+
+
+def find_parent(tree, item):
+    result = None
+    for p_item in tree:
+        if p_item.get("id") == item.get("parent_id"):
+            result = p_item
+        elif "children" in p_item.keys():
+            result = find_parent(p_item["children"], item)
+        if result is not None:
+            return result
+
+
+def make_nodes(shape, size, rng):
+    """
+    flat：每 100 个节点一个根，其余都直接回复根
+    chain：每 25 个节点组成一条嵌套回复链
+    random：每个节点随机回复之前的某个节点（或作为根）
+    节点按 id 倒序排列，与接口按创建时间倒序查询的顺序一致，子节点总是出现在父节点之前
+    """
+    nodes = []
+    for i in range(1, size + 1):
+        if shape == "flat":
+            parent_id = None if i % 100 == 1 else i - (i - 1) % 100
+        elif shape == "chain":
+            parent_id = None if i % 25 == 1 else i - 1
+        else:
+            parent_id = rng.randint(0, i - 1) or None
+        nodes.append({"id": i, "parent_id": parent_id})
+    nodes.reverse()
+    return nodes
+
+
+def timed(func, nodes):
+    nodes = [dict(node) for node in nodes]
+    start = time.perf_counter()
+    func(nodes)
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="节点数量")
+    parser.add_argument("--legacy-limit", type=int, default=2000, help="原实现只在节点数不超过该值时运行")
+    parser.add_argument("--max-depth", type=int, default=None, help="传给 build_tree 的最大深度")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "blogproject.settings.local")
+    django.setup()
+
+    from blog.utils import build_tree
+
+    rng = random.Random(args.seed)
+    print("%-8s %8s %14s %14s" % ("shape", "nodes", "build_tree", "list_to_tree"))
+    for shape in ("flat", "chain", "random"):
+        for size in sorted(set(args.sizes)):
+            nodes = make_nodes(shape, size, rng)
+            new = timed(lambda items: build_tree(items, max_depth=args.max_depth), nodes)
+            old = "%12.2fms" % timed(list_to_tree, nodes) if size <= args.legacy_limit else "skipped"
+            print("%-8s %8d %12.2fms %14s" % (shape, size, new, old))